@@ -6,44 +6,45 @@ import tkMessageBox as tkmsg
 import tkFileDialog as tkfile
 
 import sys
-import re
 import os.path
-import shlex
 import time
+import math
 import getpass
 import subprocess
 import signal
 import logging
 import json
-
-from threading import Timer
+import functools
+import threading
+import Queue
+import collections
 
 import mayaJob
+import jobEngine
+from renderQueue import RenderQueue
+from sequenceJob import SequenceJob, resumeJob
+from sessionPool import SessionPool
+from jobSupervisor import SessionSupervisor, JobPreparer
+from transferManager import TransferManager, FrameCollector, frameNumber, frameMatch
+from stallWatchdog import StallWatchdog
+from jobStore import JobStore
+from workspace import Workspace
 
 """
 Not the most readable code in places, but it works for what it is.
 
 PROBLEMS (just in the GUI component, mayaJob has it's own problems) : 
-  - Windows paths ('D:\images') won't be read from the workspace file properly, should add in a check for this but not a huge problem yet
+  - Windows paths ('D:\images') in the workspace file are only found if their drive is in DRIVE_MAP, otherwise they're taken from the project root
   - Lowering update rate when the screensaver is active only works on Gnome (Red Hat uses Gnome so not a problem at uni)
   - SSH keys _must_ be setup for all the hosts for this to work properly.
 """
 
-def secureCopy(host, src, dst, logger=None, limit=8912):
-    # Escape spaces
-    src = src.replace(' ', r'\ ')
-    dst = dst.replace(' ', r'\ ')
-
-    command = 'scp -C -B -l %d %s:\"%s\" \"%s\"' % (limit, host, src, dst)
-    try:
-        scp = subprocess.Popen(command, shell=True).wait()
-    except OSError, e:
-        if logger:
-            logger.error('Command error : %s ' % command)
-            logger.error(e)
-        else:
-            print command
-            print e
+def formatSize(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024.0:
+            return '%.1f%s' % (size, unit)
+        size /= 1024.0
+    return '%.1fTB' % size
 
 def displayError(type_, msg, logger=None):
     output = 'Error %s : %s' % (type_, msg)
@@ -54,17 +55,245 @@ def displayError(type_, msg, logger=None):
 
     tkmsg.showinfo(type_, msg)
 
+# How long a host gets to answer verifyHost once connected, before its ssh is killed
+VERIFY_TIMEOUT = 10
+
 def verifyHost(host, timeout=1):
     """
-    Will fail if the host is not accessible 
+    Will fail if the host is not accessible, or doesn't answer in time
     """
-    print "Verifying host %s" % host
-    result = subprocess.Popen(['ssh', '-o', 'ConnectTimeout=%d' % timeout, host, 'hostname'], 
-                                stdout=subprocess.PIPE, 
-                                stderr=subprocess.PIPE).wait()
+    proc = subprocess.Popen(['ssh', '-o', 'ConnectTimeout=%d' % timeout, host, 'hostname'], 
+                            stdin=open(os.devnull),
+                            stdout=subprocess.PIPE, 
+                            stderr=subprocess.PIPE)
+    if mayaJob.communicate(proc, timeout + VERIFY_TIMEOUT) is None:
+        return False
     # Returns 255 if the host is not accessible
     # Returns 130 if the wrong password was entered (no point checking this right now)
-    return result != 255
+    return proc.returncode != 255
+
+def runInPool(func, items, workers, deadline=None):
+    """
+    Calls func(item) for every item from at most 'workers' threads, waiting 
+    up to deadline seconds (forever if None) for them all to finish.
+    Anything still running after the deadline finishes in the background.
+    """
+    queue = Queue.Queue()
+    for item in items:
+        queue.put(item)
+
+    def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Queue.Empty:
+                return
+            func(item)
+
+    threads = []
+    for i in range(min(workers, queue.qsize())):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    end = time.time() + deadline if deadline is not None else None
+    for thread in threads:
+        if end is None:
+            thread.join()
+        else:
+            thread.join(max(0.0, end - time.time()))
+
+class HostStatusCache:
+    """
+    Remembers which hosts answered over ssh and when they were last checked.
+
+    Hosts are probed in parallel by a bounded pool of worker threads, and 
+    anything older than the TTL is re-checked in the background while the 
+    last known result keeps being handed out, so nothing reading the cache
+    has to wait on ssh.
+    """
+    TTL = 300.0
+    WORKERS = 16
+
+    def __init__(self, ttl=TTL, workers=WORKERS, timeout=1, logger=None):
+        self.ttl = ttl
+        self.workers = workers
+        self.timeout = timeout
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        # host -> (reachable, time checked)
+        self._status = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def refresh(self, hosts, deadline=None):
+        """
+        Probes the hosts in parallel, waiting at most deadline seconds (forever 
+        if None) for the results. Hosts still being checked when the deadline 
+        passes carry on in the background and are left out of the result.
+
+        Returns a dictionary of host -> reachable
+        """
+        with self._lock:
+            toCheck = [ host for host in hosts if host not in self._pending ]
+            self._pending.update(toCheck)
+
+        runInPool(self.__probe, toCheck, self.workers, deadline)
+
+        with self._lock:
+            return dict( (host, self._status[host][0]) for host in hosts if host in self._status )
+
+    def refreshAsync(self, hosts):
+        thread = threading.Thread(target=self.refresh, args=(hosts,))
+        thread.daemon = True
+        thread.start()
+
+    def isReachable(self, host):
+        """
+        Returns the last known status of the host (None if it has never been 
+        checked), starting a background re-check if it's out of date
+        """
+        with self._lock:
+            status = self._status.get(host)
+
+        if status is None or time.time() - status[1] > self.ttl:
+            self.refreshAsync([host])
+
+        return status[0] if status else None
+
+    def check(self, host, deadline=None):
+        """
+        Like isReachable, but a host that has never been checked is checked 
+        now, waiting at most deadline seconds. None if it didn't answer in time
+        """
+        with self._lock:
+            status = self._status.get(host)
+
+        if status is None:
+            runInPool(self.__probe, [host], 1, deadline)
+            with self._lock:
+                status = self._status.get(host)
+        elif time.time() - status[1] > self.ttl:
+            self.refreshAsync([host])
+
+        return status[0] if status else None
+
+    def reachableHosts(self):
+        with self._lock:
+            return sorted( host for host, (reachable, checked) in self._status.iteritems() if reachable )
+
+    def __probe(self, host):
+        try:
+            reachable = verifyHost(host, self.timeout)
+        except OSError, e:
+            self.logger.error('Cannot verify host %s : %s' % (host, e))
+            reachable = False
+
+        with self._lock:
+            self._status[host] = (reachable, time.time())
+            self._pending.discard(host)
+
+class HostTelemetry(threading.Thread):
+    """
+    Keeps a table of how busy each host is (cores, load average, free memory),
+    refreshed in the background every INTERVAL seconds.
+
+    Each host is asked for everything in one ssh command, and the hosts are 
+    probed in parallel by a bounded pool of threads.
+    """
+    INTERVAL = 60.0
+    WORKERS = 16
+    # How long a host gets to answer once connected, before its ssh is killed
+    PROBE_TIMEOUT = 10
+
+    # Prints the core count, /proc/loadavg and the available memory (kB) on separate lines
+    PROBE_COMMAND = ('getconf _NPROCESSORS_ONLN; cat /proc/loadavg; '
+                     '(grep MemAvailable /proc/meminfo || grep MemFree /proc/meminfo) | awk \'{print $2}\'')
+
+    Info = collections.namedtuple('Info', ['cores', 'load1', 'load5', 'load15', 'freeMemory', 'checked'])
+
+    def __init__(self, hosts, interval=INTERVAL, workers=WORKERS, timeout=2, logger=None):
+        threading.Thread.__init__(self, name='HostTelemetry')
+        self.daemon = True
+
+        self.interval = interval
+        self.workers = workers
+        self.timeout = timeout
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._hosts = list(hosts)
+        self._table = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def setHosts(self, hosts):
+        with self._lock:
+            self._hosts = list(hosts)
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.refresh()
+            self._stopped.wait(self.interval)
+
+    def refresh(self, deadline=None):
+        with self._lock:
+            hosts = list(self._hosts)
+        runInPool(self.__probe, hosts, self.workers, deadline)
+
+    def info(self, host):
+        """
+        Returns the last HostTelemetry.Info for the host, or None if it hasn't answered yet
+        """
+        with self._lock:
+            return self._table.get(host)
+
+    def table(self):
+        with self._lock:
+            return dict(self._table)
+
+    def spareCores(self, host):
+        """
+        Roughly how many cores on the host are sitting idle
+        """
+        info = self.info(host)
+        if info is None:
+            return None
+        return max(0.0, info.cores - info.load1)
+
+    def __probe(self, host):
+        command = ['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=%d' % self.timeout,
+                   '-o', 'ServerAliveInterval=%d' % self.timeout, '-o', 'ServerAliveCountMax=2',
+                   host, HostTelemetry.PROBE_COMMAND]
+        try:
+            proc = subprocess.Popen(command, 
+                                    stdin=open(os.devnull),
+                                    stdout=subprocess.PIPE, 
+                                    stderr=open(os.devnull, 'w'),
+                                    close_fds=True)
+            # A host that hangs after connecting would otherwise hold this worker forever
+            stdout = mayaJob.communicate(proc, self.timeout + HostTelemetry.PROBE_TIMEOUT)
+            if stdout is None:
+                raise OSError('no answer within %d seconds' % (self.timeout + HostTelemetry.PROBE_TIMEOUT))
+            lines = stdout.split('\n')
+            load = lines[1].split()
+            info = HostTelemetry.Info(cores=int(lines[0]),
+                                      load1=float(load[0]),
+                                      load5=float(load[1]),
+                                      load15=float(load[2]),
+                                      freeMemory=int(lines[2]) * 1024,
+                                      checked=time.time())
+        except (OSError, IndexError, ValueError), e:
+            self.logger.debug('No telemetry from host %s : %s' % (host, e))
+            with self._lock:
+                self._table.pop(host, None)
+            return
+
+        with self._lock:
+            self._table[host] = info
 
 def modifyDisabledText(entryText, msg, startCursor = 0, colour='#000000', multiLine=False):
     entryText.config(state='normal')
@@ -96,6 +325,34 @@ class ManagerUI(tk.Frame):
     SCREENSAVER_ON_DELAY = 1800.0
     SCREENSAVER_OFF_DELAY = 0.1
     UI_REFRESH_DELAY = 100
+    # Most log lines kept in the output pane
+    OUTPUT_MAX_LINES = mayaJob.Job.OUTPUT_MAX_LINES
+    TRANSFER_REFRESH_DELAY = 500
+
+    # Run jobs as coroutines on a jobEngine.Engine rather than one pxssh session each
+    USE_JOB_ENGINE = False
+
+    # How many jobs a host runs at once, unless the hosts file says otherwise
+    JOBS_PER_HOST = 1
+
+    # Render a stalled job's unfinished frames again (at most this many times)
+    REQUEUE_STALLED = True
+    MAX_STALL_REQUEUES = 2
+
+    # Keep the job list on disk and leave renders going when the manager closes,
+    # they're picked back up next time it starts
+    PERSIST_JOBS = True
+    # Stream maya's logs back over ssh rather than reading them through the shared home directory
+    STREAM_LOGS = True
+
+    # Where Windows drives in workspace file paths are mounted here, eg. { 'D' : '/transfer' }
+    DRIVE_MAP = {}
+
+    # Longest to wait for the jobs to be closed on exit
+    SHUTDOWN_TIMEOUT = 60.0
+
+    # Longest to wait for the hosts to be checked at startup, slower hosts are checked in the background
+    HOST_CHECK_DEADLINE = 5.0
 
     MIN_WINDOW_SIZE = (800, 600)
     APPDIR = os.path.expanduser('~/.rendermanager')
@@ -136,37 +393,18 @@ class ManagerUI(tk.Frame):
 
         self.logger.info('Loading workspace from user directory %s' % self.workspacePath)
 
-        outputDirectoryPat = re.compile(r'workspace -fr \"images\"')
-
-        self.logger.info('Workspace file exists')
-        self.logger.info('Reading file...')
-
         try:
-            with open(self.workspacePath) as f:
-                self.logger.info("Checking for \"images\" entry...")
-
-                for num, line in enumerate(f):
-                    if outputDirectoryPat.match(line):
-                        self.logger.info("Success on line %d : %s" % (num, line))
-
-                        outputDir = shlex.split(line)[3].replace('\"', '')[:-1]
-
-                        self.logger.info("Using output directory %s" % outputDir)
-                        break
-                else:
-                    raise ValueError
+            # File rules come back as absolute paths, relative & Windows paths included
+            self.workspace = Workspace(self.workspacePath, driveMap=ManagerUI.DRIVE_MAP, logger=self.logger)
         except IOError:
             displayError('Error', "Invalid workspace file '%s', exiting" % self.workspacePath, self.logger)
             sys.exit(1)
-        except ValueError:
+
+        outputDir = self.workspace.fileRule('images')
+        if outputDir is None:
             displayError('Invalid workspace file', 'Failed to find render path  in workspace file, exiting', self.logger)
             sys.exit(1)
-
-
-        # Check if the output dir is relative to the workspace
-        if not os.path.isabs(outputDir):
-            outputDir = os.path.join(os.path.dirname(self.workspacePath), outputDir)
-            self.logger.info("Relative path detected, expanding to %s" % outputDir)
+        self.logger.info("Using output directory %s" % outputDir)
 
         if "transfer" not in outputDir:
             displayError('Unpredictable path', 'The output directory does not appear to be on a /transfer/ drive, copying files may not work as intended', self.logger)
@@ -175,32 +413,50 @@ class ManagerUI(tk.Frame):
         self.logger.info("Loading hosts from %s" % hostsDir)
 
         self.hosts = []
+        self.hostStatus = HostStatusCache(logger=self.logger)
+        self.renderQueue = RenderQueue(ManagerUI.JOBS_PER_HOST, self.logger)
         
         try:
+            hostMachines = []
             with open(hostsDir) as f:
                 for line in f:
-                    if line:
-                        # Ignore commented lines
-                        if line[0] != '#':
-                            hostMachine = line.rstrip()
-                  
-                            if verifyHost(hostMachine):
-                                self.hosts.append(hostMachine)
-                            else:
-                                self.logger.info("Inaccessible host %s, skipping" % hostMachine)
+                    # Ignore commented lines
+                    if line.strip() and line[0] != '#':
+                        # Each line is a host name, optionally followed by how many jobs it can run at once
+                        fields = line.split()
+                        hostMachines.append(fields[0])
+                        if len(fields) > 1:
+                            self.renderQueue.setSlots(fields[0], int(fields[1]))
+
+            status = self.hostStatus.refresh(hostMachines, deadline=ManagerUI.HOST_CHECK_DEADLINE)
+            for hostMachine in hostMachines:
+                if status.get(hostMachine):
+                    self.hosts.append(hostMachine)
                 else:
-                    if not self.hosts:
-                        raise IOError("Hosts file '%s' contains no hosts" % hostsDir)
+                    self.logger.info("Inaccessible host %s, skipping" % hostMachine)
+
+            if not self.hosts:
+                raise IOError("Hosts file '%s' contains no hosts" % hostsDir)
         except IOError, e:
             displayError('File not found', e, self.logger)
 
         # Remove duplicates
         self.hosts = list(set(self.hosts))
 
+        self.hostTelemetry = HostTelemetry(self.hosts, logger=self.logger)
+        self.hostTelemetry.start()
+
         self.renderJobs = []
-        self.renderQueue = {}
         self.selectedJobID = -1
-        self.lastOutput = []
+        # (job, frames found) from resumes whose output listing has come back
+        self.resumed = Queue.Queue()
+        # (reachable, job arguments) for new jobs whose host has been checked
+        self.hostsChecked = Queue.Queue()
+        # What the output pane is showing, see refreshOutput
+        self.outputJob = None
+        self.outputCursor = None
+        self.outputHeader = []
+        self.outputLines = 0
         
         self.defaults = {}
         self.defaults['binDir'] = '/opt/autodesk/maya/bin/Render'
@@ -208,6 +464,9 @@ class ManagerUI(tk.Frame):
         self.defaults['camOverride'] = 'persp'
         self.defaults['resolutionOverride'] = (640, 480)
         self.defaults['frames'] = (0, 0)
+        self.defaults['priority'] = 0
+        self.defaults['chunkSize'] = 10
+        self.defaults['collectDir'] = ''
 
         #self.logger.debug('Defaults \n %s' % json.dumps(self.defaults, indent=3))
 
@@ -231,9 +490,45 @@ class ManagerUI(tk.Frame):
 
         signal.signal(signal.SIGINT, self.onKill) 
         self.parent.after(ManagerUI.UI_REFRESH_DELAY, self.refreshUI)
-        self.updateThread = Timer(ManagerUI.updateThreadDelay, self.update).start()
         self.shouldExit = False
 
+        self.sessionPool = SessionPool(logger=self.logger)
+
+        self.jobStore = None
+        if ManagerUI.PERSIST_JOBS:
+            try:
+                self.jobStore = JobStore(os.path.join(ManagerUI.APPDIR, 'jobs.db'), logger=self.logger)
+            except IOError, e:
+                displayError('Job store', '%s, jobs will not be kept between sessions' % e, self.logger)
+
+        self.jobEngine = None
+        if ManagerUI.USE_JOB_ENGINE:
+            self.jobEngine = jobEngine.Engine(self.logger)
+            self.jobEngine.start()
+
+        self.updateThread = SessionSupervisor(ManagerUI.updateThreadDelay, 
+                                              onTick=self.update, 
+                                              onStop=self.closeJobs, 
+                                              logger=self.logger)
+        self.updateThread.start()
+
+        # Jobs are added straight away and connect in the background, the supervisor
+        # is woken once each one is ready so it can be started
+        self.jobPreparer = JobPreparer(onReady=lambda job: self.updateThread.wake(), logger=self.logger)
+
+        # Copies finished frames back in the background, see the Transfers window
+        self.transfers = TransferManager(logger=self.logger)
+
+        # Jobs whose render died under them, failed on a jobPreparer thread (that 
+        # talks to the host) then requeued on the supervisor thread
+        self.stalledJobs = Queue.Queue()
+        self.failedStalls = Queue.Queue()
+        self.watchdog = StallWatchdog(onStall=self.stalledJobs.put, logger=self.logger)
+        self.watchdog.start()
+
+        if self.jobStore:
+            self.restoreJobs()
+
         self.initWidgets()
         
     def refreshUI(self):
@@ -241,98 +536,183 @@ class ManagerUI(tk.Frame):
             if ManagerUI.updateThreadDelay != ManagerUI.SCREENSAVER_OFF_DELAY:
                 self.logger.debug('User is active, decreasing update thread delay to %f' % ManagerUI.SCREENSAVER_OFF_DELAY)
                 ManagerUI.updateThreadDelay = ManagerUI.SCREENSAVER_OFF_DELAY
-                if self.updateThread: 
-                    self.logger.debug('Restarting update thread...')
-                    self.updateThread.cancel()
-                self.updateThread = Timer(ManagerUI.updateThreadDelay, self.update).start()
+                self.updateThread.setInterval(ManagerUI.updateThreadDelay)
         else:
             if ManagerUI.updateThreadDelay != ManagerUI.SCREENSAVER_ON_DELAY:
                 self.logger.debug('User is inactive, increasing update thread delay to %f' % ManagerUI.SCREENSAVER_ON_DELAY)
                 ManagerUI.updateThreadDelay = ManagerUI.SCREENSAVER_ON_DELAY
-                if self.updateThread: 
-                    self.logger.debug('Restarting update thread...')
-                    self.updateThread.cancel()
-                self.updateThread = Timer(ManagerUI.updateThreadDelay, self.update).start()
+                self.updateThread.setInterval(ManagerUI.updateThreadDelay)
 
-        selection = self.jobListbox_list.curselection()
-
-        # Refresh list
-        self.jobListbox_list.delete(0, tk.END)
-        for job in self.renderJobs:
-            self.jobListbox_list.insert(tk.END, str(job))
-
-            if job.state == 'Finished':   self.jobListbox_list.itemconfig(tk.END, bg='green')
-            elif job.state == 'Running':  self.jobListbox_list.itemconfig(tk.END, bg='orange')
-            elif job.state == 'Error':    self.jobListbox_list.itemconfig(tk.END, bg='red')
-            elif job.state == 'Idle':     pass
+        # Farm wide rate & ETA
+        rate = self.renderQueue.throughput()
+        if rate:
+            self.parent.title('Render Manager - %.1f frames/h, ETA %s' % (rate, mayaJob.formatDuration(self.renderQueue.eta())))
+        else:
+            self.parent.title('Render Manager')
 
-        for select in selection:
-            self.jobListbox_list.select_set(select)
+        self.refreshJobList()
 
         if self.selectedJobID != -1:
             job = self.renderJobs[self.selectedJobID]
 
-            if self.lastOutput != job.output:
-                logOutput = ''.join([ '%s\n' % line for line in job.output ])
-                modifyDisabledText(self.jobOut, logOutput, colour='#FFFFFF', multiLine=True, startCursor='1.0')
-                self.jobOut.config(state='normal')
-                self.lastOutput = job.output
-
+            if self.refreshOutput(job):
                 modifyDisabledText(self.entCurrentFrame, job.currentFrame)
                 self.prgRenderProgressFrame["value"] = job.frameProgress
                 self.prgRenderProgress["value"] = job.progress
 
             self.btnJobRestart.config(state=tk.NORMAL)
+            self.btnJobResume.config(state=tk.NORMAL)
             self.btnJobRemove.config(state=tk.NORMAL)
             self.btnJobKill.config(state=tk.NORMAL)
+            # Only renders running in their own process group on the host can really be paused
+            self.btnJobPause.config(state=tk.NORMAL if job.pausable and (job.running or job.paused) else tk.DISABLED,
+                                    text='Continue' if job.paused else 'Pause')
         else:
+            self.btnJobPause.config(state=tk.DISABLED)
             self.btnJobRestart.config(state=tk.DISABLED)
+            self.btnJobResume.config(state=tk.DISABLED)
             self.btnJobRemove.config(state=tk.DISABLED)
             self.btnJobKill.config(state=tk.DISABLED)
 
+        while not self.resumed.empty():
+            self.finishResume(*self.resumed.get())
+
+        while not self.hostsChecked.empty():
+            self.finishNewJob(*self.hostsChecked.get())
+
         self.parent.after(ManagerUI.UI_REFRESH_DELAY, self.refreshUI)
 
+    def refreshOutput(self, job):
+        """
+        Brings the output pane up to date with job, returns whether anything 
+        changed. New lines are added to the end and the oldest trimmed once 
+        there are more than OUTPUT_MAX_LINES, the pane is only filled in from 
+        scratch when another job is shown (or its log starts over). The view 
+        follows the end of the log if it was already there, otherwise it stays 
+        on the lines it was showing
+        """
+        text = self.jobOut
+        restart = self.outputJob is not job
+
+        header = job.outputHeader
+        lines, cursor, follows = job.outputSince(None if restart else self.outputCursor)
+        restart = restart or not follows
+        if not restart and not lines and header == self.outputHeader:
+            return False
+
+        following = restart or text.yview()[1] >= 1.0
+        top = int(text.index('@0,0').split('.')[0])
+        # Lines added (or taken away) above the view
+        shift = 0
+
+        text.config(state='normal')
+        if restart:
+            text.delete('1.0', tk.END)
+            self.outputJob = job
+            self.outputHeader = []
+            self.outputLines = 0
+
+        # The header takes the first lines, the log follows it
+        if header != self.outputHeader:
+            text.delete('1.0', '%d.0' % (len(self.outputHeader) + 1))
+            text.insert('1.0', ''.join( '%s\n' % line for line in header ))
+            shift += len(header) - len(self.outputHeader)
+            self.outputHeader = header
+
+        if lines:
+            # Anything before the last OUTPUT_MAX_LINES would only be trimmed again
+            lines = lines[-ManagerUI.OUTPUT_MAX_LINES:]
+            text.insert(tk.END, ''.join( '%s\n' % line for line in lines ))
+            self.outputLines += len(lines)
+
+            excess = self.outputLines - ManagerUI.OUTPUT_MAX_LINES
+            if excess > 0:
+                logStart = len(header) + 1
+                text.delete('%d.0' % logStart, '%d.0' % (logStart + excess))
+                self.outputLines -= excess
+                shift -= excess
+        self.outputCursor = cursor
+
+        if following:
+            text.see(tk.END)
+        else:
+            text.yview('%d.0' % max(1, top + shift))
+        return True
+
+    def refreshJobList(self):
+        """
+        Brings the job list up to date. Only the rows on screen are looked at, 
+        and of those only the ones whose text or state has changed are touched, 
+        so the selection is left alone and a long list costs no more than a 
+        short one. Rows scrolled off screen catch up once they're back on it
+        """
+        tree = self.jobListbox_list
+
+        # Rows follow the jobs by position, [item, text, state] shown
+        while len(self.jobRows) < len(self.renderJobs):
+            self.jobRows.append([tree.insert('', tk.END, text=''), None, None])
+        while len(self.jobRows) > len(self.renderJobs):
+            tree.delete(self.jobRows.pop()[0])
+
+        count = len(self.jobRows)
+        if not count:
+            return
+
+        top, bottom = tree.yview()
+        first = max(0, int(top * count) - 1)
+        last = min(count, int(math.ceil(bottom * count)) + 1)
+
+        for row, job in zip(self.jobRows[first:last], self.renderJobs[first:last]):
+            text, state = str(job), job.state
+            if row[1:] != [text, state]:
+                tree.item(row[0], text=text, tags=(state,))
+                row[1:] = [text, state]
+
     def update(self):
         if not self.shouldExit:
-            """ RENDER QUEUE - BROKEN
-            for host in self.renderQueue:
-                self.logger.debug('Updating first job on host %s' % host)
-                if self.renderQueue[host]:
-                    topJob = self.renderQueue[host][0]
-                    self.logger.debug('Current job on %s : %s' % (host, repr(topJob)))
-
-                    if not topJob.running:
-                        try:
-                            self.logger.info('Starting next job on host %s' % topJob.host)
-                            topJob.run()
-                        except IOError:
-                            topJob.close()
-                            displayError('Update job', 'Cannot start job on %s' % topJob.host, self.logger)
-                            self.renderQueue[host].pop()
-                    elif topJob.completed():
-                        self.logger.info('Popping finished job off queue on %s' % host)
-                        self.renderQueue[host].pop()
-            """
-            
+            # Session output & maya logs are read by the supervisor itself, 
+            # all that's left to do on each tick is start any queued jobs
+            while not self.stalledJobs.empty():
+                self.jobPreparer.call(self.onJobStalled, self.stalledJobs.get())
+            self.requeueStalledJobs()
+
+            if self.jobStore and self.jobStore.due():
+                self.saveJobs()
+
+            if self.workspace.due() and self.workspace.refresh():
+                self.defaults['outputDir'] = self.workspace.fileRule('images', self.defaults['outputDir'])
+
             for job in self.renderJobs:
-                if not job.running:
+                if hasattr(job, 'takeNewJobs'):
+                    self.queueJob(job)
+
+            for job in self.renderQueue.schedule():
+                try:
                     self.logger.debug('Starting job %s' % repr(job))
                     job.run()
-
-                self.logger.debug('Checking if job %s completed...' % repr(job))
-                if not job.completed():
-                    self.logger.debug('Not completed, updating')
-                    job.update()
-                        
-            self.updateThread = Timer(ManagerUI.updateThreadDelay, self.update).start()
-        else:
-            self.logger.info('Update thread closing...')
-            for i, job in enumerate(self.renderJobs):
+                except IOError, e:
+                    self.logger.error('Cannot start job on %s : %s' % (job.host, e), exc_info=sys.exc_info())
+                    job.close()
+                self.updateThread.wake()
+
+    def closeJobs(self):
+        self.logger.info('Update thread closing...')
+        for i, job in enumerate(self.renderJobs):
+            if self.jobStore:
+                # Saved already, anything still rendering is picked back up next time
+                self.logger.info('Detaching from job #%d...' % i)
+                job.detach()
+            else:
                 self.logger.info('Closing job #%d...' % i)
                 job.close()
-                self.logger.info('Done')
-            self.logger.info('All jobs closed, terminating thread')
-            del self.renderJobs
+            self.logger.info('Done')
+        self.logger.info('All jobs closed, terminating thread')
+        del self.renderJobs
+
+        self.sessionPool.closeAll()
+
+        if self.jobEngine:
+            self.jobEngine.stop()
 
     def initWidgets(self):
         self.logger.info('Building interface...')
@@ -382,6 +762,7 @@ class ManagerUI(tk.Frame):
         
         self.fileMenu = tk.Menu(self.menubar)
         self.fileMenu.add_command(label="Copy files", command=self.copyJobFiles)
+        self.fileMenu.add_command(label="Transfers", command=self.transferWindow)
         self.fileMenu.add_command(label="Exit", command=self.onExit)
         self.menubar.add_cascade(label="File", menu=self.fileMenu)
 
@@ -389,10 +770,15 @@ class ManagerUI(tk.Frame):
 
         self.jobListbox = tk.Frame(self.jobList)
         self.jobListbox_scr = tk.Scrollbar(self.jobListbox)
-        self.jobListbox_list = tk.Listbox(self.jobListbox, yscrollcommand=self.jobListbox_scr.set)
+        self.jobListbox_list = ttk.Treeview(self.jobListbox, show='tree', selectmode='browse', yscrollcommand=self.jobListbox_scr.set)
         self.jobListbox_scr.config(command=self.jobListbox_list.yview)
+        # Filled in by refreshJobList
+        self.jobRows = []
 
-        self.jobListbox_list.bind("<<ListboxSelect>>", self.onJobSelect)
+        for state, colour in (('Finished', 'green'), ('Running', 'orange'), ('Error', 'red'), ('Connecting', 'light blue')):
+            self.jobListbox_list.tag_configure(state, background=colour)
+
+        self.jobListbox_list.bind("<<TreeviewSelect>>", self.onJobSelect)
         self.jobListbox_list.bind("<Double-Button-1>", lambda x: self.copyJobFiles() )
         self.jobListbox_list.grid(row=0, column=0, sticky="nwes")
         self.jobListbox_list.rowconfigure(0, weight=1)
@@ -401,7 +787,7 @@ class ManagerUI(tk.Frame):
         self.jobListbox_scr.grid(row=0, column=1, stick="news")
         self.jobListbox_scr.rowconfigure(0, weight=1)
 
-        self.jobListbox.grid(row=0, columnspan=6, sticky="nsew")
+        self.jobListbox.grid(row=0, columnspan=7, sticky="nsew")
         self.jobListbox.rowconfigure(0, weight=1)
         self.jobListbox.columnconfigure(0, weight=1)
 
@@ -425,6 +811,13 @@ class ManagerUI(tk.Frame):
 
         columnCounter += 1
 
+        self.btnJobResume = ttk.Button(self.jobList, text="Resume", command=self.onJobResume)
+        self.btnJobResume.grid(row=1, column=columnCounter, sticky="n", padx=btnPad, pady=btnPad)
+        self.btnJobResume.rowconfigure(0, weight=0)
+        self.btnJobResume.columnconfigure(0, weight=0)
+
+        columnCounter += 1
+
         self.btnJobRemove = ttk.Button(self.jobList, text="Remove", command=self.onJobRemove)
         self.btnJobRemove.grid(row=1, column=columnCounter, sticky="n", padx=btnPad, pady=btnPad)
         self.btnJobRemove.rowconfigure(0, weight=0)
@@ -599,8 +992,13 @@ class ManagerUI(tk.Frame):
           self.entDst.grid(row=1, column=1, padx=padding, pady=padding)
           self.entDst.bind("<Double-Button-1>", lambda event: self.getDirectory(self.entDst, self.scpWin))
 
+          # Unchanged frames are skipped either way, this also compares checksums
+          self.varVerifyCopy = tk.IntVar()
+          chkVerify = tk.Checkbutton(self.scpWin, text='Compare checksums', variable=self.varVerifyCopy)
+          chkVerify.grid(row=2, column=1, sticky='NW', padx=padding, pady=padding)
+
           btnOk = ttk.Button(self.scpWin, text='Copy', command = self.verifyCopyJob)
-          btnOk.grid(row=2, column=1, padx=padding, pady=padding)
+          btnOk.grid(row=3, column=1, padx=padding, pady=padding)
 
     def verifyCopyJob(self):
         if self.selectedJobID != -1:
@@ -610,28 +1008,196 @@ class ManagerUI(tk.Frame):
                 answer = tkmsg.askyesno('Job', 'Job is not yet complete, are you sure you to attempt to copy the files?')
                 if not answer:
                     self.logger.info('User cancelled')
-                return
+                    return
 
             if len(self.entDst.get()) == 0:
                 displayError('Invalid option', 'Please enter a destination path')
                 return
 
             dst = os.path.expanduser(self.entDst.get())
-            src = os.path.join(job.outputPath, r'%s*{%d..%d}*' % (job.outputPrefix, job.frameRange[0], job.frameRange[1]))
-
-            self.logger.info('Destination : %s\n Source %s' % (dst, src))
+            verify = bool(self.varVerifyCopy.get())
 
             self.scpWin.destroy()
 
-            if not os.path.exists(dst):
-                os.makedirs(dst)
+            # Each chunk of a sequence is copied from the host that rendered it, 
+            # its frames are picked out of the listing by their frame numbers
+            for leaf in self.leafJobs(job):
+                src = os.path.join(leaf.outputPath, '%s*' % leaf.outputPrefix)
+                self.logger.info('Destination : %s\n Source %s (frames %d-%d)' % (dst, src, leaf.frameRange[0], leaf.frameRange[1]))
+                self.transfers.submit(leaf.host, [src], dst, leaf.sessionUser, verify=verify,
+                                      match=frameMatch(leaf.outputPrefix, leaf.frameRange[0], leaf.frameRange[1]))
 
-            secureCopy(job.host, src, dst, self.logger)
             self.renderJobs[self.selectedJobID].copied = True
+            self.transferWindow()
+
+    def transferWindow(self):
+        if hasattr(self, 'transferWin') and self.transferWin.winfo_exists():
+            self.transferWin.lift()
+            return
+
+        padding = 3
+
+        self.transferWin = tk.Toplevel()
+        self.transferWin.title('Transfers')
+        self.transferWin.columnconfigure(0, weight=1)
+        self.transferWin.rowconfigure(0, weight=1)
 
-    def addJob(self, host, binPath, scenePath, outputPath, frameRange, camOverride=None, resolutionOverride=None):
+        columns = ('host', 'destination', 'state', 'files', 'copied', 'rate', 'eta')
+        self.transferList = ttk.Treeview(self.transferWin, columns=columns, show='headings', height=10)
+        for column in columns:
+            self.transferList.heading(column, text=column.capitalize())
+            self.transferList.column(column, width=200 if column == 'destination' else 90)
+        self.transferList.grid(row=0, column=0, columnspan=3, sticky='nsew', padx=padding, pady=padding)
+
+        btnCancel = ttk.Button(self.transferWin, text='Cancel', command=self.onTransferCancel)
+        btnCancel.grid(row=1, column=1, padx=padding, pady=padding)
+
+        btnClear = ttk.Button(self.transferWin, text='Clear finished', command=self.onTransferClear)
+        btnClear.grid(row=1, column=2, padx=padding, pady=padding)
+
+        self.refreshTransfers()
+
+    def refreshTransfers(self):
+        if not self.transferWin.winfo_exists():
+            return
+
+        transfers = self.transfers.transfers()
+        rows = dict( (str(id(transfer)), transfer) for transfer in transfers )
+
+        for item in self.transferList.get_children():
+            if item not in rows:
+                self.transferList.delete(item)
+
+        for transfer in transfers:
+            item = str(id(transfer))
+            if transfer.bytesTotal is None:
+                copied = '-'
+            else:
+                copied = '%s/%s (%.0f%%)' % (formatSize(transfer.bytesDone), formatSize(transfer.bytesTotal), transfer.progress)
+            values = (transfer.host,
+                      transfer.destination,
+                      transfer.error if transfer.error else transfer.state,
+                      '%d (%d up to date)' % (len(transfer.files), len(transfer.skipped)),
+                      copied,
+                      '%s/s' % formatSize(transfer.rate),
+                      mayaJob.formatDuration(transfer.eta))
+
+            if self.transferList.exists(item):
+                self.transferList.item(item, values=values)
+            else:
+                self.transferList.insert('', tk.END, iid=item, values=values)
+
+        self.transferWin.after(ManagerUI.TRANSFER_REFRESH_DELAY, self.refreshTransfers)
+
+    def selectedTransfers(self):
+        selection = self.transferList.selection()
+        return [ transfer for transfer in self.transfers.transfers() if str(id(transfer)) in selection ]
+
+    def onTransferCancel(self):
+        for transfer in self.selectedTransfers():
+            self.transfers.cancel(transfer)
+
+    def onTransferClear(self):
+        for transfer in self.transfers.transfers():
+            if transfer.completed():
+                self.transfers.forget(transfer)
+
+    def queueJob(self, job):
+        """
+        Hands the job (or any new chunks of a sequence job) to the scheduler & supervisor
+        """
+        if hasattr(job, 'takeNewJobs'):
+            jobs = job.takeNewJobs()
+        else:
+            jobs = [job]
+
+        for leaf in jobs:
+            if leaf.running or leaf.reattached:
+                # Reattached after a restart, it's already taking up a slot on its host
+                self.renderQueue.adopt(leaf)
+            else:
+                self.renderQueue.add(leaf, job.priority)
+            self.updateThread.add(leaf)
+            self.watchdog.watch(leaf)
+            if leaf.connecting:
+                self.jobPreparer.submit(leaf)
+
+    def onJobStalled(self, job):
+        """
+        Fails a job whose render has died, from a jobPreparer thread. Its 
+        frames are requeued by requeueStalledJobs once it has failed
+        """
+        if job.completed():
+            return
+
+        job.markStalled()
+        self.failedStalls.put(job)
+
+    def requeueStalledJobs(self):
+        """
+        Renders the frames stalled jobs didn't get to again, for those that
+        haven't stalled too often already
+        """
+        waiting = []
+        while not self.failedStalls.empty():
+            job = self.failedStalls.get()
+            if job.completed():
+                self.requeueStalledJob(job)
+            else:
+                # Still fetching the end of its log
+                waiting.append(job)
+
+        for job in waiting:
+            self.failedStalls.put(job)
+
+    def requeueStalledJob(self, job):
+        retries = getattr(job, 'stallRetries', 0)
+        if not ManagerUI.REQUEUE_STALLED or retries >= ManagerUI.MAX_STALL_REQUEUES:
+            return
+
+        owner = self.ownerOf(job)
+        if owner is None:
+            return
+
+        if owner is job:
+            start, end = job.frameRange
+            if start + job.currentFrame > end:
+                return
+            newJob = job.getNewInstanceofJob(frameRange=(start + job.currentFrame, end))
+            newJob.priority = job.priority
+            self.renderJobs[self.renderJobs.index(job)] = newJob
+            self.queueJob(newJob)
+        else:
+            # Picked up by queueJob on the next tick
+            newJob = owner.requeue(job)
+
+        if newJob:
+            newJob.stallRetries = retries + 1
+
+    def ownerOf(self, job):
+        """
+        The entry in renderJobs that job is (or is a chunk of)
+        """
+        for renderJob in self.renderJobs:
+            if renderJob is job or job in self.leafJobs(renderJob):
+                return renderJob
+        return None
+
+    def leafJobs(self, job):
+        """
+        The jobs that actually render, a sequence job's chunks or just the job itself
+        """
+        if hasattr(job, 'children'):
+            return job.children
+        return [job]
+
+    def addJob(self, host, binPath, scenePath, outputPath, frameRange, camOverride=None, resolutionOverride=None, priority=0, chunkSize=None, dispatch='static', collectPath=None):
         args = locals()
         args.pop('self', None)
+        args.pop('priority', None)
+        args.pop('chunkSize', None)
+        args.pop('dispatch', None)
+        args.pop('collectPath', None)
 
         logName = os.path.join(ManagerUI.APPDIR, 'jobLogs')
         if not os.path.exists(logName):
@@ -641,50 +1207,182 @@ class ManagerUI(tk.Frame):
 
         self.logger.info('Adding job : \n %s' % json.dumps(args, indent=3))
 
+        # Frames are copied to collectPath one by one as they finish
+        onFrame = FrameCollector(self.transfers, os.path.expanduser(collectPath), self.logger) if collectPath else None
+        jobFactory = self.jobFactory(onFrame)
+
         try:
-            newJob = mayaJob.Job(**args) 
-        except IOError, e:
+            if chunkSize:
+                # Spread the chunks over every host, least loaded first
+                hosts = sorted(self.hosts, key=lambda host: -(self.hostTelemetry.spareCores(host) or 0))
+                args.pop('host')
+                newJob = SequenceJob(hosts=hosts, chunkSize=chunkSize, priority=priority, jobFactory=jobFactory, dispatch=dispatch, **args)
+            else:
+                newJob = jobFactory(**args) 
+                newJob.priority = priority
+        except (IOError, ValueError), e:
             self.logger.error(e, exc_info=sys.exc_info())
             return
 
+        if collectPath:
+            newJob.copied = True
+
         self.renderJobs.append(newJob)
-        """ RENDER QUEUE - BROKEN
-        if newJob.host in self.renderQueue:
-            self.renderQueue[newJob.host].append(newJob)
-        else:
-            self.renderQueue[newJob.host] = [newJob]
-        """
+        self.queueJob(newJob)
 
         self.logger.debug('New job state > %s' % newJob.state)
         self.logger.debug('New job is running? %s' % newJob.running)
         self.logger.debug('New job is complete? %s' % newJob.completed())
 
-        self.jobListbox_list.insert(tk.END, str(self.renderJobs[-1]))
-        self.jobListbox_list.selection_clear(0, tk.END)
-        self.jobListbox_list.select_set(tk.END)
+        self.refreshJobList()
+        self.jobListbox_list.selection_set(self.jobRows[-1][0])
+        self.jobListbox_list.see(self.jobRows[-1][0])
+
+    def jobFactory(self, onFrame=None):
+        """
+        Makes jobs from Job keyword arguments, they're prepared (and log in) 
+        on the jobPreparer's threads once queued
+        """
+        if self.jobEngine:
+            return functools.partial(jobEngine.EngineJob, self.jobEngine, deferred=True, onFrame=onFrame,
+                                     detachable=ManagerUI.PERSIST_JOBS, streamLog=ManagerUI.STREAM_LOGS)
+        return functools.partial(mayaJob.Job, sessionPool=self.sessionPool, deferred=True, onFrame=onFrame,
+                                 detachable=ManagerUI.PERSIST_JOBS, streamLog=ManagerUI.STREAM_LOGS)
+
+    def restoreLeaf(self, snapshot, onFrame=None):
+        if self.jobEngine:
+            return jobEngine.EngineJob.restore(snapshot, engine=self.jobEngine, onFrame=onFrame)
+        return mayaJob.Job.restore(snapshot, sessionPool=self.sessionPool, onFrame=onFrame)
+
+    def snapshotJob(self, job):
+        """
+        The job's snapshot plus what the manager keeps on it
+        """
+        snapshot = job.snapshot()
+        snapshot['priority'] = job.priority
+        snapshot['copied'] = hasattr(job, 'copied')
+        snapshot['stallRetries'] = getattr(job, 'stallRetries', 0)
+
+        leaves = self.leafJobs(job)
+        collector = leaves[0].originalArgs.get('onFrame') if leaves else None
+        snapshot['collectPath'] = getattr(collector, 'destination', None)
+        return snapshot
+
+    def saveJobs(self):
+        self.jobStore.save([ self.snapshotJob(job) for job in self.renderJobs ])
+
+    def restoreJobs(self):
+        """
+        Brings back the jobs from the last session, renders that were still 
+        going are followed again rather than started over
+        """
+        for snapshot in self.jobStore.load():
+            collectPath = snapshot.get('collectPath')
+            onFrame = FrameCollector(self.transfers, collectPath, self.logger) if collectPath else None
+
+            try:
+                if snapshot.get('kind') == 'sequence':
+                    job = SequenceJob.restore(snapshot, self.jobFactory(onFrame), functools.partial(self.restoreLeaf, onFrame=onFrame))
+                else:
+                    job = self.restoreLeaf(snapshot, onFrame)
+            except (KeyError, IndexError, TypeError, ValueError), e:
+                self.logger.error('Cannot restore job %s : %s' % (snapshot.get('id'), e), exc_info=sys.exc_info())
+                continue
+
+            job.priority = snapshot.get('priority', 0)
+            job.stallRetries = snapshot.get('stallRetries', 0)
+            if snapshot.get('copied'):
+                job.copied = True
+
+            self.logger.info('Restored job %s' % repr(job))
+            self.renderJobs.append(job)
+            if not job.completed():
+                self.queueJob(job)
 
     def onJobAdd(self):
         self.messageWindow()
         
-    def runningJobsOnHost(self, currentJob):
-        for job in self.renderJobs:
-          print "Check if same job %r" % (job is not currentJob)
-          if job is not currentJob:
-            print "Check host : %r " % (job.host == currentJob.host)
-            if job.host == currentJob.host:
-              print "Check if job completed %r" % (not job.completed())
-              if not job.completed(): 
-                return True
-        return False
-
     def onJobRestart(self):
         if self.selectedJobID != -1:
-          newInstance = self.renderJobs[self.selectedJobID].getNewInstanceofJob()
+          oldInstance = self.renderJobs[self.selectedJobID]
+
+          self.logger.info('Restarting job on host %s' % oldInstance.host)
 
-          self.logger.info('Restarting job on host %s' % self.renderJobs[self.selectedJobID].host)
+          for job in self.leafJobs(oldInstance):
+            self.updateThread.remove(job)
+            self.watchdog.unwatch(job)
+            self.renderQueue.remove(job)
+          # Closing first lets the new instance pick up the old session from the pool,
+          # it's queued ahead of the new instance's prepare()
+          self.jobPreparer.call(oldInstance.close)
+
+          newInstance = oldInstance.getNewInstanceofJob()
+          newInstance.priority = oldInstance.priority
 
-          self.renderJobs[self.selectedJobID].close()
           self.renderJobs[self.selectedJobID] = newInstance
+          self.queueJob(newInstance)
+
+    def onJobResume(self):
+        """
+        Restarts the selected job rendering only the frames missing from its 
+        output directory, the hosts are listed in the background
+        """
+        if self.selectedJobID != -1:
+          job = self.renderJobs[self.selectedJobID]
+          self.logger.info('Looking for rendered frames of %s' % repr(job))
+
+          thread = threading.Thread(target=self.findRenderedFrames, args=(job,))
+          thread.daemon = True
+          thread.start()
+
+    def findRenderedFrames(self, job):
+        """
+        Lists job's output on every host it rendered on and hands the frames
+        that are there (and not empty) to the UI thread through self.resumed
+        """
+        prefix = job.outputPrefix
+        start, end = job.frameRange
+        pattern = os.path.join(job.outputPath, '%s*' % prefix)
+
+        present = set()
+        for host in self.leafHosts(job):
+          try:
+            files = self.transfers.listFiles(host, [pattern], job.sessionUser)
+          except (IOError, OSError), e:
+            self.logger.error('Cannot list output of %s on %s : %s' % (repr(job), host, e))
+            return
+
+          for remote in files:
+            frame = frameNumber(remote.path, prefix)
+            if remote.size > 0 and frame is not None and start <= frame <= end:
+              present.add(frame)
+
+        self.resumed.put((job, present))
+
+    def leafHosts(self, job):
+        return sorted(set( leaf.host for leaf in self.leafJobs(job) ))
+
+    def finishResume(self, oldInstance, present):
+        if oldInstance not in self.renderJobs:
+          # Removed while its output was being listed
+          return
+
+        self.logger.info('%d frames of %s already rendered' % (len(present), repr(oldInstance)))
+
+        newInstance = resumeJob(oldInstance, present)
+        if newInstance is None:
+          self.logger.info('Nothing left to render for %s' % repr(oldInstance))
+          tkmsg.showinfo('Resume', 'Every frame of this job has already been rendered')
+          return
+
+        for job in self.leafJobs(oldInstance):
+          self.updateThread.remove(job)
+          self.watchdog.unwatch(job)
+          self.renderQueue.remove(job)
+        self.jobPreparer.call(oldInstance.close)
+
+        self.renderJobs[self.renderJobs.index(oldInstance)] = newInstance
+        self.queueJob(newInstance)
 
     def onJobRemove(self):
         if self.selectedJobID != -1:
@@ -698,11 +1396,14 @@ class ManagerUI(tk.Frame):
           self.logger.info('Removing job at id %d' % self.selectedJobID)
 
           self.cleanlyRemoveJob(self.selectedJobID)
-          self.jobListbox_list.delete(self.selectedJobID)
 
           self.selectedJobID = -1
 
-    def cleanlyRemoveJob(self, id):
+    def cleanlyRemoveJob(self, id, background=True):
+        """
+        background : Close the job on a jobPreparer thread, closing may have
+                     to wait on its host
+        """
         if self.renderJobs[id].errorCode == 0:
           jobLogFile = self.renderJobs[id].jobLogPath
           mayaLogFile = self.renderJobs[id].logPath
@@ -715,26 +1416,37 @@ class ManagerUI(tk.Frame):
         else:
           self.logger.info('Job did not end successfully, preserving logs')
 
-        self.renderJobs[id].close()
+        for job in self.leafJobs(self.renderJobs[id]):
+            self.updateThread.remove(job)
+            self.watchdog.unwatch(job)
+            self.renderQueue.remove(job)
+        if background:
+            self.jobPreparer.call(self.renderJobs[id].close)
+        else:
+            self.renderJobs[id].close()
         del self.renderJobs[id]
+        if id < len(self.jobRows):
+            self.jobListbox_list.delete(self.jobRows.pop(id)[0])
+
+    # Pausing & killing a detached render is an ssh command to its host (one per
+    # chunk for a sequence), so they're done on a jobPreparer thread
 
     def onJobPauseToggle(self):
         if self.selectedJobID != -1:
-          if self.renderJobs[self.selectedJobID].paused:
-            self.renderJobs[self.selectedJobID].resume()
-          else:
-            self.renderJobs[self.selectedJobID].pause()
+          job = self.renderJobs[self.selectedJobID]
+          self.jobPreparer.call(job.resume if job.paused else job.pause)
     
     def onJobKill(self):
         if self.selectedJobID != -1:
-          self.renderJobs[self.selectedJobID].kill()
+          self.jobPreparer.call(self.renderJobs[self.selectedJobID].kill)
 
     def onJobSelect(self, val):
         sender = val.widget
-        idx = sender.curselection()
-        value = sender.get(idx)
+        selection = sender.selection()
+        if not selection:
+            return
 
-        self.selectedJobID = int(idx[0])
+        self.selectedJobID = sender.index(selection[0])
 
         job = self.renderJobs[self.selectedJobID]
 
@@ -749,6 +1461,11 @@ class ManagerUI(tk.Frame):
         modifyDisabledText(self.entResOverride_y, job.resolutionOverride[1])
         
     def onExit(self):
+        if self.jobStore:
+            # Nothing is lost, the jobs come back (and running renders carry on) next time
+            self.onKill()
+            return
+
         for job in self.renderJobs:
             if not job.completed:
                 shouldClose = tkmsg.askyesno('Verify', 'There are still running jobs, do you really want to quit?')
@@ -761,16 +1478,27 @@ class ManagerUI(tk.Frame):
 
         if shouldClose:
           for id, job in enumerate(self.renderJobs):
-            self.cleanlyRemoveJob(id)
+            self.cleanlyRemoveJob(id, background=False)
           self.onKill()
 
     def onKill(self, signal=None, frame=None):
         self.logger.info('Application closing...')
         self.shouldExit = True
+        self.hostTelemetry.stop()
+        self.jobPreparer.stop()
+        self.transfers.stop()
+        self.watchdog.stop()
+        if self.jobStore:
+            self.saveJobs()
+            self.jobStore.close()
         if self.updateThread == None:
           self.logger.info('Waiting for background thread to complete')
         else: 
-          self.updateThread.cancel()
+          self.updateThread.stop()
+          # It closes (or detaches) the jobs on its way out, see closeJobs
+          self.updateThread.join(ManagerUI.SHUTDOWN_TIMEOUT)
+          if self.updateThread.isAlive():
+            self.logger.error('Update thread did not finish closing jobs in time')
         self.logger.info('======= Finished ======= ')
         self.parent.destroy()
         #self.parent.quit()
@@ -801,7 +1529,6 @@ class ManagerUI(tk.Frame):
         if len(dir)!=0:
           output.delete(0, tk.END)
           output.insert(0, dir)
-          self.lastOutput = []
         
     def messageWindow(self):
         if hasattr(self, 'msgWin'):
@@ -820,8 +1547,20 @@ class ManagerUI(tk.Frame):
         lblHost.grid(row=rowCounter, column=0, sticky='NE', padx=btnPad, pady=btnPad)
         self.msgWin.rowconfigure(0, weight=1)
 
-        self.iHost = ttk.Combobox(self.msgWin, values=self.hosts)
+        # Hosts that missed the startup deadline may have answered since
+        self.hosts = sorted(set(self.hosts) | set(self.hostStatus.reachableHosts()))
+        self.hostTelemetry.setHosts(self.hosts)
+
+        # Least loaded hosts first
+        hosts = sorted(self.hosts, key=lambda host: -(self.hostTelemetry.spareCores(host) or 0))
+        self.iHost = ttk.Combobox(self.msgWin, values=hosts)
         self.iHost.grid(row=rowCounter, column=1, sticky='NW')
+        self.iHost.bind('<<ComboboxSelected>>', lambda event: self.onHostSelect())
+
+        rowCounter += 1
+
+        self.lblHostInfo = tk.Label(self.msgWin, text='')
+        self.lblHostInfo.grid(row=rowCounter, column=1, sticky='NW')
 
         rowCounter += 1
 
@@ -842,7 +1581,7 @@ class ManagerUI(tk.Frame):
 
         self.iScenePath = tk.Entry(self.msgWin, width=20)
         self.iScenePath.bind("<Double-Button-1>", lambda event: self.getFile(self.iScenePath, self.msgWin, 
-                                                                initialDir=os.path.split(self.workspacePath)[0]))
+                                                                initialDir=self.workspace.fileRule('scene', self.workspace.root)))
         self.iScenePath.grid(row=rowCounter, column=1, sticky='NW')
 
         rowCounter += 1
@@ -921,10 +1660,73 @@ class ManagerUI(tk.Frame):
 
         rowCounter += 1
 
+        # Priority
+        lblPriority = tk.Label(self.msgWin, text="Priority : ")
+        lblPriority.grid(row=rowCounter, column=0, sticky='NE', padx=btnPad, pady=btnPad)
+
+        self.iPriority = tk.Entry(self.msgWin, width=5)
+        self.iPriority.grid(row=rowCounter, column=1, sticky='NW')
+        self.iPriority.insert(0, self.defaults['priority'])
+
+        rowCounter += 1
+
+        # Splitting the frame range over every host
+        self.varSplitFrames = tk.IntVar()
+        chkSplitFrames = tk.Checkbutton(self.msgWin, 
+                                        text='Split across hosts, frames per job : ', 
+                                        variable = self.varSplitFrames, 
+                                        command=self.onSplitFramesToggle)
+        chkSplitFrames.grid(row=rowCounter, column=0, sticky='NE', padx=btnPad, pady=btnPad)
+
+        self.iChunkSize = tk.Entry(self.msgWin, width=5)
+        self.iChunkSize.grid(row=rowCounter, column=1, sticky='NW', padx=btnPad, pady=btnPad)
+        modifyDisabledText(self.iChunkSize, self.defaults['chunkSize'])
+
+        rowCounter += 1
+
+        self.varDynamicDispatch = tk.IntVar()
+        self.chkDynamicDispatch = tk.Checkbutton(self.msgWin, 
+                                                 text='Balance batches by host speed', 
+                                                 variable = self.varDynamicDispatch)
+        self.chkDynamicDispatch.grid(row=rowCounter, column=1, sticky='NW', padx=btnPad, pady=btnPad)
+
+        self.onSplitFramesToggle()
+
+        rowCounter += 1
+
+        # Copying frames back while the job renders
+        self.varCollectFrames = tk.IntVar()
+        chkCollectFrames = tk.Checkbutton(self.msgWin, 
+                                          text='Copy frames as they render to : ', 
+                                          variable = self.varCollectFrames, 
+                                          command=self.onCollectFramesToggle)
+        chkCollectFrames.grid(row=rowCounter, column=0, sticky='NE', padx=btnPad, pady=btnPad)
+
+        self.iCollectPath = tk.Entry(self.msgWin, width=20)
+        self.iCollectPath.grid(row=rowCounter, column=1, sticky='NW', padx=btnPad, pady=btnPad)
+        self.iCollectPath.bind("<Double-Button-1>", lambda event: self.getDirectory(self.iCollectPath, self.msgWin))
+
+        self.onCollectFramesToggle()
+
+        rowCounter += 1
+
         # Verify button #
         btnCheck = ttk.Button(self.msgWin, text="Ok", command=self.verifyNewJob)
         btnCheck.grid(row=rowCounter, column=0, columnspan=2, sticky='N')
 
+    def onHostSelect(self):
+        host = self.iHost.get()
+        info = self.hostTelemetry.info(host)
+        if info:
+            text = '%d cores, load %.2f, %d MB free' % (info.cores, info.load1, info.freeMemory / (1024*1024))
+        else:
+            text = 'No host information'
+
+        rate = self.renderQueue.hostThroughput(host)
+        if rate:
+            text += '\n%.1f frames/h, busy for %s' % (rate, mayaJob.formatDuration(self.renderQueue.hostEta(host)))
+        self.lblHostInfo.config(text=text)
+
     def onCamOverrideToggle(self):
         if self.varCameraOverride.get():
             self.entCamOverride.config(state='normal')
@@ -932,6 +1734,23 @@ class ManagerUI(tk.Frame):
             self.entCamOverride.config(state='disabled')
             modifyDisabledText(self.entCamOverride, self.defaults['camOverride'])
 
+    def onSplitFramesToggle(self):
+        if self.varSplitFrames.get():
+            self.iChunkSize.config(state='normal')
+            self.chkDynamicDispatch.config(state='normal')
+        else:
+            self.iChunkSize.config(state='disabled')
+            self.chkDynamicDispatch.config(state='disabled')
+            self.varDynamicDispatch.set(0)
+            modifyDisabledText(self.iChunkSize, self.defaults['chunkSize'])
+
+    def onCollectFramesToggle(self):
+        if self.varCollectFrames.get():
+            self.iCollectPath.config(state='normal')
+        else:
+            self.iCollectPath.config(state='disabled')
+            modifyDisabledText(self.iCollectPath, self.defaults['collectDir'])
+
     def onResOverrideToggle(self):
         if self.varResolutionOverride.get():
             self.iResolutionOverride_1.config(state='normal')
@@ -955,10 +1774,6 @@ class ManagerUI(tk.Frame):
         if self.varResolutionOverride.get():
             args['resolutionOverride'] = [self.iResolutionOverride_1.get(), self.iResolutionOverride_2.get()]
 
-        if not verifyHost(args['host']):
-            displayError('Host error', 'Please enter valid host', self.logger)
-            return
-
         if not os.path.exists(args['scenePath']):
             displayError('Host error', 'Please enter a valid scene file', self.logger)
             return
@@ -1003,8 +1818,53 @@ class ManagerUI(tk.Frame):
                 displayError('Invalid setting', 'Please enter %s'%arg, self.logger)
                 return
 
-        self.addJob(**args)
-        self.msgWin.destroy()
+        try:
+            priority = int(self.iPriority.get() or 0)
+        except ValueError:
+            displayError('Invalid setting', 'Please enter a valid priority', self.logger)
+            return
+
+        chunkSize = None
+        if self.varSplitFrames.get():
+            try:
+                chunkSize = int(self.iChunkSize.get())
+                if chunkSize < 1:
+                    raise ValueError
+            except ValueError:
+                displayError('Invalid setting', 'Please enter a positive number of frames per job', self.logger)
+                return
+
+        dispatch = 'dynamic' if self.varDynamicDispatch.get() else 'static'
+
+        collectPath = None
+        if self.varCollectFrames.get():
+            collectPath = self.iCollectPath.get()
+            if not collectPath:
+                displayError('Invalid setting', 'Please enter a directory to copy the frames to', self.logger)
+                return
+
+        jobArgs = dict(args, priority=priority, chunkSize=chunkSize, dispatch=dispatch, collectPath=collectPath)
+
+        # Only a host that has answered is accepted, one that's never been seen 
+        # is checked on a jobPreparer thread and the job added from refreshUI
+        reachable = self.hostStatus.isReachable(args['host'])
+        if reachable is None:
+            self.jobPreparer.call(self.checkNewJobHost, jobArgs)
+        else:
+            self.finishNewJob(reachable, jobArgs)
+
+    def checkNewJobHost(self, jobArgs):
+        reachable = self.hostStatus.check(jobArgs['host'], ManagerUI.HOST_CHECK_DEADLINE)
+        self.hostsChecked.put((reachable, jobArgs))
+
+    def finishNewJob(self, reachable, jobArgs):
+        if reachable is not True:
+            displayError('Host error', 'Please enter valid host', self.logger)
+            return
+
+        self.addJob(**jobArgs)
+        if self.msgWin.winfo_exists():
+            self.msgWin.destroy()
         
 
 def main():
@@ -0,0 +1,420 @@
+#!/usr/bin/python
+
+import os
+import re
+import sys
+import time
+import heapq
+import errno
+import fcntl
+import types
+import select
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+
+import mayaJob
+
+"""
+An alternative way of driving jobs, without an interactive pxssh session
+per job.
+
+Everything a job does (logging in, launching Render, tailing the maya log
+and noticing when it's done) is written as a coroutine (a plain generator),
+and a single Engine thread runs all of them. Coroutines yield what they
+are waiting for :
+  Sleep(seconds)  - resume after a delay
+  Readable(fd)    - resume once the file descriptor has data (or hit EOF)
+  <generator>     - run another coroutine and resume with its result,
+                    which it gives back with 'raise Return(value)'
+
+The remote side is a plain 'ssh host command' subprocess with its output
+read through a pipe, so nothing ever blocks the engine thread and hundreds
+of jobs cost nothing while they have nothing to say.
+"""
+
+class Sleep:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+class Readable:
+    def __init__(self, fd):
+        self.fd = fd
+
+class Return(Exception):
+    def __init__(self, value=None):
+        Exception.__init__(self, value)
+        self.value = value
+
+class Task:
+    def __init__(self, coroutine, name):
+        self.stack = [coroutine]
+        self.name = name
+
+def waitForExit(proc, onOutput=None, readSize=4096):
+    """
+    Coroutine, reads proc.stdout until EOF (passing each chunk to onOutput)
+    and returns the exit status once the process ends
+    """
+    fd = proc.stdout.fileno()
+    while True:
+        yield Readable(fd)
+        try:
+            data = os.read(fd, readSize)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                continue
+            data = ''
+        if not data:
+            break
+        if onOutput:
+            onOutput(data)
+    proc.stdout.close()
+
+    while proc.poll() is None:
+        yield Sleep(0.05)
+
+    raise Return(proc.returncode)
+
+class Engine(threading.Thread):
+    POLL_IN = select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR
+
+    def __init__(self, logger=None):
+        threading.Thread.__init__(self, name='JobEngine')
+        self.daemon = True
+
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._ready = deque()
+        self._timers = []
+        self._timerCount = 0
+        self._readers = {}
+
+        self._incoming = []
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self._poller = select.poll()
+
+        self._wakeRead, self._wakeWrite = os.pipe()
+        fcntl.fcntl(self._wakeWrite, fcntl.F_SETFL, fcntl.fcntl(self._wakeWrite, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._poller.register(self._wakeRead, select.POLLIN)
+
+    def spawn(self, coroutine, name=None):
+        """
+        Schedules a coroutine to run on the engine, safe to call from any thread
+        """
+        with self._lock:
+            self._incoming.append(Task(coroutine, name or repr(coroutine)))
+        self.wake()
+
+    def wake(self):
+        try:
+            os.write(self._wakeWrite, 'x')
+        except OSError:
+            pass
+
+    def stop(self):
+        self._stopped = True
+        self.wake()
+
+    @property
+    def taskCount(self):
+        return len(self._ready) + len(self._timers) + len(self._readers)
+
+    def run(self):
+        self.logger.info('Job engine starting')
+
+        while not self._stopped:
+            with self._lock:
+                self._ready.extend(self._incoming)
+                self._incoming = []
+
+            # Only run what's ready now, anything that plain yields goes round again after polling
+            for i in range(len(self._ready)):
+                self.__step(self._ready.popleft())
+
+            if self._ready:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0.0, self._timers[0][0] - time.time()) * 1000.0
+            else:
+                timeout = None
+
+            try:
+                events = self._poller.poll(timeout)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                if fd == self._wakeRead:
+                    os.read(self._wakeRead, 512)
+                    continue
+
+                task = self._readers.pop(fd, None)
+                self._poller.unregister(fd)
+                if task:
+                    self._ready.append(task)
+
+            now = time.time()
+            while self._timers and self._timers[0][0] <= now:
+                self._ready.append(heapq.heappop(self._timers)[2])
+
+        self.logger.info('Job engine stopping')
+        os.close(self._wakeRead)
+        os.close(self._wakeWrite)
+
+    def __step(self, task):
+        value = None
+        error = None
+        while True:
+            coroutine = task.stack[-1]
+            try:
+                if error:
+                    op = coroutine.throw(*error)
+                    error = None
+                else:
+                    op = coroutine.send(value)
+            except (StopIteration, Return), e:
+                task.stack.pop()
+                if not task.stack:
+                    return
+                value = e.value if isinstance(e, Return) else None
+                continue
+            except Exception, e:
+                task.stack.pop()
+                if not task.stack:
+                    self.logger.error('Unhandled error in task %s : %s' % (task.name, e), exc_info=sys.exc_info())
+                    return
+                error = sys.exc_info()
+                continue
+
+            value = None
+            if isinstance(op, types.GeneratorType):
+                task.stack.append(op)
+            elif isinstance(op, Sleep):
+                self._timerCount += 1
+                heapq.heappush(self._timers, (time.time() + op.seconds, self._timerCount, task))
+                return
+            elif isinstance(op, Readable):
+                self._readers[op.fd] = task
+                self._poller.register(op.fd, Engine.POLL_IN)
+                return
+            else:
+                # Plain yield, give everything else a turn first
+                self._ready.append(task)
+                return
+
+class EngineJob(mayaJob.Job):
+    """
+    A mayaJob.Job run by an Engine, it keeps the same states & properties so
+    the UI can treat it like any other job.
+
+    The render runs under 'ssh -tt' so it's hung up (and dies) along with
+    the ssh process if the job is killed. A detachable job's ssh only lasts
+    as long as launching the render does, from then on the render is 
+    followed through its log and controlled by PID like a mayaJob.Job's.
+    """
+
+    CONNECT_TIMEOUT = 5
+    LOG_POLL_INTERVAL = 0.5
+    PID_RE = re.compile(r'RENDER_PID (\d+)')
+
+    def __init__(self, engine, *args, **kwargs):
+        self._engine = engine
+        self._proc = None
+        self._loginPending = True
+        self._sessionResult = None
+
+        mayaJob.Job.__init__(self, *args, **kwargs)
+
+        # So getNewInstanceofJob gets put on the same engine
+        self.originalArgs['engine'] = engine
+
+    def _connect(self):
+        # Stays Connecting until _login hears back
+        self.process = None
+        self._engine.spawn(self._login(), 'login %s' % repr(self))
+
+    def _sshCommand(self, *command):
+        return ['ssh',
+                '-o', 'BatchMode=yes',
+                '-o', 'ConnectTimeout=%d' % EngineJob.CONNECT_TIMEOUT,
+                '%s@%s' % (self._user, self._host)] + list(command)
+
+    def _spawn(self, command):
+        return subprocess.Popen(command,
+                                stdin=open(os.devnull),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                close_fds=True)
+
+    def _login(self):
+        try:
+            proc = self._spawn(self._sshCommand('true'))
+            status = yield waitForExit(proc)
+        except OSError, e:
+            self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+            status = 255
+
+        self._loginPending = False
+
+        if self._state != 'n':
+            # Closed while logging in
+            return
+
+        # ssh returns 255 when it couldn't connect or authenticate
+        if status == 255:
+            self.logger.error(('{0} Cannot log on as %s@%s' % (self._user, self._host)).format(repr(self)))
+            self._errorCode = 256
+            self._onComplete(success=False)
+        else:
+            self._setState('i')
+
+    def _render(self):
+        while self._loginPending:
+            yield Sleep(0.1)
+
+        if self.completed():
+            return
+
+        self.logger.info(('{0} Executing remote process on %s' % self.host).format(repr(self)))
+        try:
+            self._proc = self._spawn(['ssh', '-tt'] + self._sshCommand(self._remoteCommand())[1:])
+        except OSError, e:
+            self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+            self._onComplete(success=False)
+            return
+
+        self._engine.spawn(self._tailLog(), 'tail %s' % repr(self))
+
+        status = yield waitForExit(self._proc, self._onSessionOutput, mayaJob.Job.SESSION_READ_SIZE)
+        self.logger.debug(('{0} ssh exited with status %s' % status).format(repr(self)))
+
+        if self._detached:
+            # Hung up on purpose, the render is still going
+            return
+
+        if self._detachable:
+            if self._pid is None:
+                self.logger.error(('{0} Render did not start on %s' % self.host).format(repr(self)))
+                self._onComplete(success=False)
+            else:
+                self.logger.info(('{0} Render running on %s as PID %d' % (self.host, self._pid)).format(repr(self)))
+            # _tailLog follows it from here
+            return
+
+        # Catch up with the end of the log, this may well complete the job by itself
+        mayaJob.Job.pollLog(self)
+
+        if not self.completed():
+            self._onComplete(success=bool(self._sessionResult))
+
+    def _tailLog(self):
+        while not self.completed() and not self._detached:
+            mayaJob.Job.pollLog(self)
+            yield Sleep(EngineJob.LOG_POLL_INTERVAL)
+
+    def _onSessionOutput(self, data):
+        newLines = (self._sshPartial + data).split('\n')
+        self._sshPartial = newLines.pop()
+        newLines = [ line.rstrip('\r') for line in newLines ]
+        self._sshOutput.extend(newLines)
+
+        for line in newLines:
+            match = EngineJob.PID_RE.search(line)
+            if match:
+                self._pid = int(match.group(1))
+            elif 'COMPLETE_SUCCESS' in line:
+                self._sessionResult = True
+            elif 'COMPLETE_ERROR' in line:
+                self._sessionResult = False
+
+    def run(self):
+        if self._state == 'i':
+            self._setState('r')
+            self._engine.spawn(self._render(), 'render %s' % repr(self))
+
+    def update(self):
+        """
+        Nothing to do, the engine drives this job
+        """
+        pass
+
+    def readSession(self):
+        pass
+
+    def pollLog(self):
+        pass
+
+    def fileno(self):
+        return None
+
+    def _reattach(self):
+        mayaJob.Job._reattach(self)
+        # Nothing to log in to, the log is all there is to follow
+        self._loginPending = False
+        self._engine.spawn(self._tailLog(), 'tail %s' % repr(self))
+
+    def _dropSession(self):
+        if self._proc and self._proc.poll() is None:
+            self.logger.debug(("{0} Hanging up ssh session to %s" % self.host).format(repr(self)))
+            try:
+                self._proc.terminate()
+            except OSError, e:
+                self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+
+    def pause(self):
+        if self._sessionless():
+            mayaJob.Job.pause(self)
+            return
+
+        if self._state == 'r' and self._proc:
+            self.logger.info(('{0} Job paused').format(repr(self)))
+            self._proc.send_signal(signal.SIGSTOP)
+            self._setState('p')
+
+    def resume(self):
+        if self._sessionless():
+            mayaJob.Job.resume(self)
+            return
+
+        if self._state == 'p' and self._proc:
+            self.logger.info(('{0} Job resumed').format(repr(self)))
+            self._proc.send_signal(signal.SIGCONT)
+            self._setState('r')
+
+    def kill(self):
+        if self._sessionless():
+            mayaJob.Job.kill(self)
+            return
+
+        self.resume()
+        if self._proc and self._proc.poll() is None:
+            self.logger.debug(("{0} Terminating ssh session to %s" % self.host).format(repr(self)))
+            try:
+                self._proc.terminate()
+            except OSError, e:
+                self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+        if not self.completed():
+            self._state = 'e' if self.errorCode else 'c'
+
+    def close(self):
+        if self._state == 'n':
+            mayaJob.Job.close(self)
+            return
+
+        self.logger.info(('{0} Closing session').format(repr(self)))
+        self.kill()
+
+        if not self.completed():
+            self._onComplete(success=False)
+
+        self._drainLog()
+
+    def completed(self):
+        return self._state == 'c' or self._state == 'e'
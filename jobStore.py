@@ -0,0 +1,157 @@
+#!/usr/bin/python
+
+import json
+import time
+import Queue
+import logging
+import sqlite3
+import threading
+
+"""
+Keeps the job list in an SQLite database so it survives the manager being
+closed (or crashing), see ManagerUI.restoreJobs.
+
+Each top level job is a row holding its snapshot (see mayaJob.Job.snapshot)
+as JSON. The whole list is handed over at most every INTERVAL seconds and
+written by the store's own thread, only the rows that changed are touched
+and each save is one transaction, so nothing waits on the disk and a busy
+farm costs a handful of small writes a minute. If the writer falls behind
+only the newest list is written.
+"""
+
+class JobStore:
+    INTERVAL = 5.0
+    # How long to wait on the database being locked by something else
+    LOCK_TIMEOUT = 10.0
+
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS jobs ('
+              'id TEXT PRIMARY KEY, '
+              'position INTEGER NOT NULL, '
+              'snapshot TEXT NOT NULL, '
+              'updated REAL NOT NULL)')
+
+    def __init__(self, path, interval=INTERVAL, logger=None):
+        """
+        Raises IOError if the database can't be opened
+        """
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.path = path
+        self.interval = interval
+
+        # What's in the database, id -> (position, snapshot JSON)
+        self._written = {}
+        self._lastSave = 0.0
+        self._pending = Queue.Queue()
+        self._lock = threading.Lock()
+
+        try:
+            connection = self.__connect()
+            try:
+                connection.execute(JobStore.SCHEMA)
+                connection.commit()
+                for id, position, text in connection.execute('SELECT id, position, snapshot FROM jobs'):
+                    self._written[id] = (position, text)
+            finally:
+                connection.close()
+        except sqlite3.Error, e:
+            raise IOError('Cannot open job store %s : %s' % (path, e))
+
+        self.logger.info('Job store %s holds %d jobs' % (path, len(self._written)))
+
+        self._writer = threading.Thread(target=self.__write, name='JobStore')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def load(self):
+        """
+        The saved snapshots, in job list order
+        """
+        with self._lock:
+            rows = sorted(self._written.items(), key=lambda row: row[1][0])
+
+        snapshots = []
+        for id, (position, text) in rows:
+            try:
+                snapshots.append(json.loads(text))
+            except ValueError, e:
+                self.logger.error('Skipping unreadable job %s in the job store : %s' % (id, e))
+        return snapshots
+
+    def due(self):
+        """
+        Whether it's time for the next save
+        """
+        return time.time() - self._lastSave >= self.interval
+
+    def save(self, snapshots):
+        """
+        Queues the whole job list (a snapshot per job, in order) to be written,
+        jobs missing from it are deleted
+        """
+        self._lastSave = time.time()
+        self._pending.put(snapshots)
+
+    def close(self):
+        """
+        Writes whatever is still queued and stops the writer
+        """
+        self._pending.put(None)
+        self._writer.join()
+
+    def __connect(self):
+        connection = sqlite3.connect(self.path, timeout=JobStore.LOCK_TIMEOUT)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def __write(self):
+        connection = None
+        stopping = False
+
+        while not stopping:
+            snapshots = self._pending.get()
+            stopping = snapshots is None
+
+            # Skip to the newest list
+            while not stopping:
+                try:
+                    newer = self._pending.get_nowait()
+                except Queue.Empty:
+                    break
+                if newer is None:
+                    stopping = True
+                else:
+                    snapshots = newer
+
+            if snapshots is None:
+                continue
+
+            try:
+                if connection is None:
+                    connection = self.__connect()
+                self.__apply(connection, snapshots)
+            except (sqlite3.Error, TypeError, ValueError), e:
+                self.logger.error('Cannot save jobs to %s : %s' % (self.path, e))
+
+        if connection is not None:
+            connection.close()
+
+    def __apply(self, connection, snapshots):
+        rows = {}
+        for position, snapshot in enumerate(snapshots):
+            rows[snapshot['id']] = (position, json.dumps(snapshot, sort_keys=True))
+
+        now = time.time()
+        changed = [ (id, position, text, now) for id, (position, text) in rows.iteritems() if self._written.get(id) != (position, text) ]
+        removed = [ (id,) for id in self._written if id not in rows ]
+        if not changed and not removed:
+            return
+
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO jobs (id, position, snapshot, updated) VALUES (?, ?, ?, ?)', changed)
+            connection.executemany('DELETE FROM jobs WHERE id = ?', removed)
+
+        with self._lock:
+            self._written = rows
+        self.logger.debug('Saved %d jobs, removed %d' % (len(changed), len(removed)))
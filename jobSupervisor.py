@@ -0,0 +1,253 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import select
+import Queue
+import logging
+import functools
+import threading
+
+"""
+Drives every job's ssh session from a single thread.
+
+Each session's pty is registered with one poll object, so the thread only
+wakes up when a session actually has something to say (or when it's time
+for the periodic tick that tails the maya logs and starts queued jobs, 
+which also happens as soon as any session finishes).
+Idle sessions cost nothing, and every wake only does non-blocking reads so
+it finishes in bounded time regardless of how many jobs there are.
+
+The slow part of setting a job up (reading the scene, making log files and
+logging in) is done off the UI thread by a JobPreparer.
+"""
+
+class SessionSupervisor(threading.Thread):
+    POLL_IN = select.POLLIN | select.POLLPRI
+    POLL_BROKEN = select.POLLHUP | select.POLLERR | select.POLLNVAL
+
+    def __init__(self, interval, onTick=None, onStop=None, logger=None):
+        """
+        interval : Seconds between ticks (log polling & onTick)
+        onTick   : Called from the supervisor thread every tick
+        onStop   : Called from the supervisor thread once the loop finishes
+        """
+        threading.Thread.__init__(self, name='SessionSupervisor')
+        self.daemon = True
+
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._interval = interval
+        self._onTick = onTick
+        self._onStop = onStop
+
+        self._jobs = []
+        self._fds = {}
+        # Jobs whose session hung up, these aren't polled again
+        self._broken = set()
+        self._lock = threading.Lock()
+        self._stopped = False
+
+        self._poller = select.poll()
+
+        # Writing to this pipe wakes the loop up early (new jobs, interval changes, stopping)
+        self._wakeRead, self._wakeWrite = os.pipe()
+        fcntl.fcntl(self._wakeWrite, fcntl.F_SETFL, fcntl.fcntl(self._wakeWrite, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._poller.register(self._wakeRead, select.POLLIN)
+
+    def add(self, job):
+        with self._lock:
+            if job not in self._jobs:
+                self._jobs.append(job)
+        self.wake()
+
+    def remove(self, job):
+        with self._lock:
+            if job in self._jobs:
+                self._jobs.remove(job)
+            self._broken.discard(job)
+        self.wake()
+
+    def setInterval(self, interval):
+        if interval != self._interval:
+            self.logger.debug('Supervisor tick interval %f -> %f' % (self._interval, interval))
+            self._interval = interval
+            self.wake()
+
+    @property
+    def interval(self):
+        return self._interval
+
+    def wake(self):
+        try:
+            os.write(self._wakeWrite, 'x')
+        except OSError:
+            pass
+
+    def stop(self):
+        self._stopped = True
+        self.wake()
+
+    def run(self):
+        self.logger.info('Session supervisor starting')
+        nextTick = time.time()
+
+        while not self._stopped:
+            self.__syncRegistrations()
+
+            timeout = max(0.0, nextTick - time.time())
+            try:
+                events = self._poller.poll(timeout * 1000.0)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd, event in events:
+                if fd == self._wakeRead:
+                    os.read(self._wakeRead, 512)
+                    continue
+
+                job = self._fds.get(fd)
+                if job is None:
+                    continue
+
+                try:
+                    job.readSession()
+                except Exception, e:
+                    self.logger.error('Error reading session of %s : %s' % (repr(job), e), exc_info=sys.exc_info())
+
+                if event & SessionSupervisor.POLL_BROKEN:
+                    self._broken.add(job)
+                    self.__unregister(fd)
+                elif job.completed():
+                    self.__unregister(fd)
+
+                if job.completed():
+                    # Tick straight away so whatever is queued behind it can start
+                    nextTick = time.time()
+
+            if time.time() >= nextTick:
+                self.__tick()
+                nextTick = time.time() + self._interval
+
+        self.logger.info('Session supervisor stopping')
+        if self._onStop:
+            self._onStop()
+
+        os.close(self._wakeRead)
+        os.close(self._wakeWrite)
+
+    def __tick(self):
+        with self._lock:
+            jobs = list(self._jobs)
+
+        for job in jobs:
+            if not job.completed():
+                try:
+                    job.pollLog()
+                except Exception, e:
+                    self.logger.error('Error polling log of %s : %s' % (repr(job), e), exc_info=sys.exc_info())
+
+        if self._onTick:
+            try:
+                self._onTick()
+            except Exception, e:
+                self.logger.error('Error in supervisor tick : %s' % e, exc_info=sys.exc_info())
+
+    def __syncRegistrations(self):
+        """
+        Registers new sessions and drops ones that finished or were removed
+        """
+        with self._lock:
+            jobs = list(self._jobs)
+
+        wanted = {}
+        for job in jobs:
+            if job.completed() or job in self._broken:
+                continue
+            fd = job.fileno()
+            if fd is not None and fd >= 0:
+                wanted[fd] = job
+
+        for fd in self._fds.keys():
+            if wanted.get(fd) is not self._fds[fd]:
+                self.__unregister(fd)
+
+        for fd, job in wanted.iteritems():
+            if fd not in self._fds:
+                self._poller.register(fd, SessionSupervisor.POLL_IN)
+                self._fds[fd] = job
+
+    def __unregister(self, fd):
+        try:
+            self._poller.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+        self._fds.pop(fd, None)
+
+class JobPreparer:
+    """
+    A few worker threads that run prepare() on jobs created with deferred=True,
+    so adding a job never waits on the network. Anything else that talks to a
+    host (pausing or killing a detached render...) can be handed over with call()
+    """
+    WORKERS = 8
+
+    def __init__(self, workers=WORKERS, onReady=None, logger=None):
+        """
+        onReady : Called from a worker thread with each job once it's prepared
+                  (whether it made it to Idle or not)
+        """
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._onReady = onReady
+        self._queue = Queue.Queue()
+        self._workers = []
+
+        for i in range(workers):
+            worker = threading.Thread(target=self.__work, name='JobPreparer-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, job):
+        self._queue.put((job.prepare, job))
+
+    def call(self, function, *args):
+        """
+        Runs function(*args) on a worker thread
+        """
+        self._queue.put((functools.partial(function, *args), None))
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def stop(self):
+        for worker in self._workers:
+            self._queue.put(None)
+
+    def __work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            function, job = item
+            try:
+                function()
+            except Exception, e:
+                if job is not None:
+                    self.logger.error('Error preparing %s : %s' % (repr(job), e), exc_info=sys.exc_info())
+                else:
+                    self.logger.error('Error in job control : %s' % e, exc_info=sys.exc_info())
+
+            if job is not None and self._onReady:
+                try:
+                    self._onReady(job)
+                except Exception, e:
+                    self.logger.error('Error after preparing %s : %s' % (repr(job), e), exc_info=sys.exc_info())
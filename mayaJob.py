@@ -16,7 +16,15 @@ import re
 import logging
 import json
 import uuid
+import threading
 import signal
+import pipes
+import errno
+import fcntl
+from collections import deque
+from itertools import islice
+
+import sceneInfo
 
 """
 PROBLEMS:
@@ -24,13 +32,13 @@ PROBLEMS:
     + Disable shared SSH connections when using this.
 
  - Pausing/unpausing (SIGSTOP/SIGCONT respectively) fails to affect the render process, unsure if it pauses the shell itself successfully. This worked at one point, unsure what broke it.
-    + This functionality is disabled in the UI for now.
+    + The signals go to the local ssh process, not maya.bin. Jobs started with detachable=True run the render in its own process group on the host and signal that instead, so pausing is only enabled in the UI for those.
 
  - Primitive way of error checking, will first check the session output for COMPLETE_SUCCESS or COMPLETE_ERROR (these are printed when the render process ends) and then grabs the latest output from the log files, using it to parse out the progress percentage & current frame number.
     + The job output is updated as the session is polled, this is displayed to the user via the UI and may be used for error checking if the script fails to figure it out itself.
 
- - If the process was killed remotely (ie, ssh'ing directly into the machine and killing the maya.bin process) then the job may not notice and will just carry on running without ever changing state. This isn't a huge problem as you will probably notice that it has timed out and can terminate it manually. 
-    + Adding a timeout for how long the job will go without an obvious update could work 
+ - If the process was killed remotely (ie, ssh'ing directly into the machine and killing the maya.bin process) then the job may not notice and will just carry on running without ever changing state. 
+    + stallWatchdog.StallWatchdog looks out for jobs that have gone quiet for much longer than usual, checks the render is still running on the host and fails the job (markStalled) if not.
 
 
 
@@ -40,10 +48,480 @@ WHAT IT DOES:
  - On process exit > 
   - If COMPLETE_SUCCESS is read then the session is terminated
   - If COMPLETE_ERROR is read then the session is terminated and the log file parsed for 'maya exited with error(x)', then we can grab the error code
+ - Jobs started with detachable=True launch the render detached (setsid) with its PID and exit status kept in files on the host (see RUN_DIR), the session goes back to the pool straight away. Status & signals are then short ssh commands of their own
+ - Such jobs can be let go of (detach) without stopping the render, and picked back up from a snapshot() by restore(), which asks the host how the render is doing and follows it through its log from there
+ - With streamLog=True maya logs to a file on the host (next to the PID file) and the log is streamed back over ssh by LogStream into the local copy, so nothing relies on the home directory being shared
 
  - 
 """
 
+def formatDuration(seconds):
+  if seconds is None:
+    return '-'
+  minutes, seconds = divmod(int(seconds), 60)
+  hours, minutes = divmod(minutes, 60)
+  return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+def formatThroughput(framesPerHour, eta):
+  """
+  Rate & ETA as shown after a job in the job list, empty until there's a rate
+  """
+  if not framesPerHour:
+    return ''
+  return ' [%.1f frames/h, ETA %s]' % (framesPerHour, formatDuration(eta))
+
+def renderPattern(logPath):
+  """
+  pgrep/pkill -f pattern matching the render of the job logging to logPath. 
+  The log path is on the command line of both Render and maya.bin, it's 
+  matched as '[/]path' so the pattern doesn't match the shell running pkill
+  """
+  pattern = ''.join( c if c.isalnum() or c in '/_-: ' else '\\^' if c == '^' else '[%s]' % c for c in logPath )
+  return '[%s]%s' % (logPath[0], pattern[1:])
+
+def communicate(proc, timeout):
+  """
+  proc.communicate() for a process started with stdout=PIPE, except that the 
+  process is killed if it hasn't finished within timeout seconds (ssh's 
+  ConnectTimeout doesn't cover a host that connects and then hangs). Returns 
+  the output, or None if the process had to be killed
+  """
+  expired = []
+  def expire():
+    expired.append(True)
+    try:
+      proc.kill()
+    except OSError:
+      pass
+
+  timer = threading.Timer(timeout, expire)
+  timer.daemon = True
+  timer.start()
+  try:
+    output = proc.communicate()[0]
+  finally:
+    timer.cancel()
+
+  return None if expired else output
+
+class Throughput:
+  """
+  A compact time series of how many frames a job has done (fractions for
+  the frame in progress), used for a rate smoothed over the last WINDOW 
+  seconds. Samples closer together than SPACING replace each other, so 
+  it never holds more than about WINDOW/SPACING of them.
+  """
+  WINDOW = 1800.0
+  SPACING = 10.0
+
+  def __init__(self, window=WINDOW, spacing=SPACING):
+    self.window = window
+    self.spacing = spacing
+    self._samples = deque()
+
+  def record(self, framesDone, now=None):
+    now = time.time() if now is None else now
+    if len(self._samples) > 1 and now - self._samples[-2][0] < self.spacing:
+      self._samples[-1] = (now, framesDone)
+    else:
+      self._samples.append((now, framesDone))
+
+    # Always keeping two so there's still a rate after a long quiet spell
+    while len(self._samples) > 2 and now - self._samples[1][0] > self.window:
+      self._samples.popleft()
+
+  def samples(self):
+    return list(self._samples)
+
+  @property
+  def framesDone(self):
+    return self._samples[-1][1] if self._samples else 0.0
+
+  def framesPerHour(self, now=None):
+    """
+    Frames per hour over the window, counting up to now so a job that's 
+    gone quiet slows down. None until there are two samples
+    """
+    if len(self._samples) < 2:
+      return None
+    now = time.time() if now is None else now
+    (first, firstDone), lastDone = self._samples[0], self._samples[-1][1]
+    if now <= first:
+      return None
+    return 3600.0 * (lastDone - firstDone) / (now - first)
+
+class RingBuffer:
+  """
+  Fixed capacity buffer of text lines, the oldest lines are dropped once 
+  either the line or byte limit is exceeded (a limit of None means unbounded).
+
+  sequence is the total number of lines ever appended, so a reader can tell
+  which lines it hasn't seen yet even after the start has been dropped, see 
+  since(). Safe to read from one thread while another appends.
+  """
+
+  def __init__(self, maxLines=None, maxBytes=None):
+    self.maxLines = maxLines
+    self.maxBytes = maxBytes
+    self.sequence = 0
+    self._lines = deque()
+    self._bytes = 0
+    self._lock = threading.Lock()
+
+  def append(self, line):
+    self.extend([line])
+
+  def extend(self, lines):
+    with self._lock:
+      for line in lines:
+        self._lines.append(line)
+        self._bytes += len(line)
+        self.sequence += 1
+      self.__trim()
+
+  def clear(self):
+    with self._lock:
+      self._lines.clear()
+      self._bytes = 0
+
+  def lines(self):
+    with self._lock:
+      return list(self._lines)
+
+  def since(self, sequence):
+    """
+    The lines appended after line number sequence, the sequence number they 
+    run up to, and whether they follow straight on from sequence (False if 
+    lines in between have already been dropped, all that's left is returned)
+    """
+    with self._lock:
+      new = self.sequence - sequence
+      if new <= 0:
+        return [], self.sequence, new == 0
+      if new > len(self._lines):
+        return list(self._lines), self.sequence, False
+      return list(islice(self._lines, len(self._lines) - new, None)), self.sequence, True
+
+  def __trim(self):
+    while self._lines and ((self.maxLines is not None and len(self._lines) > self.maxLines) or
+                           (self.maxBytes is not None and self._bytes > self.maxBytes)):
+      self._bytes -= len(self._lines.popleft())
+
+  def __len__(self):
+    return len(self._lines)
+
+  def __iter__(self):
+    return iter(self._lines)
+
+  @property
+  def size(self):
+    return self._bytes
+
+class LogTail:
+  """
+  Incrementally reads a file that is being appended to by another process.
+
+  Only the bytes written since the last read are touched, any trailing 
+  partial line is carried over until the rest of it arrives. If the file 
+  is replaced (inode changes or the first few bytes differ) or truncated 
+  (shrinks below the offset) reading starts again from the beginning of 
+  the new file.
+  """
+
+  # Upper limit on how much is read in one go so a huge backlog can't stall a poll
+  MAX_READ = 4 * 1024 * 1024
+  # Number of bytes from the start of the file used to recognise it after an inode gets reused
+  HEAD_SIZE = 64
+
+  def __init__(self, path, offset=0):
+    self.path = path
+    self.offset = offset
+    self._inode = None
+    self._head = ''
+    self._partial = ''
+
+  def reset(self):
+    self.offset = 0
+    self._head = ''
+    self._partial = ''
+
+  def readLines(self):
+    """
+    Returns the list of complete lines appended since the last call
+    """
+    with open(self.path, 'r') as f:
+      stat = os.fstat(f.fileno())
+
+      if self._inode is not None and stat.st_ino != self._inode:
+        # Log was rotated or recreated
+        self.reset()
+      elif stat.st_size < self.offset:
+        # Log was truncated
+        self.reset()
+      elif self._head and f.read(len(self._head)) != self._head:
+        # Log was recreated with the same inode
+        self.reset()
+      self._inode = stat.st_ino
+
+      if stat.st_size == self.offset:
+        return []
+
+      f.seek(self.offset)
+      data = f.read(LogTail.MAX_READ)
+      if len(self._head) < LogTail.HEAD_SIZE and self.offset == len(self._head):
+        self._head = (self._head + data)[:LogTail.HEAD_SIZE]
+      self.offset = f.tell()
+
+    lines = (self._partial + data).split('\n')
+    self._partial = lines.pop()
+    return [ line.rstrip('\r') for line in lines ]
+
+  @property
+  def lineOffset(self):
+    """
+    Offset just past the last complete line read, where a new LogTail 
+    should start to carry on from here without losing a line
+    """
+    return self.offset - len(self._partial)
+
+  def finish(self, timeout):
+    """
+    The rest of the log once its writer is done, the last line included 
+    even without a newline. The file is local so it never waits, timeout is
+    there to match LogStream.finish
+    """
+    lines = self.readLines()
+    if self._partial:
+      lines.append(self._partial.rstrip('\r'))
+      self._partial = ''
+    return lines
+
+  def close(self):
+    """
+    Nothing to let go of, here so a LogTail can stand in for a LogStream
+    """
+    pass
+
+class LogStream:
+  """
+  Follows a log that is being written on another host, so it doesn't have
+  to be on a shared filesystem.
+
+  'tail -F' runs on the host over an ssh connection of its own, and new
+  bytes come back down a pipe that is read without blocking. Complete lines 
+  are appended to a local copy of the log as they arrive, so the log is 
+  never read twice. If the connection drops it's started again (at most 
+  every RETRY_DELAY seconds) from just after the last byte that came back.
+  Given the render's PID, tail exits by itself once the render has.
+
+  Has the same readLines()/finish()/offset/lineOffset as LogTail so a Job 
+  can use either.
+  """
+  MAX_READ = LogTail.MAX_READ
+  RETRY_DELAY = 10.0
+  CONNECT_TIMEOUT = 5
+
+  def __init__(self, host, user, remotePath, localPath, offset=0, pid=None):
+    """
+    remotePath : Path of the log on the host as a shell word, it's expanded there ("$HOME/..." is fine)
+    localPath  : Where the local copy is kept
+    """
+    self.host = host
+    self.user = user
+    self.remotePath = remotePath
+    self.path = localPath
+    self.offset = offset
+    self.pid = pid
+    self._partial = ''
+    self._proc = None
+    self._nextStart = 0.0
+    self._closed = False
+
+  def _start(self):
+    follow = '--pid=%d ' % self.pid if self.pid else ''
+    command = 'tail -c +%d %s-F %s 2> /dev/null' % (self.offset + 1, follow, self.remotePath)
+    try:
+      proc = subprocess.Popen(['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=%d' % LogStream.CONNECT_TIMEOUT, '%s@%s' % (self.user, self.host), command],
+                              stdin=open(os.devnull),
+                              stdout=subprocess.PIPE,
+                              stderr=open(os.devnull, 'w'),
+                              close_fds=True)
+    except OSError:
+      # Tried again after RETRY_DELAY
+      return
+
+    fd = proc.stdout.fileno()
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    self._proc = proc
+
+  def _stop(self):
+    proc, self._proc = self._proc, None
+    if proc is None:
+      return
+    if proc.poll() is None:
+      try:
+        proc.terminate()
+      except OSError:
+        pass
+    proc.stdout.close()
+    proc.wait()
+
+  def readLines(self):
+    """
+    Returns the list of complete lines that have come in since the last call
+    """
+    if self._closed:
+      return []
+
+    if self._proc is None:
+      if time.time() < self._nextStart:
+        return []
+      self._nextStart = time.time() + LogStream.RETRY_DELAY
+      self._start()
+      if self._proc is None:
+        return []
+
+    # close() may be called from another thread at any point
+    proc = self._proc
+    data = ''
+    ended = False
+    while len(data) < LogStream.MAX_READ:
+      try:
+        chunk = os.read(proc.stdout.fileno(), LogStream.MAX_READ - len(data))
+      except OSError, e:
+        ended = e.errno != errno.EAGAIN
+        break
+      except ValueError:
+        # Closed under us
+        ended = True
+        break
+      if not chunk:
+        ended = True
+        break
+      data += chunk
+
+    if ended:
+      self._stop()
+
+    self.offset += len(data)
+    lines = (self._partial + data).split('\n')
+    self._partial = lines.pop()
+
+    self._append(lines)
+    return [ line.rstrip('\r') for line in lines ]
+
+  @property
+  def lineOffset(self):
+    return self.offset - len(self._partial)
+
+  def _append(self, lines):
+    if lines:
+      with open(self.path, 'a') as f:
+        f.write(''.join( '%s\n' % line for line in lines ))
+
+  def finish(self, timeout):
+    """
+    The rest of the log once the render is done, then closes the stream.
+
+    tail can still be behind when the session reports the render is over, 
+    so rather than waiting on it whatever hasn't come back yet is fetched 
+    in one go with a plain 'tail -c +offset', given timeout seconds. The 
+    last line is included even without a newline
+    """
+    if self._closed:
+      return []
+
+    lines = self.readLines()
+    self.close()
+
+    command = 'tail -c +%d %s 2> /dev/null' % (self.offset + 1, self.remotePath)
+    try:
+      proc = subprocess.Popen(['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=%d' % LogStream.CONNECT_TIMEOUT, '%s@%s' % (self.user, self.host), command],
+                              stdin=open(os.devnull),
+                              stdout=subprocess.PIPE,
+                              stderr=open(os.devnull, 'w'),
+                              close_fds=True)
+      data = communicate(proc, timeout) or ''
+    except OSError:
+      data = ''
+
+    self.offset += len(data)
+    rest = (self._partial + data).split('\n')
+    self._partial = ''
+    if not rest[-1]:
+      rest.pop()
+    rest = [ line.rstrip('\r') for line in rest ]
+
+    self._append(rest)
+    return lines + rest
+
+  @property
+  def closed(self):
+    return self._closed
+
+  def close(self):
+    self._closed = True
+    self._stop()
+
+class RenderLogParser:
+  """
+  Line driven state machine for the maya (mental ray) render log.
+
+  Lines are fed in as they arrive and only those lines are looked at, so 
+  the cost of a poll depends on how much new output there is rather than 
+  how big the log has grown. The state is small enough to be checkpointed 
+  with checkpoint() and picked up again with fromCheckpoint().
+
+  feed() returns a list of events describing what changed :
+    ('progress', percentage) - Progress of the frame currently rendering
+    ('frame', framesDone)    - A frame finished rendering
+    ('exit', status)         - Maya exited with the given status
+  """
+
+  # The regex pattern to search for in the output to retrieve the current percentage 
+  progressRe = re.compile('JOB[\s]*[\d]+\.[\d]+[\s]*[\d]+ MB progr:[\s]*([\d]+\.[\d]+)\%[\s]*rendered on .*')
+
+  def __init__(self):
+    self.framesDone = 0
+    self.frameProgress = 0.0
+    self.exitStatus = None
+    self.linesParsed = 0
+
+  def feed(self, lines):
+    events = []
+    for line in lines:
+      self.linesParsed += 1
+
+      if 'progr:' in line:
+        match = RenderLogParser.progressRe.search(line)
+        if match:
+          self.frameProgress = float(match.group(1))
+          events.append(('progress', self.frameProgress))
+      elif 'rendering statistics' in line:
+        self.framesDone += 1
+        self.frameProgress = 100.0
+        events.append(('frame', self.framesDone))
+      elif 'Maya exited with status' in line:
+        self.exitStatus = int(re.findall('\d+', line)[0])
+        events.append(('exit', self.exitStatus))
+
+    return events
+
+  def checkpoint(self):
+    return { 'framesDone' : self.framesDone,
+             'frameProgress' : self.frameProgress,
+             'exitStatus' : self.exitStatus,
+             'linesParsed' : self.linesParsed }
+
+  @classmethod
+  def fromCheckpoint(cls, state):
+    parser = cls()
+    parser.framesDone = state['framesDone']
+    parser.frameProgress = state['frameProgress']
+    parser.exitStatus = state['exitStatus']
+    parser.linesParsed = state['linesParsed']
+    return parser
+
 class Job:
   """
   Perhaps this should be broken up, it's pretty huge now
@@ -53,6 +531,7 @@ class Job:
   """
 
   STATE = {
+      'n' : "Connecting",
       'i' : "Idle",
       'r' : "Running",
       'p' : "Paused",
@@ -62,9 +541,41 @@ class Job:
 
   ERROR = {
       0 : 'Success',
-      256 : 'Login failed'
+      256 : 'Login failed',
+      257 : 'Render stalled',
+      258 : 'Launch failed'
       }
 
+  # Only this much of the maya log & ssh session is kept in memory, the full log stays on disk
+  OUTPUT_MAX_LINES = 5000
+  OUTPUT_MAX_BYTES = 4 * 1024 * 1024
+  SESSION_MAX_LINES = 200
+  # Most bytes taken from the ssh session per read
+  SESSION_READ_SIZE = 4096
+  # How long a host gets to answer a control command (status or signals for a detached render)
+  CONNECT_TIMEOUT = 5
+  # How long a control command gets to finish once connected
+  CONTROL_TIMEOUT = 15
+  # How long a detached render gets to write its PID
+  LAUNCH_TIMEOUT = 30
+  # Where detached renders keep their PID & exit status on the host, relative to $HOME
+  RUN_DIR = '.rendermanager/run'
+  # Days before leftover PID & exit status files are cleared out
+  RUN_FILE_DAYS = 7
+
+  # Constructor arguments kept by snapshot(), the rest (sessions & callbacks) are passed back in to restore()
+  SNAPSHOT_ARGS = ('host', 'scenePath', 'frameRange', 'outputPath', 'camOverride', 'resolutionOverride',
+                   'user', 'binPath', 'logPath', 'outputMaxLines', 'outputMaxBytes', 'detachable', 'streamLog')
+
+  # Printed by a detached render's launch command, see _launchCommand
+  PID_RE = re.compile(r'RENDER_PID (\d+)')
+  # Last line of the render's initial output, and the most of it kept
+  START_SENTINEL = 'Locale is: "Locale:en_US.UTF-8 CodeSet:UTF-8"'
+  START_OUTPUT_MAX = 64 * 1024
+
+  # Answers to the status command, see _remoteStatus
+  STATUS_RE = re.compile(r'^RENDER_(RUNNING|GONE|EXITED) ?(\d*)$', re.MULTILINE)
+
   def __init__(self, 
                 host, 
                 scenePath, 
@@ -74,7 +585,24 @@ class Job:
                 resolutionOverride=None, 
                 user=None, 
                 binPath='/opt/autodesk/maya2014-x64/bin/Render', 
-                logPath=None):
+                logPath=None,
+                outputMaxLines=OUTPUT_MAX_LINES,
+                outputMaxBytes=OUTPUT_MAX_BYTES,
+                sessionPool=None,
+                deferred=False,
+                onFrame=None,
+                detachable=False,
+                streamLog=False):
+    """
+    deferred   : Leave the job Connecting and let the caller run prepare() 
+                 (from another thread) rather than doing it here
+    onFrame    : Called with (job, frame number) as each frame finishes, and 
+                 for any frames that were missed once the job finishes successfully
+    detachable : Start the render so it survives the session hanging up, 
+                 see detach()
+    streamLog  : Have maya log on the host and stream the log back over ssh
+                 (see LogStream), rather than reading it through a shared home
+    """
 
     # Store the original args to restarting the job
     self.originalArgs = locals()
@@ -83,33 +611,11 @@ class Job:
     self._id = uuid.uuid4()
 
     self.logger = logging.getLogger(__name__)
-    if logPath != None:
-      logName = os.path.join('%s@%s_%s.log' % (os.path.basename(scenePath), host, self._id) )
-      logPath = os.path.expanduser(logPath)
-      if not os.path.exists(logPath):
-        self.logger.debug('Making log directory for job@%s in %s' % (host, logPath))
-        os.makedirs(logPath)
 
-      self._jobLogFile = os.path.join(logPath, logName)
-      try:
-        with open(self._jobLogFile, 'w') as f:
-          f.write('')
-        self.logger.debug('Job@%s log path : %s' % (host, self._jobLogFile))
-      except IOError, e:
-        raise
-        
-    handler = logging.FileHandler(self._jobLogFile)
-    self.logger.addHandler(handler)
-    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
-    handler.setFormatter(formatter)
-    self.logger.setLevel(logging.DEBUG)
-
-    # The regex pattern to search for in the output to retrieve the current percentage 
-    self.progressRe = re.compile('JOB[\s]*[\d]+\.[\d]+[\s]*[\d]+ MB progr:[\s]*[\d]+\.[\d]+\%[\s]*rendered on .*')
+    # Frame/progress/exit state, built up from the log as it is tailed
+    self._logParser = RenderLogParser()
     self._progress = 0
 
-    # Seek value for reading from file
-    self.p = 0
     self._state = None
     self._errorCode = None
 
@@ -119,6 +625,14 @@ class Job:
     self._outputPath = outputPath
     self._frameRange = ( int(frameRange[0]), int(frameRange[1]) )
     self._currentFrame = 0
+    # When the render started and when each frame finished, for measuring render speed
+    self._startTime = None
+    self._frameTimes = []
+    self._lastProgressTime = None
+    self._progressUpdates = 0
+    self._throughput = Throughput()
+    self._onFrame = onFrame
+    self._framesSignalled = set()
     self._camOverride = camOverride
     self._resOverride = resolutionOverride
 
@@ -128,53 +642,203 @@ class Job:
       self.logger.error(('{0} Negative frame range entered').format(repr(self)))
       raise ValueError('Negative frame range')
 
+    self._user = user if user else getpass.getuser() 
+
+    # Everything below is filled in by prepare()
+    self._jobLogDir = logPath
+    self._jobLogFile = None
+    self._logPath = None
+    self._logTail = None
+    self._streamLog = streamLog
+    # Where maya logs to on the host, and how its command line is matched by pgrep/pkill
+    self._hostLogPath = None
+    self._hostLogMatch = None
+    self._processCall = None
+    # Until the scene has been read
+    self.outputPrefix = os.path.splitext(os.path.basename(self._scenePath))[0]
+    self.process = None
+
+    self._output = RingBuffer(outputMaxLines, outputMaxBytes)
+    self._sshOutput = RingBuffer(Job.SESSION_MAX_LINES)
+    self._sshPartial = ''
+
+    # Sessions come from (and go back to) this sessionPool.SessionPool if there is one
+    self._sessionPool = sessionPool
+    # Whether the shell is sitting at a prompt, ie. the session could be used by another job
+    self._sessionReusable = False
+
+    # Whether prepare() is underway, and if the job was closed while it was
+    self._preparing = False
+    self._cancelled = False
+    self._prepareLock = threading.Lock()
+
+    self._detachable = detachable
+    # Process (and process group) ID of a detached render on the host
+    self._pid = None
+    # Whether the session was let go of with the render still running, and if 
+    # this job was restored to follow a render started by an earlier one
+    self._detached = False
+    self._reattached = False
+    self._reattachState = 'r'
+    # What run() is waiting on the session for: a detached render's PID then 
+    # the prompt ('pid', 'prompt'), or the end of the render's initial output
+    self._launchStage = None
+    self._launchDeadline = None
+    self._startOutput = None
+    # The end of a streamed log is being fetched, the job completes once it's in
+    self._finishing = False
+
+    self._setState('n')
+
+    if not deferred:
+      self.prepare()
+
+  def prepare(self):
+    """
+    Does the slow part of setting up the job (log files, reading the scene and logging in), 
+    the job goes from Connecting to Idle, or to Error if any of it fails
+    """
+    with self._prepareLock:
+      if self._state != 'n' or self._preparing:
+        return
+      self._preparing = True
+
+    try:
+      if self._reattached:
+        self._reconnect()
+      else:
+        self._setUp()
+    finally:
+      with self._prepareLock:
+        self._preparing = False
+        cancelled = self._cancelled
+
+    if cancelled:
+      self.logger.info(('{0} Job was closed while connecting').format(repr(self)))
+      self.close()
+
+  def _setUp(self):
+    try:
+      self._prepareLogs()
+      self._readScene()
+    except (IOError, OSError), e:
+      self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+      self._setState('e')
+      return
+
+    self._buildProcessCall()
+    self._connect()
+
+  def _reconnect(self):
+    """
+    Asks the host how the detached render this job was restored to follow 
+    is doing, and picks it up from there
+    """
+    status = self._remoteStatus()
+    self._reattach()
+
+    if status is None:
+      self.logger.info(('{0} Cannot reach %s, following the log until it answers' % self.host).format(repr(self)))
+      return
+
+    # Catching up with the log may well finish the job by itself
+    self.pollLog()
+    if self.completed() or status[0] == 'running':
+      return
+
+    if status[0] == 'exited':
+      self.logger.info(('{0} Render finished while detached').format(repr(self)))
+      self._errorCode = status[1]
+      self._onComplete(success=(status[1] == 0))
+    else:
+      self.markStalled()
+
+  def _prepareLogs(self):
+    if self._jobLogDir != None:
+      logName = os.path.join('%s@%s_%s.log' % (os.path.basename(self._scenePath), self._host, self._id) )
+      logPath = os.path.expanduser(self._jobLogDir)
+      if not os.path.exists(logPath):
+        self.logger.debug('Making log directory for job@%s in %s' % (self._host, logPath))
+        os.makedirs(logPath)
+
+      self._jobLogFile = os.path.join(logPath, logName)
+      with open(self._jobLogFile, 'w') as f:
+        f.write('')
+      self.logger.debug('Job@%s log path : %s' % (self._host, self._jobLogFile))
+        
+    self._addJobLogHandler()
+
     logDir = os.path.expanduser('~/.rendermanager/renderLogs/%s/%s/' % (os.path.splitext(os.path.basename(self._scenePath))[0], self._host))
     logFile = '%s_%s.log' % (time.strftime("D%d:%m:%Y"), time.strftime("T%H:%M:%S")) 
 
     if not os.path.exists(logDir):
       os.makedirs(logDir)
 
-    self._logPath = os.path.join(logDir, logFile)
+    logPath = os.path.join(logDir, logFile)
 
-    try:
-      with open(self._logPath, 'w') as f:
-        f.write('')
-    except IOError:
-      raise
+    with open(logPath, 'w') as f:
+      f.write('')
+
+    self._logPath = logPath
+    self._setHostLogPath()
+    # Keeps track of how far into the maya log we have read
+    self._logTail = self._openLog()
 
     self.logger.info(('{0} Initialising job on %s' % self.host).format(repr(self)))
 
     self.logger.debug(('{0} Maya job log path: %s' % self._logPath).format(repr(self)))
-
-    self._user = user if user else getpass.getuser() 
     self.logger.debug(('{0} Session user : %s' % self._user).format(repr(self)))
 
-    self.logger.debug(('{0} Parsing scene file for output prefix...').format(repr(self)))
-    try:
-      with open(os.path.expanduser(self.scenePath)) as f:
-          for line in f:
-            if 'setAttr ".ifp" -type "string"' in line:
-              self.outputPrefix = line.split('"')[-2]
-              self.logger.debug(('{0} File name prefix found, using %s' % self.outputPrefix).format(repr(self)))
-              break
-          else:
-            self.outputPrefix = os.path.splitext(os.path.basename(self.scenePath))[0]
-            self.logger.debug(('{0} File name prefix not set, using scene name (%s)' % self.outputPrefix).format(repr(self)))
-    except IOError:
-      raise
+  def _setHostLogPath(self):
+    if self._streamLog:
+      self._hostLogPath = self._runFile('log')
+      self._hostLogMatch = '/%s/%s.log' % (Job.RUN_DIR, self._id)
+    else:
+      self._hostLogPath = self._hostLogMatch = self._logPath
+
+  def _openLog(self, offset=0):
+    if self._streamLog:
+      return LogStream(self._host, self._user, self._hostLogPath, self._logPath, offset, self._pid)
+    return LogTail(self._logPath, offset)
+
+  def _stopLog(self):
+    """
+    Stops following the maya log, anything still to come is not waited for
+    """
+    if self._logTail is not None:
+      self._logTail.close()
+
+  def _addJobLogHandler(self):
+    handler = logging.FileHandler(self._jobLogFile)
+    self.logger.addHandler(handler)
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    handler.setFormatter(formatter)
+    self.logger.setLevel(logging.DEBUG)
+
+  def _readScene(self):
+    self.logger.debug(('{0} Reading scene file for output prefix...').format(repr(self)))
+    # Cached, jobs split from the same scene only read it once
+    info = sceneInfo.readScene(self.scenePath)
+    if info.outputPrefix:
+      self.outputPrefix = info.outputPrefix
+      self.logger.debug(('{0} File name prefix found, using %s' % self.outputPrefix).format(repr(self)))
+    else:
+      self.outputPrefix = os.path.splitext(os.path.basename(self.scenePath))[0]
+      self.logger.debug(('{0} File name prefix not set, using scene name (%s)' % self.outputPrefix).format(repr(self)))
 
+  def _buildProcessCall(self):
     self._processArgs = []
 
-    if frameRange:
+    if self._frameRange:
       self._processArgs.append( ('s', str(self._frameRange[0])) ) 
       self._processArgs.append( ('e', str(self._frameRange[1])) )
 
-    if resolutionOverride:
-      self._processArgs.append( ('x', str(resolutionOverride[0])) )
-      self._processArgs.append( ('y', str(resolutionOverride[0])) )
+    if self._resOverride:
+      self._processArgs.append( ('x', str(self._resOverride[0])) )
+      self._processArgs.append( ('y', str(self._resOverride[0])) )
       
-    if camOverride:
-      self._processArgs.append( ('cam', camOverride) )
+    if self._camOverride:
+      self._processArgs.append( ('cam', self._camOverride) )
 
     # Verbose output
     self._processArgs.append( ('v', '5') )
@@ -188,7 +852,7 @@ class Job:
     self._processArgs.append( ('aml', '') ) 
     self._processArgs.append( ('at', '') ) 
       
-    self._processArgs.append( ('log', self._logPath) )
+    self._processArgs.append( ('log', self._hostLogPath) )
 
     #self.logger.debug('Process args : \n%s' % json.dumps(self._processArgs, indent=3))
     
@@ -202,22 +866,74 @@ class Job:
     self._processCall = " ".join(self._processCall)
 
     self.logger.debug(('{0} Process call : %s' % self._processCall).format(repr(self)))
-    
-    self._output = []
-    self._sshOutput = '' 
-    self.process = pxssh.pxssh()
-    
-    self.__setState('i')
+
+  def _connect(self):
+    self.process = None
 
     try:
-        self.process.login(self._host, self._user)
+        if self._sessionPool:
+          self.process = self._sessionPool.acquire(self._host, self._user)
+        else:
+          self.process = pxssh.pxssh()
+          self.process.login(self._host, self._user)
+        self._sessionReusable = True
+        self._setState('i')
     except pxssh.ExceptionPxssh as e:
         self.logger.error(('{0} Cannot log on as %s@%s' % (self._user, self._host)).format(repr(self)))
         self._errorCode = 256
-        self.__onComplete(success=False)
-    
+        self._onComplete(success=False)
+
+  def _remoteCommand(self):
+    """
+    Shell command that runs the render and echoes whether it succeeded once it exits
+    """
+    if self._detachable:
+      return self._launchCommand()
+
+    # The quotes keep the session's echo of the command line from matching
+    commands = [r'nice %s' % self._processCall,
+                r"RETVAL=$?",
+                r"""[ $RETVAL -eq 0 ] && echo COMPLETE_""SUCCESS""",
+                r"""[ $RETVAL -ne 0 ] && echo COMPLETE_""ERROR"""]
+    if self._streamLog:
+      commands.insert(0, 'mkdir -p "$HOME/%s"' % Job.RUN_DIR)
+    return ';'.join(commands)
+
+  def _runFile(self, extension):
+    return '"$HOME/%s/%s.%s"' % (Job.RUN_DIR, self._id, extension)
+
+  def _launchCommand(self):
+    """
+    Shell command that starts the render in a session of its own (so nothing 
+    hanging up on our side reaches it) and echoes its PID once it's going. 
+    The render's shell writes its PID before starting it and the exit status
+    once it's done, the exit status is written to a temporary file first so 
+    it's never read half written
+    """
+    pidFile, exitFile, partFile = self._runFile('pid'), self._runFile('exit'), self._runFile('exit.part')
+    script = ';'.join(['echo $$ > %s' % pidFile,
+                       'nice %s' % self._processCall,
+                       'echo $? > %s' % partFile,
+                       'mv %s %s' % (partFile, exitFile)])
+
+    # No ';' after the '&', it already ends the command
+    return ';'.join(['mkdir -p "$HOME/%s"' % Job.RUN_DIR,
+                     'find "$HOME/%s" -type f -mtime +%d -exec rm -f {} +' % (Job.RUN_DIR, Job.RUN_FILE_DAYS),
+                     'rm -f %s %s' % (pidFile, exitFile),
+                     'setsid sh -c %s < /dev/null > /dev/null 2>&1 & for i in $(seq %d); do [ -s %s ] && break; sleep 0.1; done' % 
+                        (pipes.quote(script), Job.LAUNCH_TIMEOUT * 10, pidFile),
+                     # The quotes keep the echoed command line from matching
+                     '[ -s %s ] && echo RENDER_PID $(cat %s) || echo RENDER_""FAILED' % (pidFile, pidFile)])
+
+  def _statusCommand(self):
+    return ('if [ -s %s ]; then echo RENDER_EXITED $(cat %s); elif kill -0 %d 2> /dev/null; then echo RENDER_RUNNING; else echo RENDER_GONE; fi' % 
+            (self._runFile('exit'), self._runFile('exit'), self._pid))
+
   def __str__(self):
-    return '[%s] : %s@%s : { Frame %d/%d } %.2f%%' % (self.state, os.path.basename(self._scenePath), self.host, self._currentFrame, self.totalFrames, self.progress)
+    text = '[%s] : %s@%s : { Frame %d/%d } %.2f%%' % (self.state, os.path.basename(self._scenePath), self.host, self._currentFrame, self.totalFrames, self.progress)
+    if self.running:
+      text += formatThroughput(self.framesPerHour, self.eta)
+    return text
 
   def __repr__(self):
     return '<{uid}> Host:{host} | Scene:{scene} | Frames:{framecount} | Errorcode:{error} | Status:{status}'.format(
@@ -228,43 +944,93 @@ class Job:
         error=self.errorCode,
         status=self._state)
 
-  def __setState(self, state):
+  def _setState(self, state):
     if self._state:
       self.logger.debug(("{0} %s -> %s" % (Job.STATE[self._state], Job.STATE[state])).format(repr(self)))
     else:
       self.logger.debug(("{0} Setting initial state to %s" % Job.STATE[state]).format(repr(self)))
+    if state == 'r' and self._startTime is None:
+      self._startTime = time.time()
+      self._throughput.record(0.0, self._startTime)
     self._state = state
 
-  def __setProgress(self, value):
+  def _setProgress(self, value):
     self.logger.info(('{0} Frame progress : %.2f' % value).format(repr(self)))
     self._progress = value
 
-  def __onComplete(self, success):
+  def _onComplete(self, success):
+    if self._finishing:
+      return
+
+    # The session can report the render is over before the end of its log has 
+    # been read. Fetching what's left of a streamed log waits on the host, so
+    # that's done on a thread of its own and the job completes once it's in
+    if isinstance(self._logTail, LogStream) and not self._logTail.closed and self._state in ('r', 'p'):
+      self.logger.info(('{0} Fetching the end of the log from %s' % self.host).format(repr(self)))
+      self._finishing = True
+      self._inBackground(self._finishInBackground, success)
+      return
+
+    self._finishLog()
+    self._complete(success)
+
+  def _finishInBackground(self, success):
+    try:
+      self._finishLog()
+      # Unless it was killed or closed in the meantime
+      if not self.completed():
+        self._complete(success)
+    finally:
+      self._finishing = False
+
+  def _complete(self, success):
     self.logger.info(('{0} Job finished').format(repr(self)))
     if success:
       self.logger.info('Success')
-      self.__setState('c')
-      self.__setProgress(0.0)
+      self._setState('c')
+      self._setProgress(0.0)
       self._currentFrame = self._maxFrame
-
-      self._output = []
-      try:
-        with open(self._logPath) as logFile:
-          for line in logFile:
-            self._output.append(line.strip())
-      except IOError, e:
-        self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+      for frame in range(self._frameRange[0], self._frameRange[1] + 1):
+        self._frameFinished(frame)
     else:
-      self.__setState('e')
-      if self._errorCode != None or self._errorCode != 256:
+      self._setState('e')
+      if self._logParser.exitStatus is not None:
+        self.parseErrorcode(['Maya exited with status %d' % self._logParser.exitStatus])
+      elif self._errorCode is None:
         try:
           with open(self._logPath) as logFile:
-            self.parseErrorcode([line for line in logFile])
+            # Read a line at a time, the log can be huge
+            self.parseErrorcode(logFile)
         except IOError, e:
           self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
 
+    self._stopLog()
     self.close()
 
+  def markStalled(self):
+    """
+    Gives up on a job whose render has died without the session noticing
+    """
+    if self._finishing:
+      # It's over already, only the end of its log is still coming
+      return
+
+    self.logger.error(('{0} Render is no longer running on %s' % self.host).format(repr(self)))
+    self._errorCode = 257
+    # Whatever the shell is doing now, it can't be trusted to be back at a prompt
+    self._sessionReusable = False
+    self._onComplete(success=False)
+
+  def _frameFinished(self, frame):
+    if self._onFrame is None or frame in self._framesSignalled:
+      return
+
+    self._framesSignalled.add(frame)
+    try:
+      self._onFrame(self, frame)
+    except Exception, e:
+      self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+
   def parseErrorcode(self, lines):
       for line in lines:
           if 'Maya exited with status' in line:
@@ -274,148 +1040,273 @@ class Job:
         self._errorCode = None 
 
       if self._errorCode == 0:
-        self.__setState('c')
+        self._setState('c')
       elif self._errorCode > 0:
         self.logger.error(('{0} Error : (%d)' % int(self._errorCode)).format(repr(self)))
       else:
         self.logger.error(('{0} Unknown error').format(repr(self)))
 
   def run(self):
-    # A horribly hacky way of checking for the end of the initial output
-    SENTINEL_STRING = 'Locale is: "Locale:en_US.UTF-8 CodeSet:UTF-8"'
-
-    if self._state == 'i':
+    """
+    Starts the render. This only sends the command, the session's answer is
+    picked up by readSession (and a launch that never answers by pollLog) so
+    nothing here waits on the host
+    """
+    if self._state != 'i':
+      return
+
+    self._sessionReusable = False
+    if self._detachable:
+      self.logger.info(('{0} Launching detached render on %s' % self.host).format(repr(self)))
+      self._launchStage = 'pid'
+      self._launchDeadline = time.time() + Job.LAUNCH_TIMEOUT + Job.CONNECT_TIMEOUT
+    else:
       self.logger.info(('{0} Executing remote process on %s' % self.host).format(repr(self)))
-      # Run the process and evaluate it's return value when complete, ensuring we capture success/failure
-      self.process.sendline(';'.join([r'nice %s' % self._processCall,
-                                      r"RETVAL=$?",
-                                      r"[ $RETVAL -eq 0 ] && echo COMPLETE_SUCCESS",
-                                      r"[ $RETVAL -ne 0 ] && echo COMPLETE_ERROR"]
-                                      ))
-
       self.logger.info(('{0} Ignoring initial output').format(repr(self)))
-
-      # Read until the job starts, and write any errors to file if it cannot
-      tmp = ''
-      while tmp.split('\n')[-1] != SENTINEL_STRING:
-        try:
-          tmp += self.process.read_nonblocking()
-          lines = tmp.split('\n')
-          print lines[-1]
-          print lines[-1] == SENTINEL_STRING
-
-
-          if 'COMPLETE_ERROR' == lines[-1]:
-            # Premature exit
-            try:
-              self.logger.error(lines[-2])
-            except Exception:
-              pass
-
-            try:
-              with open(self._logPath, 'a+') as mayaLog:
-                mayaLog.write(tmp)
-            except IOError, e:
-              self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
-
-            self.logger.error(('{0} Prematurely exited process').format(repr(self)))
-            self.__onComplete(success=False)
-            break
-        except TIMEOUT, e:
-          self.logger.info('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
-          self.logger.info('{0} {1}'.format(repr(self), tmp), exc_info=sys.exc_info())
-        except ValueError, e:
-          self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
-          self.__onComplete(success=False)
+      self._startOutput = ''
+
+    self.process.sendline(self._remoteCommand())
+    self._setState('r')
+
+  def _readStartOutput(self, data):
+    """
+    Keeps what the render prints before it gets going, it ends up in the 
+    maya log (where it's the only clue if the render exits straight away)
+    """
+    self._startOutput += data
+    if Job.START_SENTINEL in self._startOutput or len(self._startOutput) > Job.START_OUTPUT_MAX:
+      self._endStartOutput()
+
+  def _endStartOutput(self):
+    output, self._startOutput = self._startOutput, None
+    try:
+      with open(self._logPath, 'a+') as mayaLog:
+        mayaLog.write(output)
+    except IOError, e:
+      self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+
+  def _readLaunch(self, lines):
+    """
+    Picks the PID of a detached render out of the session output, then waits
+    for the prompt so the session can be handed back
+    """
+    if self._launchStage == 'pid':
+      for line in lines:
+        match = Job.PID_RE.search(line)
+        if match:
+          self._launched(int(match.group(1)))
           break
+        if 'RENDER_FAILED' in line:
+          self.logger.error(('{0} Render did not start on %s' % self.host).format(repr(self)))
+          self._launchStage = None
+          self._errorCode = 258
+          self._onComplete(success=False)
+          return
+
+    if self._launchStage == 'prompt' and re.search(self.process.PROMPT, self._sshPartial):
+      self._launchStage = None
+      self._sessionReusable = True
+      self._releaseSession()
+
+  def _launched(self, pid):
+    self._pid = pid
+    if isinstance(self._logTail, LogStream):
+      # Lets tail stop by itself once the render has gone
+      self._logTail.pid = self._pid
+    self.logger.info(('{0} Render running on %s as PID %d' % (self.host, self._pid)).format(repr(self)))
+
+    # The render is followed through its log & controlled by PID from here, 
+    # the session is free for another job once it's back at the prompt
+    self._launchStage = 'prompt'
+    self._launchDeadline = time.time() + Job.CONNECT_TIMEOUT
+
+  def _checkLaunch(self):
+    """
+    Gives up on a launch the host hasn't answered in time
+    """
+    if self._launchStage is None or self.completed() or time.time() < self._launchDeadline:
+      return
+
+    stage, self._launchStage = self._launchStage, None
+    if stage == 'prompt':
+      # The render is going, the session just can't be trusted to be reused
+      self._releaseSession()
+      return
+
+    self.logger.error(('{0} Render did not report its PID on %s in time' % self.host).format(repr(self)))
+    # In case it started after all
+    self._inBackground(self._stopRender)
+    self._errorCode = 258
+    self._onComplete(success=False)
+
+  def _releaseSession(self):
+    session, self.process = self.process, None
+    if self._sessionPool and self._sessionReusable:
+      self.logger.info(('{0} Returning session to the pool').format(repr(self)))
+      self._sessionPool.release(session)
+      return
 
-      try:
-        with open(self._logPath, 'a+') as mayaLog:
-          mayaLog.write(tmp)
-      except IOError, e:
-        self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
-    
-      self.__setState('r')
+    self.logger.info(('{0} Closing session').format(repr(self)))
+    try:
+      session.logout()
+    except (OSError, ValueError), e:
+      self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+    session.close(force=True)
 
   def update(self):
+    self.readSession()
+    self.pollLog()
+
+  def fileno(self):
+    """
+    File descriptor of the ssh session, for use with select/poll
+    """
+    if self.process is None or self._finishing:
+      return None
+    return self.process.child_fd
+
+  def readSession(self):
+    """
+    Reads whatever the ssh session has ready without blocking
+    """
+    if self.process is None or self._finishing:
+      return
+
     if not self.process.isalive():
-        self.__onComplete(success=False)
+        self._onComplete(success=False)
 
     if not self.completed():
       try:
-        self._sshOutput += str(self.process.read_nonblocking()) 
+        data = str(self.process.read_nonblocking(Job.SESSION_READ_SIZE, timeout=0))
+        newLines = (self._sshPartial + data).split('\n')
+        self._sshPartial = newLines.pop()
+        self._sshOutput.extend(newLines)
       except TIMEOUT, e:
-        self.logger.debug('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+        return
       except ValueError, e:
-        self.logger.error('{0} {1}'.format(repr(self), e))
-        self.__setState('e', exc_info=sys.exc_info())
+        self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+        self._setState('e')
         return
       except EOF, e:
-        self.logger.error('{0} {1}'.format(repr(self), e))
-        self.__setState('e', exc_info=sys.exc_info())
+        self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+        self._setState('e')
         return
       
-      sshOutputNew = self._sshOutput.split('\n')
-      for line in sshOutputNew:
+      if self._launchStage is not None:
+        self._readLaunch(newLines)
+        return
+
+      if self._startOutput is not None:
+        self._readStartOutput(data)
+
+      for line in newLines:
         if 'COMPLETE_SUCCESS' in line:
-          self.__onComplete(success=True)
+          self._sessionReusable = True
+          self._onComplete(success=True)
+          return
+
+        if 'COMPLETE_ERROR' in line: 
+          if self._startOutput is not None:
+            self.logger.error(('{0} Prematurely exited process').format(repr(self)))
+            self._endStartOutput()
+          self._sessionReusable = True
+          self._onComplete(success=False)
+          return
 
-        if 'COMPLETE_FAILURE' in line: 
-          self.__onComplete(success=False)
+  def pollLog(self):
+    """
+    Picks up anything new in the maya log
+    """
+    self._checkLaunch()
 
+    if self._logTail is None or self._state in ('n', 'i') or self._finishing:
+      # Still connecting, not started, or already over
+      return
+
+    if not self.completed():
       try:
-        with open(self._logPath, 'r') as f:
-            f.seek(self.p)
-            latest_data = f.read().split('\n')
-            #self.p = f.tell()
-            self.p = 0 # nasty performance, but for some reason it doesn't like reading the data properly if we read from the last position
-
-            self.output = [ line for line in latest_data ]
-
-            progressResults = self.progressRe.findall('\n'.join(latest_data), re.MULTILINE)
-            progressResult_LineNum = -1
-            renderingStats_LineNum = -1
-            if progressResults:
-                for num, line in enumerate(latest_data):
-                    if line == progressResults[-1]:
-                        progressResult_LineNum = num
-                    if 'rendering statistics' in line:
-                        renderingStats_LineNum = num
-                        if self._currentFrame != self._maxFrame:
-                          self.logger.debug(('{0} Incrementing frame counter').format(repr(self)))
-                          self._currentFrame += 1
-                    if 'Maya exited with status' in line:
-                        self._errorCode = int(re.findall('\d+', line)[0])
-                        if self._errorCode != 0:
-                          self.logger.error(('{0} Error : (%d)' % int(self._errorCode)).format(repr(self)))
-                          self.__onComplete(success=False)
-                        else:
-                          self.__onComplete(success=True)
-
-                if progressResult_LineNum > renderingStats_LineNum:
-                    self.logger.debug(('{0} Getting remaining frame progress').format(repr(self)))
-                    percentage = re.findall(r'\d+.\d+%', progressResults[-1])[0]
-                    self.__setProgress(float(percentage[:-1]))
-                else:
-                    self.__setProgress(100.0)
+        latest_data = self._logTail.readLines()
       except IOError, e:
         self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+        return
+
+      if not latest_data:
+        return
+
+      self._output.extend(latest_data)
+
+      for event, value in self._logParser.feed(latest_data):
+        if event == 'progress':
+          self._lastProgressTime = time.time()
+          self._progressUpdates += 1
+          self._setProgress(value)
+          self._throughput.record(self._currentFrame + value / 100.0)
+        elif event == 'frame':
+          self._logFrame(value)
+        elif event == 'exit':
+          # Render has exited so the shell is about to be back at the prompt
+          self._sessionReusable = True
+          self._errorCode = value
+          if self._errorCode != 0:
+            self.logger.error(('{0} Error : (%d)' % int(self._errorCode)).format(repr(self)))
+            self._onComplete(success=False)
+          else:
+            self._onComplete(success=True)
+          break
+
+  def _logFrame(self, framesDone):
+    self._frameTimes.append(time.time())
+    self._setProgress(100.0)
+    if self._currentFrame != self._maxFrame:
+      self.logger.debug(('{0} Incrementing frame counter').format(repr(self)))
+      self._currentFrame = min(framesDone, self._maxFrame)
+    self._frameFinished(self._frameRange[0] + min(framesDone, self._maxFrame + 1) - 1)
+    self._throughput.record(min(framesDone, self._maxFrame + 1))
 
   def pause(self):
-    if not self._state == 'p':
+    if self._sessionless():
+      if self._state == 'r':
+        self.logger.info(('{0} Job paused').format(repr(self)))
+        self._signalRender('STOP')
+        self._setState('p')
+      return
+
+    if not self._state == 'p' and self.process is not None:
         self.logger.info(('{0} Job paused').format(repr(self)))
         self.logger.debug(("{0} Sending SIGSTOP to %s on %s" % (self._binPath, self.host)).format(repr(self)))
         self.process.kill(signal.SIGSTOP) 
-        self.__setState('p')
+        self._setState('p')
 
   def resume(self):
-    if self._state == 'p':
+    if self._sessionless():
+      if self._state == 'p':
+        self.logger.info(('{0} Job resumed').format(repr(self)))
+        self._signalRender('CONT')
+        self._setState('r')
+      return
+
+    if self._state == 'p' and self.process is not None:
         self.logger.info(('{0} Job resumed').format(repr(self)))
         self.logger.debug(("{0} Sending SIGCONT to %s on %s" % (self._binPath, self.host)).format(repr(self)))
         self.process.kill(signal.SIGCONT) 
-        self.__setState('r')
+        self._setState('r')
 
   def kill(self):
+    if self._state == 'n':
+      self.close()
+      return
+
+    if self._sessionless():
+      if self._state in ('r', 'p'):
+        self._stopRender()
+        self._state = 'e' if self.errorCode else 'c'
+        self._stopLog()
+      return
+
+    if self.process is None:
+      # The session has already gone back to the pool
+      return
+
     self.resume()
     if self._state == 'r':
         # I know using both is redundant but we want to be sure all child processes die too
@@ -429,13 +1320,44 @@ class Job:
         self.logger.debug(('{0} Attempting to SIGKILL with no running process on %s' % self.host).format(repr(self)))
         self.process.kill(signal.SIGKILL) 
         self._state = 'e' if self.errorCode else 'c'
+    self._stopLog()
 
   def close(self):
+    with self._prepareLock:
+      if self._state == 'n':
+        if self._preparing:
+          # prepare() closes the job itself once it's done logging in
+          self._cancelled = True
+        else:
+          self.logger.info(('{0} Job closed before it connected').format(repr(self)))
+          if self._reattached:
+            # Restored but never reconnected, the render it would have followed goes too
+            self._stopRender()
+            self._stopLog()
+          self._setState('e' if self.errorCode else 'c')
+        return
+
+    if self.process is None:
+      if self._sessionless() and not self.completed():
+        self.kill()
+      return
+
+    if self._sessionPool and self._sessionReusable:
+      self.logger.info(('{0} Returning session to the pool').format(repr(self)))
+      if not self.completed():
+        self._state = 'e' if self.errorCode else 'c'
+
+      session, self.process = self.process, None
+      self._sessionPool.release(session)
+      self._drainLog()
+      self._stopLog()
+      return
+
     self.logger.info(('{0} Closing session').format(repr(self)))
     self.kill()
 
     if not self.completed(): 
-        self.__onComplete(success=False)
+        self._onComplete(success=False)
 
     try:
         self.process.logout()
@@ -444,20 +1366,249 @@ class Job:
     except ValueError as e:
         self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
 
+    self._drainLog()
+
+    self.process.close(force=True)
+
+  def detach(self):
+    """
+    Lets go of the job without stopping its render, so it can be picked back 
+    up with restore() once the manager restarts. Jobs that aren't rendering, 
+    or whose render wouldn't survive the session hanging up, are just closed
+    """
+    if self._reattached and self._state == 'n':
+      # Never reconnected, there's nothing to let go of
+      return
+
+    if self._state not in ('r', 'p') or not (self._detachable or self._reattached):
+      self.close()
+      return
+
+    self.logger.info(('{0} Detaching from render on %s' % self.host).format(repr(self)))
+    self._detached = True
+    self._dropSession()
+    self._stopLog()
+
+  def _dropSession(self):
+    """
+    Hangs up the session, whatever is running in it
+    """
+    if self.process is None:
+      return
+
+    session, self.process = self.process, None
     try:
-        with open(self._logPath, 'r') as mayaLog:
-            self._output = [ line for line in mayaLog ]
+      session.close(force=True)
+    except (OSError, ValueError), e:
+      self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+
+  def _sessionless(self):
+    """
+    Whether the render runs without a session of ours (launched detached, or 
+    reattached to), so it's checked on & signalled on the host directly
+    """
+    return self._pid is not None or self._reattached or self._launchStage == 'pid'
+
+  def _control(self, command):
+    """
+    Runs a short command on the host over an ssh connection of its own, 
+    returns its output or None if the host couldn't be reached
+    """
+    try:
+      proc = subprocess.Popen(['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=%d' % Job.CONNECT_TIMEOUT, '%s@%s' % (self._user, self._host), command],
+                              stdin=open(os.devnull),
+                              stdout=subprocess.PIPE,
+                              stderr=open(os.devnull, 'w'),
+                              close_fds=True)
+      output = communicate(proc, Job.CONNECT_TIMEOUT + Job.CONTROL_TIMEOUT)
+    except OSError, e:
+      self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+      return None
+
+    if output is None:
+      self.logger.error(('{0} %s did not answer in time' % self.host).format(repr(self)))
+      return None
+
+    # ssh exits with 255 when it couldn't connect
+    if proc.returncode == 255:
+      return None
+    return output
+
+  def _inBackground(self, function, *args):
+    """
+    Runs function on a thread of its own, for control commands nobody waits on
+    """
+    thread = threading.Thread(target=function, args=args, name='JobControl')
+    thread.daemon = True
+    thread.start()
+
+  def _signalRender(self, *signals):
+    """
+    Sends each signal (by name) in turn to the render on the host
+    """
+    if self._pid is not None:
+      # The render's shell leads its own process group, signalling the group reaches maya.bin too
+      command = ';'.join( 'kill -%s -- -%d' % (name, self._pid) for name in signals )
+    else:
+      pattern = pipes.quote(renderPattern(self._hostLogMatch))
+      command = ';'.join( 'pkill -%s -f -- %s' % (name, pattern) for name in signals )
+
+    self.logger.debug(("{0} Sending SIG%s to %s on %s" % ('/SIG'.join(signals), self._binPath, self.host)).format(repr(self)))
+    self._control(command)
+
+  def _stopRender(self):
+    # I know using both is redundant but we want to be sure all child processes die too
+    self._signalRender('CONT', 'INT', 'KILL')
+
+  def _remoteStatus(self):
+    """
+    How a detached render is doing : ('running', None), ('exited', exit status) 
+    or ('gone', None) if it died without saying, None if the host can't be asked
+    """
+    output = self._control(self._statusCommand())
+    match = Job.STATUS_RE.search(output) if output is not None else None
+    if match is None:
+      return None
+
+    state, status = match.groups()
+    return (state.lower(), int(status) if status else None)
+
+  def renderAlive(self):
+    """
+    Asks the host whether the render is still going, None if it can't be reached
+    """
+    if self._pid is not None:
+      status = self._remoteStatus()
+      return status[0] == 'running' if status else None
+
+    output = self._control('pgrep -f -- %s > /dev/null && echo RENDER_RUNNING || echo RENDER_GONE' % pipes.quote(renderPattern(self._hostLogMatch)))
+    match = Job.STATUS_RE.search(output) if output is not None else None
+    return match.group(1) == 'RUNNING' if match else None
+
+  def snapshot(self):
+    """
+    Everything needed to rebuild the job with restore(), as plain (JSON friendly) data
+    """
+    return { 'kind' : 'job',
+             'id' : str(self._id),
+             'args' : dict( (name, self.originalArgs[name]) for name in Job.SNAPSHOT_ARGS ),
+             'state' : 'r' if self._reattached and self._state == 'n' else self._state,
+             'errorCode' : self._errorCode,
+             'currentFrame' : self._currentFrame,
+             'progress' : self._progress,
+             'startTime' : self._startTime,
+             'outputPrefix' : self.outputPrefix,
+             'logPath' : self._logPath,
+             'jobLogPath' : self._jobLogFile,
+             'logOffset' : self.logOffset,
+             'logState' : self.logState,
+             'pid' : self._pid }
+
+  @classmethod
+  def restore(cls, snapshot, **kwargs):
+    """
+    Rebuilds a job from snapshot(), kwargs are the constructor arguments that 
+    couldn't be saved (sessionPool, onFrame...).
+
+    A job that hadn't started yet comes back Connecting, to be prepared and 
+    run as normal. One that was rendering is reattached, it carries on 
+    reading the maya log from where it left off and finishes when maya 
+    exits, with pause & kill done on the host directly. If its render was 
+    launched detached it stays Connecting until prepare() has asked the 
+    host how the render is doing.
+    """
+    args = dict(snapshot['args'])
+    args.update(kwargs)
+    args['deferred'] = True
+
+    job = cls(**args)
+    job._id = uuid.UUID(snapshot['id'])
+    if snapshot['state'] not in ('n', 'i'):
+      job._restoreSnapshot(snapshot)
+    return job
+
+  def _restoreSnapshot(self, snapshot):
+    self._errorCode = snapshot['errorCode']
+    self._currentFrame = snapshot['currentFrame']
+    self._progress = snapshot['progress']
+    self._startTime = snapshot['startTime']
+    self.outputPrefix = snapshot['outputPrefix']
+    self._logPath = snapshot['logPath']
+    self._jobLogFile = snapshot['jobLogPath']
+    self._pid = snapshot.get('pid')
+
+    if self._jobLogFile and os.path.exists(self._jobLogFile):
+      self._addJobLogHandler()
+
+    if self._logPath:
+      self._setHostLogPath()
+      self._logTail = self._openLog(snapshot['logOffset'])
+      self._logParser = RenderLogParser.fromCheckpoint(snapshot['logState'])
+      self._buildProcessCall()
+
+    if snapshot['state'] in ('r', 'p') and self._logTail and self._pid is not None:
+      # Only a detached render was really paused, the process group was stopped
+      self._reattachState = snapshot['state']
+      self._reattached = True
+    elif snapshot['state'] in ('r', 'p') and self._logTail:
+      self._reattach()
+    elif snapshot['state'] == 'c':
+      self._setState('c')
+    else:
+      self._setState('e')
+
+  def _reattach(self):
+    self.logger.info(('{0} Reattaching to render on %s' % self.host).format(repr(self)))
+    self._reattached = True
+    if self._startTime is None:
+      self._startTime = time.time()
+    # The rate is measured from now, what was done before the restart isn't in the samples
+    self._throughput.record(self._currentFrame + self._progress / 100.0)
+    self._setState(self._reattachState)
+
+  def _finishLog(self):
+    """
+    Reads the rest of the maya log once the render is over and parses it, 
+    so the last frames and maya's exit status aren't lost
+    """
+    if self._logTail is None or self._state in ('n', 'i'):
+      return
+
+    try:
+      lines = self._logTail.finish(Job.CONNECT_TIMEOUT + Job.CONTROL_TIMEOUT)
     except IOError as e:
-        self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+      self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+      return
 
-    self.process.close(force=True)
+    self._output.extend(lines)
+    for event, value in self._logParser.feed(lines):
+      if event == 'frame':
+        self._logFrame(value)
 
-  def getNewInstanceofJob(self):
-    self.logging.info(('{0} Returning new instance of job on %s' % self.host, exc_infosys.exc_info()).format(repr(self)))
-    return Job(**self.originalArgs)
+  def _drainLog(self):
+    """
+    Pulls whatever is left of the maya log into the output buffer
+    """
+    if self._logTail is None:
+      return
+
+    try:
+      self._output.extend(self._logTail.readLines())
+    except IOError as e:
+      self.logger.error('{0} {1}'.format(repr(self), e), exc_info=sys.exc_info())
+
+  def getNewInstanceofJob(self, frameRange=None):
+    """
+    A fresh copy of this job, rendering frameRange instead if it's given
+    """
+    self.logger.info(('{0} Returning new instance of job on %s' % self.host).format(repr(self)))
+    args = dict(self.originalArgs)
+    if frameRange:
+      args['frameRange'] = frameRange
+    return self.__class__(**args)
 
   def completed(self):
-    return (self._state == 'c' or self._state == 'e') or (not self.process.isalive())
+    return (self._state == 'c' or self._state == 'e') or (self.process is not None and not self.process.isalive())
 
   @property
   def host(self):
@@ -497,6 +1648,14 @@ class Job:
   def logPath(self):
     return self._logPath
 
+  @property
+  def logState(self):
+    return self._logParser.checkpoint()
+
+  @property
+  def logOffset(self):
+    return self._logTail.lineOffset if self._logTail else 0
+
   @property
   def jobLogPath(self):
     return self._jobLogFile
@@ -515,7 +1674,35 @@ class Job:
 
   @property
   def output(self):
-    return self._output
+    return self._output.lines()
+
+  @property
+  def outputSequence(self):
+    return self._output.sequence
+
+  @property
+  def outputHeader(self):
+    """
+    Lines shown above the output, replaced whenever they change
+    """
+    return []
+
+  def outputSince(self, cursor):
+    """
+    The output lines that are new since cursor, for showing the output a bit 
+    at a time. Returns (lines, cursor to pass next time, whether the lines 
+    follow on from what cursor had, if not what was shown should be cleared). 
+    A cursor of None, or one from another job, starts from the top
+    """
+    source, sequence = cursor if cursor else (None, 0)
+    if source != self._id:
+      sequence = 0
+    lines, sequence, follows = self._output.since(sequence)
+    return lines, (self._id, sequence), follows and source == self._id
+
+  @property
+  def sessionOutput(self):
+    return self._sshOutput.lines()
 
   @property
   def frameProgress(self):
@@ -529,6 +1716,61 @@ class Job:
   def currentFrame(self):
     return self._currentFrame
 
+  @property
+  def startTime(self):
+    return self._startTime
+
+  @property
+  def lastProgressTime(self):
+    return self._lastProgressTime
+
+  @property
+  def progressUpdates(self):
+    return self._progressUpdates
+
+  @property
+  def frameTimes(self):
+    return list(self._frameTimes)
+
+  @property
+  def secondsPerFrame(self):
+    """
+    Average time taken per finished frame (including the time maya took to 
+    start up), None until a frame has finished
+    """
+    if not self._frameTimes or self._startTime is None:
+      return None
+    return (self._frameTimes[-1] - self._startTime) / len(self._frameTimes)
+
+  @property
+  def throughput(self):
+    return self._throughput
+
+  @property
+  def framesPerHour(self):
+    """
+    Smoothed render rate, None until the job has been going a little while
+    """
+    if not self.running:
+      return None
+    return self._throughput.framesPerHour()
+
+  @property
+  def framesLeft(self):
+    if self._state == 'c':
+      return 0.0
+    return max(0.0, (self._maxFrame + 1) - self._throughput.framesDone)
+
+  @property
+  def eta(self):
+    """
+    Seconds until the job should finish at its current rate, None if unknown
+    """
+    rate = self.framesPerHour
+    if not rate:
+      return None
+    return 3600.0 * self.framesLeft / rate
+
   @property
   def errorCode(self):
     if hasattr(self, '_errorCode'):
@@ -547,6 +1789,18 @@ class Job:
   def totalFrames(self):
     return self._maxFrame
 
+  @property
+  def connecting(self):
+    return self._state == 'n'
+
+  @property
+  def reattached(self):
+    return self._reattached
+
+  @property
+  def pausable(self):
+    return self._detachable or self._reattached
+
   @property
   def paused(self):
     return self._state == 'p'
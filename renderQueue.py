@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+import heapq
+import logging
+import threading
+
+"""
+Decides when each job gets to start.
+
+Every host has a number of slots (how many renders it can run at once),
+jobs wait in a per-host queue ordered by priority (highest first) and then
+by the order they were added, and the next one is started as soon as a slot
+on its host frees up.
+Jobs that are still connecting are passed over (without losing their
+place) until they're ready.
+"""
+
+class RenderQueue:
+    DEFAULT_SLOTS = 1
+
+    def __init__(self, slots=DEFAULT_SLOTS, logger=None):
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.defaultSlots = slots
+        self._slots = {}
+
+        # host -> heap of (-priority, order added, job)
+        self._waiting = {}
+        # host -> jobs currently taking up a slot
+        self._running = {}
+
+        self._count = 0
+        self._lock = threading.RLock()
+
+    def setSlots(self, host, slots):
+        with self._lock:
+            self._slots[host] = max(1, int(slots))
+
+    def slots(self, host):
+        return self._slots.get(host, self.defaultSlots)
+
+    def add(self, job, priority=0):
+        with self._lock:
+            self._count += 1
+            heapq.heappush(self._waiting.setdefault(job.host, []), (-priority, self._count, job))
+            self.logger.debug('Queued job %s on %s with priority %d' % (repr(job), job.host, priority))
+
+    def adopt(self, job):
+        """
+        Gives a job that's already rendering (picked back up after a restart) 
+        a slot on its host straight away
+        """
+        with self._lock:
+            self._running.setdefault(job.host, []).append(job)
+            self.logger.debug('Adopted running job %s on %s' % (repr(job), job.host))
+
+    def remove(self, job):
+        with self._lock:
+            waiting = self._waiting.get(job.host, [])
+            for entry in waiting:
+                if entry[2] is job:
+                    waiting.remove(entry)
+                    heapq.heapify(waiting)
+                    break
+
+            running = self._running.get(job.host, [])
+            if job in running:
+                running.remove(job)
+
+    def schedule(self):
+        """
+        Frees the slots of finished jobs and hands back the jobs that
+        should be started now, in the order they should be started
+        """
+        toStart = []
+        with self._lock:
+            for host, running in self._running.iteritems():
+                running[:] = [ job for job in running if not job.completed() ]
+
+            for host, waiting in self._waiting.iteritems():
+                running = self._running.setdefault(host, [])
+                connecting = []
+                while waiting and len(running) < self.slots(host):
+                    entry = heapq.heappop(waiting)
+                    job = entry[2]
+                    if job.completed():
+                        # Failed before it ever got started (couldn't log in for example)
+                        continue
+                    if job.connecting:
+                        # Not ready yet, it keeps its place and whatever is behind it gets a go
+                        connecting.append(entry)
+                        continue
+                    running.append(job)
+                    toStart.append(job)
+                    self.logger.info('Starting next job on host %s (%d/%d slots)' % (host, len(running), self.slots(host)))
+
+                for entry in connecting:
+                    heapq.heappush(waiting, entry)
+
+        return toStart
+
+    def waiting(self, host=None):
+        with self._lock:
+            hosts = [host] if host else self._waiting.keys()
+            return [ entry[2] for host in hosts for entry in sorted(self._waiting.get(host, [])) ]
+
+    def running(self, host=None):
+        with self._lock:
+            hosts = [host] if host else self._running.keys()
+            return [ job for host in hosts for job in self._running.get(host, []) ]
+
+    def hostThroughput(self, host):
+        """
+        Frames per hour the host is getting through right now
+        """
+        return sum( job.framesPerHour or 0.0 for job in self.running(host) )
+
+    def throughput(self):
+        return sum( self.hostThroughput(host) for host in self.hosts() )
+
+    def hostEta(self, host):
+        """
+        Seconds until everything running and waiting on the host should be done
+        at its current rate, None if it isn't rendering anything yet
+        """
+        return self.__eta(self.running(host) + self.waiting(host), self.hostThroughput(host))
+
+    def eta(self):
+        return self.__eta(self.running() + self.waiting(), self.throughput())
+
+    def hosts(self):
+        with self._lock:
+            return sorted(set(self._running.keys()) | set(self._waiting.keys()))
+
+    def __eta(self, jobs, rate):
+        if not rate:
+            return None
+        return 3600.0 * sum( job.framesLeft for job in jobs if not job.completed() ) / rate
+
+    def freeSlots(self, host):
+        with self._lock:
+            return self.slots(host) - len([ job for job in self._running.get(host, []) if not job.completed() ])
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+import os
+import re
+import mmap
+import threading
+from collections import OrderedDict
+
+"""
+Reads what the manager needs to know about a maya scene (just the output
+file name prefix so far) without reading the whole scene, production scenes
+run to hundreds of MB.
+
+The scene is mapped rather than read, and searched with mmap's own find, so
+only the pages around what's found are ever read in. In a .ma the render
+globals are set near the end of the file, so they're looked for from the end
+and only a bounded block after them is parsed. A .mb (IFF chunks) is searched
+for the attribute's name and its value read from just after it.
+
+Results are kept by (path, size, mtime), so splitting a shot into chunks reads
+the scene once however many jobs it becomes, and jobs preparing it at the same
+time wait on the one read rather than each doing their own.
+"""
+
+class SceneInfo:
+    def __init__(self, path, format, outputPrefix=None):
+        """
+        format       : 'ma' or 'mb'
+        outputPrefix : The render globals' file name prefix, None if it isn't set
+        """
+        self.path = path
+        self.format = format
+        self.outputPrefix = outputPrefix
+
+    def __repr__(self):
+        return '<SceneInfo %s (%s) prefix:%s>' % (self.path, self.format, self.outputPrefix)
+
+# Most scenes kept at once
+MAX_CACHED = 64
+# How far past the start of the render globals block to look for its attributes
+BLOCK_SCAN = 64 * 1024
+# Longest attribute value read out of a .mb
+MAX_VALUE = 4096
+
+MA_GLOBALS = 'select -ne :defaultRenderGlobals;'
+MA_PREFIX = 'setAttr ".ifp" -type "string"'
+MA_PREFIX_RE = re.compile(r'setAttr "\.ifp" -type "string" "((?:[^"\\]|\\.)*)"')
+# A line not indented with the block's attributes ends the block
+MA_BLOCK_END_RE = re.compile(r'\n(?![\t ])')
+
+MB_MAGIC = ('FOR4', 'FOR8')
+MB_PREFIX = '.ifp\0'
+# Most flag bytes between a .mb attribute's name and its value
+MB_FLAG_BYTES = 2
+
+_cache = OrderedDict()
+_reading = {}
+_lock = threading.Lock()
+
+def readScene(path):
+    """
+    The SceneInfo for the scene at path, read once per version of the file.
+    Raises IOError/OSError if it can't be read
+    """
+    path = os.path.realpath(os.path.expanduser(path))
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+
+    with _lock:
+        if key in _cache:
+            return _cache[key]
+        keyLock = _reading.setdefault(key, threading.Lock())
+
+    with keyLock:
+        with _lock:
+            info = _cache.get(key)
+        if info is None:
+            info = _parse(path, stat.st_size)
+            with _lock:
+                _cache[key] = info
+                while len(_cache) > MAX_CACHED:
+                    _cache.popitem(last=False)
+        with _lock:
+            _reading.pop(key, None)
+    return info
+
+def clearCache():
+    with _lock:
+        _cache.clear()
+
+def _parse(path, size):
+    with open(path, 'rb') as f:
+        if size == 0:
+            # Can't map an empty file
+            return SceneInfo(path, 'ma')
+
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError), e:
+            raise IOError('Cannot map scene %s : %s' % (path, e))
+
+        try:
+            if data[:4] in MB_MAGIC:
+                return SceneInfo(path, 'mb', _binaryPrefix(data))
+            return SceneInfo(path, 'ma', _asciiPrefix(data))
+        finally:
+            data.close()
+
+def _asciiPrefix(data):
+    start = data.rfind(MA_GLOBALS)
+    if start != -1:
+        block = data[start:start + BLOCK_SCAN]
+        end = MA_BLOCK_END_RE.search(block, len(MA_GLOBALS))
+        match = MA_PREFIX_RE.search(block, 0, end.start() if end else len(block))
+        # Maya always writes the block, so no prefix in it means none is set
+        return _unescape(match.group(1)) if match else None
+
+    # Not saved by maya itself, take the first prefix set anywhere
+    start = data.find(MA_PREFIX)
+    if start == -1:
+        return None
+    match = MA_PREFIX_RE.match(data[start:start + MAX_VALUE])
+    return _unescape(match.group(1)) if match else None
+
+def _unescape(value):
+    return re.sub(r'\\(.)', r'\1', value) or None
+
+def _binaryPrefix(data):
+    """
+    String attributes are stored as the attribute's name and the value, each
+    null terminated, with a flag byte or two in between
+    """
+    start = data.find(MB_PREFIX)
+    if start == -1:
+        return None
+
+    start += len(MB_PREFIX)
+    for i in range(MB_FLAG_BYTES):
+        if data[start:start + 1] >= ' ':
+            break
+        start += 1
+
+    value = data[start:start + MAX_VALUE]
+    end = value.find('\0')
+    if end <= 0:
+        return None
+    value = value[:end]
+    if any( ord(c) < 32 or ord(c) > 126 for c in value ):
+        return None
+    return value
@@ -0,0 +1,688 @@
+#!/usr/bin/python
+
+import os
+import math
+import uuid
+import logging
+import threading
+
+import mayaJob
+
+"""
+A shot split into chunks of frames, each rendered by its own mayaJob.Job
+(possibly on a different host).
+
+The SequenceJob itself never talks to a host, it hands its child jobs to
+whoever is running them (see takeNewJobs) and adds up their progress,
+frame counts and errors behind the same properties a Job has, so the UI
+can show it as one entry.
+
+Frames are handed out in one of two ways :
+  'static'  - The range is cut into fixed chunks up front and dealt out to
+              the hosts in turn.
+  'dynamic' - The frames sit in a shared FramePool and each host pulls its
+              next batch when it finishes the last one. Batches are sized 
+              from how long that host has been taking per frame, and shrink
+              as the pool runs dry so the hosts all finish at about the same
+              time. Frames from a failed batch go back into the pool.
+
+A job can also be resumed (see resumeJob), rendering only the frames that
+aren't in its output directory yet, with each run of missing frames 
+rendered by as few jobs as possible.
+
+snapshot() & restore() save and rebuild the whole thing, chunks and 
+dispatch state included, with each chunk restored like any other Job.
+"""
+
+def chunkFrames(frameRange, chunkSize):
+    """
+    Splits an inclusive (start, end) frame range into consecutive (start, end) chunks of at most chunkSize frames
+    """
+    start, end = int(frameRange[0]), int(frameRange[1])
+    chunkSize = max(1, int(chunkSize))
+    return [ (s, min(s + chunkSize - 1, end)) for s in range(start, end + 1, chunkSize) ]
+
+def missingRanges(frameRange, present):
+    """
+    The frames of an inclusive (start, end) range that aren't in present, 
+    as the fewest consecutive (start, end) ranges
+    """
+    ranges = []
+    for frame in range(int(frameRange[0]), int(frameRange[1]) + 1):
+        if frame in present:
+            continue
+        if ranges and ranges[-1][1] == frame - 1:
+            ranges[-1] = (ranges[-1][0], frame)
+        else:
+            ranges.append((frame, frame))
+    return ranges
+
+def resumeJob(job, present):
+    """
+    A new instance of job that only renders the frames that aren't in present
+    (frame numbers already rendered), or None if there's nothing left to render
+    """
+    gaps = missingRanges(job.frameRange, present)
+    if not gaps:
+        return None
+
+    if isinstance(job, SequenceJob):
+        newJob = job.getNewInstanceofJob(skipFrames=present)
+    elif len(gaps) == 1:
+        newJob = job.getNewInstanceofJob(frameRange=gaps[0])
+    else:
+        # One chunk per gap, all on the same host
+        args = job.originalArgs
+        newJob = SequenceJob(hosts=[job.host],
+                             scenePath=args['scenePath'],
+                             frameRange=job.frameRange,
+                             chunkSize=None,
+                             outputPath=args['outputPath'],
+                             camOverride=args['camOverride'],
+                             resolutionOverride=args['resolutionOverride'],
+                             user=args['user'],
+                             binPath=args['binPath'],
+                             logPath=args['logPath'],
+                             jobFactory=lambda **childArgs: job.getNewInstanceofJob(frameRange=childArgs['frameRange']),
+                             skipFrames=present)
+
+    newJob.priority = getattr(job, 'priority', 0)
+    return newJob
+
+class FramePool:
+    """
+    The frames of a sequence that haven't been handed out yet, kept as a 
+    sorted list of inclusive (start, end) ranges
+    """
+
+    def __init__(self, frameRange=None):
+        self._ranges = []
+        if frameRange:
+            self.giveBack(frameRange)
+
+    def take(self, count):
+        """
+        Takes up to count consecutive frames from the front of the pool, 
+        returns them as a (start, end) range or None if the pool is empty
+        """
+        if not self._ranges:
+            return None
+        start, end = self._ranges[0]
+        last = min(end, start + max(1, count) - 1)
+        if last == end:
+            self._ranges.pop(0)
+        else:
+            self._ranges[0] = (last + 1, end)
+        return (start, last)
+
+    def giveBack(self, frameRange):
+        self._ranges.append((int(frameRange[0]), int(frameRange[1])))
+        self._ranges.sort()
+
+        # Merge anything that now touches
+        merged = [self._ranges[0]]
+        for start, end in self._ranges[1:]:
+            if start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self._ranges = merged
+
+    def clear(self):
+        self._ranges = []
+
+    def ranges(self):
+        return list(self._ranges)
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self._ranges)
+
+class SequenceJob:
+    STATE = mayaJob.Job.STATE
+
+    # Roughly how long each batch should take in dynamic mode, in seconds
+    TARGET_BATCH_TIME = 600.0
+    MAX_BATCH_SIZE = 100
+    # Weight given to the newest batch when updating a host's seconds per frame
+    SPEED_SMOOTHING = 0.5
+    # A host is given no more batches after failing this many
+    MAX_HOST_FAILURES = 2
+
+    # Constructor arguments kept by snapshot(), see mayaJob.Job.SNAPSHOT_ARGS
+    SNAPSHOT_ARGS = ('hosts', 'scenePath', 'frameRange', 'chunkSize', 'outputPath', 'camOverride', 'resolutionOverride',
+                     'user', 'binPath', 'logPath', 'priority', 'dispatch', 'targetBatchTime', 'skipFrames')
+
+    def __init__(self,
+                 hosts,
+                 scenePath,
+                 frameRange,
+                 chunkSize,
+                 outputPath=None,
+                 camOverride=None,
+                 resolutionOverride=None,
+                 user=None,
+                 binPath='/opt/autodesk/maya2014-x64/bin/Render',
+                 logPath=None,
+                 priority=0,
+                 jobFactory=mayaJob.Job,
+                 dispatch='static',
+                 targetBatchTime=TARGET_BATCH_TIME,
+                 skipFrames=None):
+        """
+        hosts           : Hosts to spread the chunks over, in order of preference
+        chunkSize       : Most frames rendered by a single child job ('static'),
+                          or the size of each host's first batch ('dynamic'). 
+                          None for no limit
+        priority        : Queue priority of the child jobs
+        jobFactory      : Called with Job keyword arguments to make each child
+        dispatch        : 'static' or 'dynamic', see the module docstring
+        targetBatchTime : Seconds each batch should take in dynamic mode
+        skipFrames      : Frames that are already rendered, only the rest are
+        """
+        self.originalArgs = locals()
+        self.originalArgs.pop('self')
+
+        self._id = uuid.uuid4()
+        self.logger = logging.getLogger(__name__)
+
+        if not hosts:
+            raise ValueError('No hosts to render on')
+
+        self._hosts = list(hosts)
+        self._scenePath = scenePath
+        self._frameRange = ( int(frameRange[0]), int(frameRange[1]) )
+        self._outputPath = outputPath
+        self._camOverride = camOverride
+        self._resOverride = resolutionOverride
+        self._binPath = binPath
+        self._jobFactory = jobFactory
+        self._jobArgs = { 'scenePath' : scenePath,
+                          'outputPath' : outputPath,
+                          'camOverride' : camOverride,
+                          'resolutionOverride' : resolutionOverride,
+                          'user' : user,
+                          'binPath' : binPath,
+                          'logPath' : logPath }
+
+        self.priority = priority
+
+        if self._frameRange[1] < self._frameRange[0]:
+            raise ValueError('Negative frame range')
+
+        if dispatch not in ('static', 'dynamic'):
+            raise ValueError('Unknown dispatch mode %s' % dispatch)
+
+        self._dispatch = dispatch
+        self._targetBatchTime = targetBatchTime
+
+        # What's left to render, and how many frames were already done before
+        ranges = missingRanges(self._frameRange, set(skipFrames)) if skipFrames else [self._frameRange]
+        self._framesSkipped = (self._frameRange[1] - self._frameRange[0] + 1) - sum(end - start + 1 for start, end in ranges)
+        # Batch size for hosts in dynamic mode until there's a speed to go by
+        self._chunkSize = max(1, int(chunkSize)) if chunkSize is not None else SequenceJob.MAX_BATCH_SIZE
+        if chunkSize is None:
+            chunkSize = max(end - start + 1 for start, end in ranges) if ranges else 1
+
+        self._children = []
+        self._undispatched = []
+        self._lock = threading.RLock()
+
+        # Dynamic dispatch state
+        self._pool = FramePool()
+        self._current = {}
+        self._secondsPerFrame = {}
+        self._failures = {}
+        self._requeued = set()
+
+        if dispatch == 'static':
+            chunks = [ chunk for frameRange in ranges for chunk in chunkFrames(frameRange, chunkSize) ]
+            for i, chunk in enumerate(chunks):
+                self._addChild(self._hosts[i % len(self._hosts)], chunk)
+        else:
+            for frameRange in ranges:
+                self._pool.giveBack(frameRange)
+            for host in self._hosts:
+                batch = self._pool.take(int(chunkSize))
+                if batch is None:
+                    break
+                self._current[host] = self._addChild(host, batch)
+
+        self.logger.info('{0} Split into {1} chunks'.format(repr(self), len(self._children)))
+
+    def _addChild(self, host, frameRange):
+        args = dict(self._jobArgs)
+        args['host'] = host
+        args['frameRange'] = frameRange
+
+        child = self._jobFactory(**args)
+        with self._lock:
+            self._children.append(child)
+            self._undispatched.append(child)
+        return child
+
+    def __str__(self):
+        text = '[%s] : %s@%d hosts : { %d jobs, Frame %d/%d } %.2f%%' % (self.state, os.path.basename(self._scenePath), len(self.hosts), len(self._children), self.currentFrame, self.totalFrames, self.progress)
+        if self.running:
+            text += mayaJob.formatThroughput(self.framesPerHour, self.eta)
+        return text
+
+    def __repr__(self):
+        return '<{uid}> Hosts:{hosts} | Scene:{scene} | Frames:{framecount} | Jobs:{jobs} | Status:{status}'.format(
+            uid=self._id,
+            hosts=','.join(self.hosts),
+            scene=os.path.basename(self._scenePath),
+            framecount=self.totalFrames,
+            jobs=len(self._children),
+            status=self._state)
+
+    def takeNewJobs(self):
+        """
+        Returns the child jobs that haven't been handed out yet, they need to be run like any other job
+        """
+        with self._lock:
+            if self._dispatch == 'dynamic':
+                self._refill()
+            jobs, self._undispatched = self._undispatched, []
+        return jobs
+
+    def _refill(self):
+        """
+        Gives every host that finished its batch the next one from the pool
+        """
+        for host, child in self._current.items():
+            if not child.completed():
+                continue
+
+            del self._current[host]
+
+            if child.state == 'Finished':
+                speed = child.secondsPerFrame
+                if speed:
+                    previous = self._secondsPerFrame.get(host, speed)
+                    self._secondsPerFrame[host] = (SequenceJob.SPEED_SMOOTHING * speed + 
+                                                   (1.0 - SequenceJob.SPEED_SMOOTHING) * previous)
+            else:
+                # Put the frames back for someone else, frames from a failed render can't be trusted
+                self._pool.giveBack(child.frameRange)
+                self._requeued.add(child)
+                self._failures[host] = self._failures.get(host, 0) + 1
+                self.logger.info('{0} Batch {1}-{2} failed on {3}, returning frames to the pool'.format(
+                    repr(self), child.frameRange[0], child.frameRange[1], host))
+
+        idleHosts = [ host for host in self._hosts 
+                      if host not in self._current and self._failures.get(host, 0) < SequenceJob.MAX_HOST_FAILURES ]
+
+        for host in idleHosts:
+            if not len(self._pool):
+                break
+            batch = self._pool.take(self._batchSize(host))
+            self._current[host] = self._addChild(host, batch)
+
+    def requeue(self, child):
+        """
+        Puts the frames a failed child never got to back up for rendering, on 
+        the next host along. Returns the new child, or None if there isn't one 
+        (nothing was left, or in dynamic mode where the frames go back in the pool)
+        """
+        with self._lock:
+            if child not in self._children or child in self._requeued:
+                return None
+
+            done = SequenceJob._framesDone(child)
+            remaining = (child.frameRange[0] + done, child.frameRange[1])
+
+            # Its finished frames still count, they're just not the child's any more
+            self._requeued.add(child)
+            self._framesSkipped += done
+
+            if self._dispatch == 'dynamic':
+                if self._current.get(child.host) is child:
+                    del self._current[child.host]
+                self._failures[child.host] = self._failures.get(child.host, 0) + 1
+                if remaining[0] <= remaining[1]:
+                    self._pool.giveBack(remaining)
+                return None
+
+            if remaining[0] > remaining[1]:
+                return None
+
+            host = self._hosts[(self._hosts.index(child.host) + 1) % len(self._hosts)] if child.host in self._hosts else child.host
+            self.logger.info('{0} Requeueing frames {1}-{2} on {3}'.format(repr(self), remaining[0], remaining[1], host))
+            return self._addChild(host, remaining)
+
+    def _batchSize(self, host):
+        """
+        Enough frames to keep the host busy for about targetBatchTime, but
+        never more than an even share of what's left so the ending is balanced.
+        A host that hasn't been measured yet is sized by the slowest one that
+        has, and before any host has been measured the first batch size is used
+        """
+        speed = self._secondsPerFrame.get(host)
+        if speed is None and self._secondsPerFrame:
+            # Not measured yet, go by the slowest known host to stay on the small side
+            speed = max(self._secondsPerFrame.values())
+
+        if speed:
+            size = int(self._targetBatchTime / speed)
+        else:
+            size = self._chunkSize
+
+        share = int(math.ceil(len(self._pool) / float(max(1, self._usableHostCount()))))
+        return max(1, min(size, share, SequenceJob.MAX_BATCH_SIZE))
+
+    def _usableHostCount(self):
+        return len([ host for host in self._hosts if self._failures.get(host, 0) < SequenceJob.MAX_HOST_FAILURES ])
+
+    def _activeChildren(self):
+        """
+        Children whose frames still count, failed batches that were handed to another host don't
+        """
+        with self._lock:
+            return [ child for child in self._children if child not in self._requeued ]
+
+    @property
+    def hostSecondsPerFrame(self):
+        with self._lock:
+            return dict(self._secondsPerFrame)
+
+    @property
+    def framesRemaining(self):
+        with self._lock:
+            return len(self._pool)
+
+    @property
+    def children(self):
+        with self._lock:
+            return list(self._children)
+
+    @staticmethod
+    def _frameCount(job):
+        return job.frameRange[1] - job.frameRange[0] + 1
+
+    @staticmethod
+    def _framesDone(job):
+        if job.state == 'Finished':
+            return SequenceJob._frameCount(job)
+        return job.currentFrame
+
+    @property
+    def _state(self):
+        children = self._activeChildren()
+        if children and all(child.completed() for child in children):
+            if len(self._pool) and self._usableHostCount():
+                # Between batches
+                return 'r'
+            if len(self._pool) or any(child.state == 'Error' for child in children):
+                return 'e'
+            return 'c'
+        elif any(child.running for child in children):
+            return 'r'
+        elif any(child.paused for child in children):
+            return 'p'
+        elif any(child.connecting for child in children):
+            return 'n'
+        return 'i'
+
+    def run(self):
+        """
+        Nothing to do, the children are run individually
+        """
+        pass
+
+    def update(self):
+        pass
+
+    def pause(self):
+        for child in self.children:
+            if child.running:
+                child.pause()
+
+    def resume(self):
+        for child in self.children:
+            if child.paused:
+                child.resume()
+
+    def kill(self):
+        with self._lock:
+            self._pool.clear()
+        for child in self.children:
+            child.kill()
+
+    def close(self):
+        self.logger.info('{0} Closing all chunks'.format(repr(self)))
+        with self._lock:
+            self._pool.clear()
+        for child in self.children:
+            child.close()
+
+    def detach(self):
+        for child in self.children:
+            child.detach()
+
+    def snapshot(self):
+        with self._lock:
+            args = dict( (name, self.originalArgs[name]) for name in SequenceJob.SNAPSHOT_ARGS )
+            if args['skipFrames']:
+                args['skipFrames'] = sorted(args['skipFrames'])
+
+            children = list(self._children)
+            return { 'kind' : 'sequence',
+                     'id' : str(self._id),
+                     'args' : args,
+                     'children' : [ child.snapshot() for child in children ],
+                     'requeued' : [ i for i, child in enumerate(children) if child in self._requeued ],
+                     'current' : dict( (host, children.index(child)) for host, child in self._current.iteritems() ),
+                     'pool' : self._pool.ranges(),
+                     'secondsPerFrame' : dict(self._secondsPerFrame),
+                     'failures' : dict(self._failures),
+                     'framesSkipped' : self._framesSkipped }
+
+    @classmethod
+    def restore(cls, snapshot, jobFactory, restoreChild):
+        """
+        Rebuilds a sequence job from snapshot(), restoreChild is called with 
+        each chunk's snapshot and returns the rebuilt chunk (see mayaJob.Job.restore)
+        """
+        args = dict(snapshot['args'])
+        # Every frame is skipped so nothing gets split up, the chunks come from the snapshot
+        start, end = args['frameRange']
+        job = cls(jobFactory=jobFactory, **dict(args, skipFrames=range(start, end + 1)))
+        job.originalArgs['skipFrames'] = args['skipFrames']
+
+        job._id = uuid.UUID(snapshot['id'])
+        children = [ restoreChild(child) for child in snapshot['children'] ]
+        with job._lock:
+            job._children = children
+            job._requeued = set( children[i] for i in snapshot['requeued'] )
+            job._current = dict( (host, children[i]) for host, i in snapshot['current'].iteritems() )
+            for frameRange in snapshot['pool']:
+                job._pool.giveBack(frameRange)
+            job._secondsPerFrame = dict(snapshot['secondsPerFrame'])
+            job._failures = dict(snapshot['failures'])
+            job._framesSkipped = snapshot['framesSkipped']
+            # Anything unfinished gets handed out again, to be run or (if it was rendering) followed
+            job._undispatched = [ child for child in children if not child.completed() and child not in job._requeued ]
+        return job
+
+    def getNewInstanceofJob(self, skipFrames=None):
+        """
+        A fresh copy of this job, leaving out skipFrames if they're given
+        """
+        self.logger.info('{0} Returning new instance of sequence job'.format(repr(self)))
+        args = dict(self.originalArgs)
+        if skipFrames is not None:
+            args['skipFrames'] = skipFrames
+        return self.__class__(**args)
+
+    def completed(self):
+        return self._state in ('c', 'e')
+
+    @property
+    def host(self):
+        return self.hosts[0]
+
+    @property
+    def hosts(self):
+        hosts = []
+        for child in self.children:
+            if child.host not in hosts:
+                hosts.append(child.host)
+        return hosts or self._hosts
+
+    @property
+    def binaryPath(self):
+        return self._binPath
+
+    @property
+    def scenePath(self):
+        return self._scenePath
+
+    @property
+    def outputPath(self):
+        return self._outputPath
+
+    @property
+    def frameRange(self):
+        return self._frameRange
+
+    @property
+    def cameraOverride(self):
+        return self._camOverride if self._camOverride else 'n/a'
+
+    @property
+    def resolutionOverride(self):
+        return self._resOverride if self._resOverride else ('n/a', 'n/a')
+
+    @property
+    def logPath(self):
+        return self.children[0].logPath
+
+    @property
+    def jobLogPath(self):
+        return self.children[0].jobLogPath
+
+    @property
+    def state(self):
+        return SequenceJob.STATE[self._state]
+
+    @property
+    def outputPrefix(self):
+        return self.children[0].outputPrefix
+
+    @property
+    def output(self):
+        """
+        A line per chunk, followed by the log of the first chunk that failed
+        (or is running if none have failed)
+        """
+        child = self._featuredChild()
+        return self.outputHeader + (child.output if child is not None else [])
+
+    @property
+    def outputHeader(self):
+        children = self._activeChildren()
+        lines = [ '%d-%d %s' % (child.frameRange[0], child.frameRange[1], str(child)) for child in children ]
+
+        child = self._featuredChild(children)
+        if child is not None:
+            lines.append('')
+            lines.append('==== Frames %d-%d on %s ====' % (child.frameRange[0], child.frameRange[1], child.host))
+        return lines
+
+    def outputSince(self, cursor):
+        """
+        The featured chunk's log a bit at a time, see mayaJob.Job.outputSince
+        """
+        child = self._featuredChild()
+        if child is None:
+            return [], None, cursor is None
+        return child.outputSince(cursor)
+
+    def _featuredChild(self, children=None):
+        """
+        The chunk whose log is shown, the first that failed or is running if none have
+        """
+        children = self._activeChildren() if children is None else children
+        for wanted in ('Error', 'Running'):
+            for child in children:
+                if child.state == wanted:
+                    return child
+        return None
+
+    @property
+    def frameProgress(self):
+        running = [ child.frameProgress for child in self._activeChildren() if child.running ]
+        if running:
+            return sum(running) / len(running)
+        return 100.0 if self.completed() else 0.0
+
+    @property
+    def progress(self):
+        total = 0.0
+        for child in self._activeChildren():
+            percentage = 100.0 if child.state == 'Finished' else child.progress
+            total += percentage * SequenceJob._frameCount(child)
+        total += 100.0 * self._framesSkipped
+        return total / float(self._frameRange[1] - self._frameRange[0] + 1)
+
+    @property
+    def currentFrame(self):
+        return min(self._framesSkipped + sum(SequenceJob._framesDone(child) for child in self._activeChildren()), self.totalFrames)
+
+    @property
+    def framesPerHour(self):
+        """
+        Combined rate of the chunks rendering now
+        """
+        rates = [ child.framesPerHour for child in self._activeChildren() if child.framesPerHour ]
+        return sum(rates) if rates else None
+
+    @property
+    def framesLeft(self):
+        with self._lock:
+            pooled = len(self._pool)
+        return pooled + sum(child.framesLeft for child in self._activeChildren())
+
+    @property
+    def eta(self):
+        rate = self.framesPerHour
+        if not rate:
+            return None
+        return 3600.0 * self.framesLeft / rate
+
+    @property
+    def errorCode(self):
+        children = self._activeChildren()
+        for child in children:
+            if child.errorCode:
+                return child.errorCode
+        if children and all(child.completed() for child in children):
+            return 0
+        return None
+
+    @property
+    def errorCodeDetail(self):
+        if self.errorCode in mayaJob.Job.ERROR:
+            return mayaJob.Job.ERROR[self.errorCode]
+        else:
+            return 'Unknown error'
+
+    @property
+    def totalFrames(self):
+        return self._frameRange[1] - self._frameRange[0]
+
+    @property
+    def connecting(self):
+        return self._state == 'n'
+
+    @property
+    def pausable(self):
+        return all(child.pausable for child in self.children)
+
+    @property
+    def paused(self):
+        return self._state == 'p'
+
+    @property
+    def running(self):
+        return self._state == 'r'
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+import time
+import logging
+import threading
+
+from pexpect import pxssh, EOF, TIMEOUT
+
+"""
+Keeps logged in ssh sessions around so jobs don't pay for a fresh login
+(and sshd doesn't get hammered) every time one is created or restarted.
+
+A session only ever belongs to one job at a time, it's parked here once
+that job is finished with it and checked to still be responsive before it
+is handed out again. Connection sharing (ControlMaster) is turned off for
+every session, so pausing one job's session can't freeze any other.
+"""
+
+class SessionPool:
+    # Most idle sessions kept per host
+    MAX_IDLE = 4
+    # Idle sessions older than this (seconds) are logged out rather than reused
+    IDLE_TIMEOUT = 600.0
+    # How long a parked session gets to answer the health check
+    HEALTH_TIMEOUT = 10
+
+    SSH_OPTIONS = { 'ControlMaster' : 'no',
+                    'ControlPath' : 'none' }
+
+    def __init__(self, maxIdle=MAX_IDLE, idleTimeout=IDLE_TIMEOUT, logger=None):
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.maxIdle = maxIdle
+        self.idleTimeout = idleTimeout
+
+        # (user, host) -> list of (session, time parked), most recently parked last
+        self._idle = {}
+        self._checks = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, host, user):
+        """
+        Returns a logged in session to host that nothing else is using,
+        raises pxssh.ExceptionPxssh if a new one is needed and login fails
+        """
+        key = (user, host)
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                session, parked = idle.pop()
+
+            if time.time() - parked > self.idleTimeout:
+                self.__discard(session)
+            elif self.__healthy(session):
+                self.logger.debug('Reusing session to %s@%s' % (user, host))
+                return session
+            else:
+                self.logger.info('Session to %s@%s failed its health check, discarding' % (user, host))
+                self.__discard(session)
+
+        self.logger.debug('Opening new session to %s@%s' % (user, host))
+        session = pxssh.pxssh(options=SessionPool.SSH_OPTIONS)
+        try:
+            session.login(host, user)
+        except pxssh.ExceptionPxssh:
+            session.close(force=True)
+            raise
+        session.poolKey = key
+        return session
+
+    def release(self, session):
+        """
+        Parks a session once its job is done with it, the shell should be
+        back at the prompt (or about to be)
+        """
+        if not session.isalive():
+            return
+
+        key = getattr(session, 'poolKey', None)
+        if key is None:
+            self.__discard(session)
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            idle.append((session, time.time()))
+            surplus = idle[:-self.maxIdle] if len(idle) > self.maxIdle else []
+            del idle[:len(surplus)]
+
+        for session, parked in surplus:
+            self.__discard(session)
+
+    def idleCount(self, host=None):
+        with self._lock:
+            return sum(len(idle) for (user, h), idle in self._idle.iteritems() if host is None or h == host)
+
+    def closeAll(self):
+        with self._lock:
+            sessions = [ session for idle in self._idle.values() for session, parked in idle ]
+            self._idle = {}
+
+        for session in sessions:
+            self.__discard(session)
+
+    def __healthy(self, session):
+        """
+        Checks the shell still answers, and reads up to the fresh prompt so
+        nothing left over from the last job is seen by the next one
+        """
+        if not session.isalive():
+            return False
+
+        with self._lock:
+            self._checks += 1
+            check = self._checks
+
+        try:
+            # The shell has to do the sum, so the echoed command line can't match
+            session.sendline('echo READY_$((%d+1))' % check)
+            session.expect('READY_%d' % (check + 1), timeout=SessionPool.HEALTH_TIMEOUT)
+            return bool(session.prompt(timeout=SessionPool.HEALTH_TIMEOUT))
+        except (EOF, TIMEOUT, OSError, ValueError):
+            return False
+
+    def __discard(self, session):
+        try:
+            session.logout()
+        except Exception, e:
+            self.logger.debug('Error logging out pooled session : %s' % e)
+        try:
+            session.close(force=True)
+        except Exception, e:
+            self.logger.debug('Error closing pooled session : %s' % e)
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+import sys
+import time
+import logging
+import threading
+
+"""
+Notices renders that have died without their job finding out (maya.bin
+killed on the host, the host rebooted under a shell that never hung up...)
+which would otherwise sit 'Running' forever.
+
+For every running job the watchdog learns how often the maya log usually
+reports progress and how long frames usually take. Once a job has been
+quiet for TOLERANCE times longer than usual it asks the host whether the
+render is still there (see mayaJob.Job.renderAlive), and hands the job to 
+onStall if it isn't.
+"""
+
+class JobTimings:
+    """
+    What the watchdog has learnt about one job
+    """
+
+    def __init__(self):
+        self.progressUpdates = 0
+        self.lastProgressTime = None
+        self.framesSeen = 0
+        self.lastFrameTime = None
+
+        # Smoothed seconds between progress updates & between frames, and how many samples went into each
+        self.progressInterval = None
+        self.progressSamples = 0
+        self.frameInterval = None
+        self.frameSamples = 0
+
+        # When the host last said the render was still alive
+        self.lastConfirmed = None
+        self.unanswered = 0
+
+class StallWatchdog(threading.Thread):
+    INTERVAL = 30.0
+    # How many times the usual gap a job has to go quiet for before the host is asked about it
+    TOLERANCE = 5.0
+    # Never ask about a job that's been quiet for less than this (seconds)
+    MIN_TIMEOUT = 300.0
+    # How long a job can go quiet before enough has been seen to know what's usual
+    INITIAL_TIMEOUT = 3600.0
+    MIN_SAMPLES = 3
+    # Weight given to the newest gap when updating the baselines
+    SMOOTHING = 0.3
+    # Give up on a job once its host has failed to answer this many times in a row
+    MAX_UNANSWERED = 3
+
+    def __init__(self, onStall, interval=INTERVAL, tolerance=TOLERANCE, logger=None):
+        """
+        onStall : Called from the watchdog thread with each job whose render has gone
+        """
+        threading.Thread.__init__(self, name='StallWatchdog')
+        self.daemon = True
+
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.interval = interval
+        self.tolerance = tolerance
+        self._onStall = onStall
+
+        self._timings = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def watch(self, job):
+        with self._lock:
+            self._timings.setdefault(job, JobTimings())
+
+    def unwatch(self, job):
+        with self._lock:
+            self._timings.pop(job, None)
+
+    def timings(self, job):
+        with self._lock:
+            return self._timings.get(job)
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        with self._lock:
+            watched = self._timings.items()
+
+        now = time.time()
+        for job, timings in watched:
+            if job.completed():
+                self.unwatch(job)
+                continue
+
+            if not job.running:
+                continue
+
+            self.__observe(job, timings)
+
+            if not self.__quietTooLong(job, timings, now):
+                continue
+
+            alive = job.renderAlive()
+            if alive:
+                self.logger.info('%s has been quiet for a while but is still rendering' % repr(job))
+                timings.lastConfirmed = now
+                timings.unanswered = 0
+                continue
+
+            if alive is None:
+                timings.unanswered += 1
+                if timings.unanswered < StallWatchdog.MAX_UNANSWERED:
+                    self.logger.info('%s has been quiet for a while and %s isn\'t answering' % (repr(job), job.host))
+                    continue
+
+            self.logger.error('%s has stalled, its render is no longer running' % repr(job))
+            self.unwatch(job)
+            try:
+                self._onStall(job)
+            except Exception, e:
+                self.logger.error('Error handling stalled job %s : %s' % (repr(job), e), exc_info=sys.exc_info())
+
+    def __observe(self, job, timings):
+        """
+        Updates the baselines with whatever the job has done since last time
+        """
+        updates = job.progressUpdates
+        lastProgress = job.lastProgressTime
+        if updates > timings.progressUpdates and lastProgress is not None:
+            if timings.lastProgressTime is not None:
+                gap = (lastProgress - timings.lastProgressTime) / float(updates - timings.progressUpdates)
+                timings.progressInterval = StallWatchdog.__smooth(timings.progressInterval, gap)
+                timings.progressSamples += 1
+            timings.progressUpdates = updates
+            timings.lastProgressTime = lastProgress
+
+        frameTimes = job.frameTimes
+        for i in range(max(1, timings.framesSeen), len(frameTimes)):
+            timings.frameInterval = StallWatchdog.__smooth(timings.frameInterval, frameTimes[i] - frameTimes[i - 1])
+            timings.frameSamples += 1
+        if frameTimes:
+            timings.lastFrameTime = frameTimes[-1]
+        timings.framesSeen = len(frameTimes)
+
+    @staticmethod
+    def __smooth(average, sample):
+        if average is None:
+            return sample
+        return StallWatchdog.SMOOTHING * sample + (1.0 - StallWatchdog.SMOOTHING) * average
+
+    def __timeout(self, interval, samples):
+        if interval is None or samples < StallWatchdog.MIN_SAMPLES:
+            return StallWatchdog.INITIAL_TIMEOUT
+        return max(StallWatchdog.MIN_TIMEOUT, self.tolerance * interval)
+
+    def __quietTooLong(self, job, timings, now):
+        """
+        Whether the job has gone without progress for much longer than usual,
+        and without a frame for much longer than frames usually take
+        """
+        since = lambda *times: now - max([ t for t in times if t is not None ] or [now])
+
+        started = job.startTime
+        quiet = since(started, timings.lastProgressTime, timings.lastFrameTime, timings.lastConfirmed)
+        if quiet < self.__timeout(timings.progressInterval, timings.progressSamples):
+            return False
+
+        if timings.frameInterval is not None:
+            sinceFrame = since(started, timings.lastFrameTime, timings.lastConfirmed)
+            if sinceFrame < self.__timeout(timings.frameInterval, timings.frameSamples):
+                return False
+
+        return True
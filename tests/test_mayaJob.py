@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+import os
+import sys
+import shutil
+import time
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mayaJob
+from pexpect import TIMEOUT
+
+class FakeSession:
+    """
+    Stands in for a pxssh session, read_nonblocking hands back whatever was queued with answer()
+    """
+    PROMPT = r'\[PEXPECT\][\$\#] '
+
+    def __init__(self):
+        self.sent = []
+        self._queue = []
+
+    def answer(self, data):
+        self._queue.append(data)
+
+    def sendline(self, line):
+        self.sent.append(line)
+
+    def read_nonblocking(self, size, timeout=0):
+        if not self._queue:
+            raise TIMEOUT('Nothing to read')
+        return self._queue.pop(0)
+
+    def isalive(self):
+        return True
+
+    def kill(self, sig):
+        pass
+
+    def logout(self):
+        pass
+
+    def close(self, force=False):
+        pass
+
+class FakePool:
+    def __init__(self):
+        self.released = []
+
+    def acquire(self, host, user):
+        return FakeSession()
+
+    def release(self, session):
+        self.released.append(session)
+
+class SlowStream(mayaJob.LogStream):
+    """
+    A LogStream whose finish() waits until it's let go, rather than fetching the end of the log over ssh
+    """
+    def __init__(self, localPath, lines):
+        mayaJob.LogStream.__init__(self, 'host', 'user', 'render.log', localPath)
+        self.lines = lines
+        self.release = threading.Event()
+
+    def finish(self, timeout):
+        self.release.wait(timeout)
+        self.close()
+        return self.lines
+
+class ReadSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.home = os.environ.get('HOME')
+        os.environ['HOME'] = self.directory
+
+        scenePath = os.path.join(self.directory, 'scene.ma')
+        with open(scenePath, 'w') as f:
+            f.write('//Maya ASCII scene\n')
+
+        self.frames = []
+        self.job = mayaJob.Job('host', scenePath, (1, 3),
+                               logPath=os.path.join(self.directory, 'render.log'),
+                               sessionPool=FakePool(),
+                               deferred=True,
+                               onFrame=lambda job, frame: self.frames.append(frame))
+        self.job.prepare()
+        self.session = self.job.process
+
+    def tearDown(self):
+        if self.home is not None:
+            os.environ['HOME'] = self.home
+        shutil.rmtree(self.directory)
+
+    def testEchoedCommandDoesNotComplete(self):
+        self.job.run()
+        self.assertEqual(self.job.state, 'Running')
+
+        # The remote pty echoes the command line back before anything else
+        self.session.answer('%s\r\n' % self.session.sent[-1])
+        self.job.readSession()
+
+        self.assertEqual(self.job.state, 'Running')
+        self.assertEqual(self.frames, [])
+
+    def testCompleteSuccess(self):
+        self.job.run()
+        self.session.answer('%s\r\n' % self.session.sent[-1])
+        self.session.answer('%s\r\n' % mayaJob.Job.START_SENTINEL)
+        self.job.readSession()
+        self.job.readSession()
+        self.assertEqual(self.job.state, 'Running')
+
+        self.session.answer('COMPLETE_SUCCESS\r\n')
+        self.job.readSession()
+        self.assertEqual(self.job.state, 'Finished')
+        self.assertEqual(self.frames, [1, 2, 3])
+
+    def testStreamedLogFinishesInBackground(self):
+        self.job.run()
+        self.session.answer('%s\r\n' % mayaJob.Job.START_SENTINEL)
+        self.job.readSession()
+
+        stream = SlowStream(os.path.join(self.directory, 'stream.log'),
+                            ['Maya exited with status 211'])
+        self.job._logTail = stream
+
+        self.session.answer('COMPLETE_ERROR\r\n')
+        self.job.readSession()
+        # Still waiting on the end of the log, without blocking the reader
+        self.assertEqual(self.job.state, 'Running')
+        self.assertEqual(self.job.fileno(), None)
+
+        stream.release.set()
+        end = time.time() + 5.0
+        while not self.job.completed() and time.time() < end:
+            time.sleep(0.01)
+
+        self.assertEqual(self.job.state, 'Error')
+        self.assertEqual(self.job.errorCode, 211)
+
+if __name__ == '__main__':
+    unittest.main()
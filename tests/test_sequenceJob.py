@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sequenceJob import SequenceJob, FramePool
+
+class FakeJob:
+    """
+    Stands in for a mayaJob.Job, just enough for SequenceJob to hand out batches
+    """
+    def __init__(self, host, frameRange, **args):
+        self.host = host
+        self.frameRange = frameRange
+        self.state = 'Running'
+        self.secondsPerFrame = None
+        self.currentFrame = 0
+        self.running = True
+        self.connecting = False
+        self.paused = False
+
+    def completed(self):
+        return self.state in ('Finished', 'Error')
+
+    def finish(self, secondsPerFrame):
+        self.state = 'Finished'
+        self.running = False
+        self.secondsPerFrame = secondsPerFrame
+
+class FramePoolTest(unittest.TestCase):
+    def testTake(self):
+        pool = FramePool((1, 10))
+        self.assertEqual(pool.take(4), (1, 4))
+        self.assertEqual(pool.take(0), (5, 5))
+        self.assertEqual(pool.take(100), (6, 10))
+        self.assertEqual(pool.take(1), None)
+        self.assertEqual(len(pool), 0)
+
+    def testGiveBackMerges(self):
+        pool = FramePool((1, 10))
+        pool.take(10)
+        pool.giveBack((5, 6))
+        pool.giveBack((1, 2))
+        pool.giveBack((3, 4))
+        pool.giveBack((9, 10))
+        self.assertEqual(pool.ranges(), [(1, 6), (9, 10)])
+        self.assertEqual(len(pool), 8)
+        self.assertEqual(pool.take(10), (1, 6))
+
+class BatchSizeTest(unittest.TestCase):
+    def makeJob(self, hosts, frameRange=(1, 1000), chunkSize=5):
+        return SequenceJob(hosts, 'scene.ma', frameRange, chunkSize,
+                           jobFactory=FakeJob, dispatch='dynamic', targetBatchTime=600.0)
+
+    def testUnmeasuredUsesChunkSize(self):
+        job = self.makeJob(['a', 'b'])
+        self.assertEqual(job._batchSize('a'), 5)
+
+    def testMeasuredHost(self):
+        job = self.makeJob(['a', 'b'])
+        job._secondsPerFrame['a'] = 60.0
+        self.assertEqual(job._batchSize('a'), 10)
+
+    def testUnmeasuredHostGoesBySlowestHost(self):
+        job = self.makeJob(['a', 'b', 'c'])
+        job._secondsPerFrame['a'] = 10.0
+        job._secondsPerFrame['b'] = 60.0
+        self.assertEqual(job._batchSize('c'), 10)
+
+    def testNoMoreThanAnEvenShare(self):
+        job = self.makeJob(['a', 'b'], frameRange=(1, 30))
+        job._secondsPerFrame['a'] = 1.0
+        # 20 frames left after the first batches, split over 2 hosts
+        self.assertEqual(job._batchSize('a'), 10)
+
+    def testNeverMoreThanMax(self):
+        job = self.makeJob(['a'], frameRange=(1, 10000))
+        job._secondsPerFrame['a'] = 0.5
+        self.assertEqual(job._batchSize('a'), SequenceJob.MAX_BATCH_SIZE)
+
+    def testRefillSizesFromMeasuredSpeed(self):
+        job = self.makeJob(['a', 'b'])
+        first = job.takeNewJobs()
+        self.assertEqual([ child.frameRange for child in first ], [(1, 5), (6, 10)])
+
+        first[0].finish(60.0)
+        second = job.takeNewJobs()
+        self.assertEqual([ (child.host, child.frameRange) for child in second ], [('a', (11, 20))])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,603 @@
+#!/usr/bin/python
+
+import os
+import re
+import sys
+import time
+import json
+import pipes
+import hashlib
+import logging
+import threading
+import subprocess
+import collections
+from collections import deque
+
+"""
+Copies rendered frames back from the hosts in the background.
+
+A Transfer is a set of remote paths (shell globs are fine) to copy into a
+local directory. The TransferManager first lists what matches on the host
+(one ssh command), then copies the files one per stream, running several
+streams per host at once with an overall cap on how many run in total.
+
+Every stream is a plain 'ssh host cat file' read through a pipe, so the
+bytes copied (and from them the rate & ETA) are counted exactly. The ssh
+connections to each host are shared (ControlMaster) so starting a stream
+per file costs next to nothing. Files are written to a '.part' file and
+only renamed into place once complete.
+
+Each destination directory keeps a Manifest of what was copied into it
+(size, remote modification time and optionally an md5), and the listing
+brings back the same details for the remote files, so anything that's
+already been copied and hasn't changed since is skipped.
+
+A FrameCollector hooked up as a job's onFrame copies each frame back as
+soon as it has rendered, rather than waiting for the whole job.
+"""
+
+def frameNumber(path, prefix):
+    """
+    The frame number in a rendered image's file name (the last run of digits
+    after the prefix, so prefix.0012.exr and prefix_12.tga are both 12), or 
+    None if there isn't one
+    """
+    name = os.path.basename(path)
+    if not name.startswith(prefix):
+        return None
+    digits = re.findall(r'\d+', name[len(prefix):])
+    return int(digits[-1]) if digits else None
+
+def frameMatch(prefix, first, last=None):
+    """
+    A Transfer match taking only the images of frames first to last (just 
+    first if last isn't given). A glob on the frame number can't tell 12 
+    from 112, this looks at the number itself
+    """
+    last = first if last is None else last
+    def match(path):
+        frame = frameNumber(path, prefix)
+        return frame is not None and first <= frame <= last
+    return match
+
+RemoteFile = collections.namedtuple('RemoteFile', ['path', 'size', 'mtime', 'checksum'])
+
+class Manifest:
+    """
+    What has been copied into a directory, file name -> size, remote 
+    modification time and checksum (if one was asked for). Kept as JSON 
+    in the directory itself.
+    """
+    FILE_NAME = '.rendermanager-manifest.json'
+
+    def __init__(self, directory, logger=None):
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.directory = directory
+        self.path = os.path.join(directory, Manifest.FILE_NAME)
+
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except IOError:
+            pass
+        except ValueError, e:
+            self.logger.error('Ignoring broken manifest %s : %s' % (self.path, e))
+
+    def upToDate(self, remote):
+        """
+        Whether the remote file was already copied here and hasn't changed since
+        """
+        name = os.path.basename(remote.path)
+        with self._lock:
+            entry = self._entries.get(name)
+
+        if entry is None or entry['size'] != remote.size or entry['mtime'] != remote.mtime:
+            return False
+
+        if remote.checksum and entry.get('checksum') and entry['checksum'] != remote.checksum:
+            return False
+
+        try:
+            # Deleted or changed locally since
+            return os.path.getsize(os.path.join(self.directory, name)) == remote.size
+        except OSError:
+            return False
+
+    def record(self, remote, checksum=None):
+        with self._lock:
+            self._entries[os.path.basename(remote.path)] = { 'size' : remote.size,
+                                                             'mtime' : remote.mtime,
+                                                             'checksum' : checksum or remote.checksum }
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+
+        temp = self.path + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                json.dump(entries, f)
+            os.rename(temp, self.path)
+        except (IOError, OSError), e:
+            self.logger.error('Cannot save manifest %s : %s' % (self.path, e))
+
+class Transfer:
+    STATE = {
+        'q' : 'Queued',
+        'l' : 'Listing',
+        't' : 'Transferring',
+        'c' : 'Finished',
+        'e' : 'Error',
+        'x' : 'Cancelled'
+        }
+
+    # Seconds of history the transfer rate is averaged over
+    RATE_WINDOW = 5.0
+
+    def __init__(self, host, paths, destination, user=None, match=None, verify=False):
+        """
+        paths       : Remote paths to copy, expanded by the remote shell
+        destination : Local directory the files are copied into
+        match       : Called with each remote path found, only those it returns True for are copied
+        verify      : Compare md5 checksums as well as sizes & times (reads every remote file)
+        """
+        self.host = host
+        self.user = user
+        self.paths = list(paths)
+        self.destination = destination
+        self.match = match
+        self.verify = verify
+
+        self._state = 'q'
+        self.error = None
+
+        # RemoteFile of every file that needs copying, and of those that were already up to date
+        self.files = []
+        self.skipped = []
+        self.failed = []
+        self._remaining = 0
+
+        self.bytesTotal = None
+        self.bytesDone = 0
+        self._samples = deque()
+
+        self.started = None
+        self.finished = None
+
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return '[%s] %s:%s -> %s' % (self.state, self.host, ' '.join(self.paths), self.destination)
+
+    def __repr__(self):
+        return '<Transfer> Host:{host} | Files:{files} | Bytes:{done}/{total} | Status:{status}'.format(
+            host=self.host,
+            files=len(self.files),
+            done=self.bytesDone,
+            total=self.bytesTotal,
+            status=self._state)
+
+    def _addBytes(self, count):
+        with self._lock:
+            self.bytesDone += count
+            now = time.time()
+            self._samples.append((now, self.bytesDone))
+            while len(self._samples) > 2 and now - self._samples[0][0] > Transfer.RATE_WINDOW:
+                self._samples.popleft()
+
+    def _setState(self, state):
+        self._state = state
+        if state == 'l':
+            self.started = time.time()
+        elif state in ('c', 'e', 'x'):
+            self.finished = time.time()
+
+    @property
+    def state(self):
+        return Transfer.STATE[self._state]
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def progress(self):
+        if not self.bytesTotal:
+            return 100.0 if self.completed() else 0.0
+        return 100.0 * self.bytesDone / self.bytesTotal
+
+    @property
+    def rate(self):
+        """
+        Bytes per second over the last RATE_WINDOW seconds
+        """
+        with self._lock:
+            if self.completed() or len(self._samples) < 2:
+                return 0.0
+            (first, firstBytes), (last, lastBytes) = self._samples[0], self._samples[-1]
+        # Count the time since the last chunk too, so a stalled copy drops to zero
+        elapsed = time.time() - first
+        if elapsed <= 0:
+            return 0.0
+        return (lastBytes - firstBytes) / elapsed
+
+    @property
+    def eta(self):
+        """
+        Seconds left at the current rate, None if it can't be worked out yet
+        """
+        rate = self.rate
+        if self.bytesTotal is None or not rate:
+            return None
+        return max(0.0, (self.bytesTotal - self.bytesDone) / rate)
+
+    def completed(self):
+        return self._state in ('c', 'e', 'x')
+
+class TransferManager:
+    # Most streams running at once in total, and per host
+    MAX_STREAMS = 8
+    STREAMS_PER_HOST = 3
+    READ_SIZE = 64 * 1024
+    CONNECT_TIMEOUT = 5
+
+    CONTROL_PATH = '~/.rendermanager/ssh-%r@%h:%p'
+    CONTROL_PERSIST = 60
+
+    def __init__(self, maxStreams=MAX_STREAMS, streamsPerHost=STREAMS_PER_HOST, limit=None, compress=True, logger=None):
+        """
+        limit    : Most Kbit/s per stream (like scp -l), None for no limit
+        compress : Compress the ssh streams, worth it for uncompressed image formats
+        """
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.streamsPerHost = streamsPerHost
+        self.limit = limit
+        self.compress = compress
+
+        controlDir = os.path.dirname(os.path.expanduser(TransferManager.CONTROL_PATH))
+        if not os.path.exists(controlDir):
+            os.makedirs(controlDir)
+
+        self._transfers = []
+        # Work waiting for a stream, (transfer, RemoteFile), the file is None for a listing
+        self._pending = deque()
+        # Destination directory -> Manifest
+        self._manifests = {}
+        self._active = {}
+        self._procs = {}
+        self._stopped = False
+        self._cond = threading.Condition()
+
+        self._workers = []
+        for i in range(maxStreams):
+            worker = threading.Thread(target=self.__work, name='Transfer-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, host, paths, destination, user=None, match=None, verify=False):
+        """
+        Queues a copy of paths on host into the local destination directory, returns the Transfer
+        """
+        transfer = Transfer(host, paths, destination, user, match, verify)
+        self.logger.info('Queueing transfer %s' % str(transfer))
+        with self._cond:
+            self._transfers.append(transfer)
+            self._pending.append((transfer, None))
+            self._cond.notify_all()
+        return transfer
+
+    def cancel(self, transfer):
+        with self._cond:
+            if transfer.completed():
+                return
+            self.logger.info('Cancelling transfer %s' % str(transfer))
+            transfer._cancelled = True
+            transfer._setState('x')
+            procs = [ proc for proc, owner in self._procs.items() if owner is transfer ]
+            self._cond.notify_all()
+
+        for proc in procs:
+            self.__terminate(proc)
+
+        self.manifest(transfer.destination).save()
+
+    def transfers(self):
+        with self._cond:
+            return list(self._transfers)
+
+    def forget(self, transfer):
+        """
+        Drops a finished transfer from the list
+        """
+        with self._cond:
+            if transfer.completed() and transfer in self._transfers:
+                self._transfers.remove(transfer)
+
+    def manifest(self, destination):
+        with self._cond:
+            manifest = self._manifests.get(destination)
+            if manifest is None:
+                manifest = self._manifests[destination] = Manifest(destination, self.logger)
+            return manifest
+
+    def stop(self):
+        for transfer in self.transfers():
+            self.cancel(transfer)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def listFiles(self, host, paths, user=None, verify=False, match=None):
+        """
+        Lists the files matching paths on host, returns a list of RemoteFile.
+        Blocks until the listing comes back, raises IOError if it fails
+        """
+        proc = subprocess.Popen(self._sshCommand(host, user, TransferManager._listCommand(paths, verify)),
+                                stdin=open(os.devnull),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                close_fds=True)
+        stdout, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise IOError('Listing failed (%d) : %s' % (proc.returncode, stderr.strip()))
+        return TransferManager._parseListing(stdout, verify, match)
+
+    @staticmethod
+    def _listCommand(paths, verify):
+        """
+        Prints 'size mtime [md5] path' for each file, the globs are left for 
+        the remote shell so only spaces need escaping
+        """
+        patterns = ' '.join( path.replace(' ', r'\ ') for path in paths )
+        if verify:
+            details = "printf '%s %s %s %s\\n' $(stat -c '%s %Y' -- \"$f\") $(md5sum < \"$f\" | cut -c1-32) \"$f\""
+        else:
+            details = "stat -c '%s %Y %n' -- \"$f\""
+        return 'for f in %s; do [ -f "$f" ] && %s; done; true' % (patterns, details)
+
+    @staticmethod
+    def _parseListing(output, verify, match=None):
+        """
+        A RemoteFile per file listed, a file matched by more than one of the 
+        patterns is only listed once
+        """
+        fields = 4 if verify else 3
+        found = []
+        seen = set()
+        for line in output.splitlines():
+            parts = line.split(' ', fields - 1)
+            if len(parts) != fields or not parts[0].isdigit() or not parts[1].isdigit():
+                continue
+            remote = RemoteFile(path=parts[-1],
+                                size=int(parts[0]),
+                                mtime=int(parts[1]),
+                                checksum=parts[2] if verify else None)
+            if remote.path in seen:
+                continue
+            seen.add(remote.path)
+            if match is None or match(remote.path):
+                found.append(remote)
+        return found
+
+    def _sshCommand(self, host, user, command):
+        options = ['-o', 'BatchMode=yes',
+                   '-o', 'ConnectTimeout=%d' % TransferManager.CONNECT_TIMEOUT,
+                   '-o', 'ControlMaster=auto',
+                   '-o', 'ControlPath=%s' % TransferManager.CONTROL_PATH,
+                   '-o', 'ControlPersist=%d' % TransferManager.CONTROL_PERSIST]
+        if self.compress:
+            options.append('-C')
+        target = '%s@%s' % (user, host) if user else host
+        return ['ssh'] + options + [target, command]
+
+    def __next(self):
+        """
+        Waits for the first piece of work whose host has a free stream, None once stopped
+        """
+        with self._cond:
+            while not self._stopped:
+                for item in list(self._pending):
+                    transfer = item[0]
+                    if transfer.cancelled:
+                        self._pending.remove(item)
+                        continue
+                    if self._active.get(transfer.host, 0) < self.streamsPerHost:
+                        self._pending.remove(item)
+                        self._active[transfer.host] = self._active.get(transfer.host, 0) + 1
+                        return item
+                self._cond.wait()
+            return None
+
+    def __work(self):
+        while True:
+            item = self.__next()
+            if item is None:
+                return
+
+            transfer, remote = item
+            try:
+                if remote is None:
+                    self.__list(transfer)
+                else:
+                    self.__copy(transfer, remote)
+            except Exception, e:
+                self.logger.error('Error in transfer %s : %s' % (repr(transfer), e), exc_info=sys.exc_info())
+                with self._cond:
+                    if not transfer.completed():
+                        transfer.error = str(e)
+                        transfer._setState('e')
+
+            with self._cond:
+                self._active[transfer.host] -= 1
+                self._cond.notify_all()
+
+    def __run(self, transfer, command, stdout):
+        """
+        Starts an ssh command for the transfer, tracked so cancel() can stop it
+        """
+        proc = subprocess.Popen(self._sshCommand(transfer.host, transfer.user, command),
+                                stdin=open(os.devnull),
+                                stdout=stdout,
+                                stderr=subprocess.PIPE,
+                                close_fds=True)
+        with self._cond:
+            self._procs[proc] = transfer
+        return proc
+
+    def __finish(self, proc):
+        with self._cond:
+            self._procs.pop(proc, None)
+
+    def __terminate(self, proc):
+        try:
+            if proc.poll() is None:
+                proc.terminate()
+        except OSError:
+            pass
+
+    def __list(self, transfer):
+        transfer._setState('l')
+
+        proc = self.__run(transfer, TransferManager._listCommand(transfer.paths, transfer.verify), subprocess.PIPE)
+        try:
+            stdout, stderr = proc.communicate()
+        finally:
+            self.__finish(proc)
+
+        if transfer.cancelled:
+            return
+
+        if proc.returncode != 0:
+            raise IOError('Listing failed (%d) : %s' % (proc.returncode, stderr.strip()))
+
+        found = TransferManager._parseListing(stdout, transfer.verify, transfer.match)
+
+        if not found:
+            transfer.error = 'No files matched'
+            transfer._setState('e')
+            self.logger.error('Transfer %s : no files matched' % str(transfer))
+            return
+
+        if not os.path.exists(transfer.destination):
+            os.makedirs(transfer.destination)
+
+        manifest = self.manifest(transfer.destination)
+
+        with self._cond:
+            if transfer.cancelled:
+                return
+
+            transfer.skipped = [ remote for remote in found if manifest.upToDate(remote) ]
+            transfer.files = [ remote for remote in found if remote not in transfer.skipped ]
+            transfer.bytesTotal = sum(remote.size for remote in transfer.files)
+            transfer._remaining = len(transfer.files)
+
+            self.logger.info('Transfer %s : %d files, %d bytes (%d files up to date)' % (
+                str(transfer), len(transfer.files), transfer.bytesTotal, len(transfer.skipped)))
+
+            if not transfer.files:
+                transfer._setState('c')
+                return
+
+            transfer._setState('t')
+            for remote in transfer.files:
+                self._pending.append((transfer, remote))
+            self._cond.notify_all()
+
+    def __copy(self, transfer, remote):
+        path, size = remote.path, remote.size
+        target = os.path.join(transfer.destination, os.path.basename(path))
+        partial = target + '.part'
+        copied = 0
+        started = time.time()
+        md5 = hashlib.md5()
+
+        proc = self.__run(transfer, 'cat -- %s' % pipes.quote(path), subprocess.PIPE)
+        try:
+            with open(partial, 'wb') as f:
+                while True:
+                    data = proc.stdout.read(TransferManager.READ_SIZE) if not transfer.cancelled else ''
+                    if not data:
+                        break
+                    f.write(data)
+                    md5.update(data)
+                    copied += len(data)
+                    transfer._addBytes(len(data))
+
+                    if self.limit:
+                        # Sleep off anything over the limit (Kbit/s)
+                        ahead = copied * 8 / (self.limit * 1000.0) - (time.time() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+
+            stderr = proc.stderr.read()
+            proc.wait()
+        finally:
+            if transfer.cancelled:
+                self.__terminate(proc)
+            self.__finish(proc)
+
+        ok = not transfer.cancelled and proc.returncode == 0 and copied == size
+        if ok and remote.checksum and remote.checksum != md5.hexdigest():
+            ok = False
+            stderr = 'checksum mismatch'
+
+        if ok:
+            os.rename(partial, target)
+            self.manifest(transfer.destination).record(remote, md5.hexdigest())
+        else:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            if not transfer.cancelled:
+                self.logger.error('Transfer %s : copying %s failed (%s, %d/%d bytes) %s' % (
+                    str(transfer), path, proc.returncode, copied, size, stderr.strip()))
+
+        with self._cond:
+            if not ok:
+                transfer.failed.append(path)
+
+            transfer._remaining -= 1
+            if transfer._remaining == 0 and not transfer.completed():
+                if transfer.failed:
+                    transfer.error = '%d files failed' % len(transfer.failed)
+                    transfer._setState('e')
+                else:
+                    transfer._setState('c')
+                self.logger.info('Transfer %s done in %.1fs' % (str(transfer), transfer.finished - transfer.started))
+                finished = True
+            else:
+                finished = False
+
+        if finished:
+            self.manifest(transfer.destination).save()
+
+class FrameCollector:
+    """
+    Copies every frame of a job into destination as soon as it has rendered, 
+    pass one as the job's onFrame
+    """
+
+    def __init__(self, manager, destination, logger=None):
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.manager = manager
+        self.destination = destination
+
+    def __call__(self, job, frame):
+        prefix = job.outputPrefix
+        pattern = os.path.join(job.outputPath, '%s*%d*' % (prefix, frame))
+        self.logger.debug('Collecting frame %d of %s' % (frame, repr(job)))
+        self.manager.submit(job.host, [pattern], self.destination, job.sessionUser,
+                            match=frameMatch(prefix, frame))
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+import os
+import re
+import time
+import logging
+
+"""
+Reads a maya project's workspace.mel, for where the project keeps its
+images, scenes, textures...
+
+Every 'workspace -fr' (file rule) in the file is read into a table of rule
+name -> absolute path, resolved once when the file is read: relative paths
+are taken from the project root (the workspace file's directory), an empty
+rule is the root itself, and Windows paths ('D:\images', 'D:/images') are
+mapped onto a local mount through driveMap. Looking a rule up is then just a
+dict lookup.
+
+The table is kept against the file's mtime, refresh() (every INTERVAL
+seconds, see due()) reads the file again only if it has changed.
+"""
+
+class Workspace:
+    INTERVAL = 30.0
+
+    STRING = r'"((?:[^"\\]|\\.)*)"'
+    RULE_RE = re.compile(r'\bworkspace\s+-(?:fr|fileRule)\s+%s\s+%s' % (STRING, STRING))
+    DRIVE_RE = re.compile(r'^([A-Za-z]):[\\/]?')
+
+    def __init__(self, path, driveMap=None, interval=INTERVAL, logger=None):
+        """
+        driveMap : Windows drive letter -> where that drive is mounted here,
+                   paths on unmapped drives are taken from the project root
+        Raises IOError if the file can't be read
+        """
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.root = os.path.dirname(self.path)
+        self.interval = interval
+        self.driveMap = dict( (drive.rstrip(':').upper(), mount) for drive, mount in (driveMap or {}).iteritems() )
+
+        self._mtime = None
+        self._rules = {}
+        self._lastRefresh = 0.0
+
+        if not self.refresh():
+            raise IOError('Cannot read workspace file %s' % self.path)
+
+    def fileRule(self, name, default=None):
+        """
+        Absolute path of the rule called name ('images', 'scene', 'sourceImages'...)
+        """
+        return self._rules.get(name, default)
+
+    def fileRules(self):
+        return dict(self._rules)
+
+    def due(self):
+        return time.time() - self._lastRefresh >= self.interval
+
+    def refresh(self):
+        """
+        Reads the file again if it has changed since it was last read, returns
+        whether the table is up to date. If the file can't be read the old
+        table is kept
+        """
+        self._lastRefresh = time.time()
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return True
+
+            with open(self.path) as f:
+                text = f.read()
+        except (IOError, OSError), e:
+            self.logger.error('Cannot read workspace file %s : %s' % (self.path, e))
+            return False
+
+        self._rules = self.__parse(text)
+        self._mtime = mtime
+        self.logger.info('Read %d file rules from %s' % (len(self._rules), self.path))
+        return True
+
+    def resolve(self, path):
+        """
+        Absolute local path of a path as written in the workspace file
+        """
+        drive = Workspace.DRIVE_RE.match(path)
+        path = path.replace('\\', '/')
+
+        if drive:
+            letter = drive.group(1).upper()
+            path = path[drive.end():]
+            if letter in self.driveMap:
+                return os.path.normpath(os.path.join(self.driveMap[letter], path))
+            self.logger.warning('No mount given for drive %s:, taking %s from the project root' % (letter, path))
+
+        path = os.path.expanduser(path)
+        return os.path.normpath(os.path.join(self.root, path))
+
+    def __parse(self, text):
+        # Skip commented out rules
+        text = '\n'.join( line for line in text.splitlines() if not line.lstrip().startswith('//') )
+
+        rules = {}
+        for match in Workspace.RULE_RE.finditer(text):
+            name, path = [ Workspace.__unescape(value) for value in match.groups() ]
+            rules[name] = self.resolve(path)
+        return rules
+
+    @staticmethod
+    def __unescape(value):
+        # Only \\ and \" are escapes, anything else is kept as is ('D:\images')
+        return re.sub(r'\\([\\"])', r'\1', value)